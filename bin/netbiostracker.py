@@ -37,7 +37,7 @@ def main():
     _logger.info('=== Starting netbiostracker ===')
 
     addresses = tracker.get_addresses_to_scan(config.get_exceptions())
-    scanresult = tracker.scan(addresses)
+    scanresult = tracker.scan(addresses, config.get_workers())
     parsed_results = tracker.parse(scanresult, config.get_encoding())
     tracker.update_database(parsed_results)
 
@@ -30,15 +30,19 @@ from nav import daemon
 import nav.buildconf
 from nav.snmptrapd.plugin import load_handler_modules, ModuleLoadError
 from nav.util import is_valid_ip, address_to_string
-from nav.db import getConnection
+from nav.db import getConnection, closeConnections
 import nav.logs
 
-from nav.snmptrapd import agent
+from nav.snmptrapd import agent, lookup
+from nav.snmptrapd.dispatch import (TrapDispatcher, TrapPriorities,
+                                    handle_batch)
+from nav.event import EventBatch
 
 # Paths
 configfile = nav.buildconf.sysconfdir + "/snmptrapd.conf"
 traplogfile = nav.buildconf.localstatedir + "/log/snmptraps.log"
 logfile = nav.buildconf.localstatedir + "/log/snmptrapd.log"
+dispatcher = None
 
 
 DEFAULT_PORT = 162
@@ -167,20 +171,16 @@ def main():
         nav.logs.reopen_log_files()
         logger.debug('Daemonization complete; reopened log files.')
 
-        # Reopen lost db connection
-        # This is a workaround for a double free bug in psycopg 2.0.7
-        # which is why we don't need to keep the return value
-        getConnection('default')
-
         # Reopen log files on SIGHUP
         logger.debug('Adding signal handler for reopening log files on SIGHUP.')
         signal.signal(signal.SIGHUP, signal_handler)
         # Exit on SIGTERM
         signal.signal(signal.SIGTERM, signal_handler)
 
+        start_dispatcher()
         logger.info("Snmptrapd started, listening on %s", addresses_text)
         try:
-            server.listen(opts.community, trapHandler)
+            server.listen(opts.community, dispatcher.receive)
         except SystemExit:
             raise
         except Exception, why:
@@ -188,14 +188,39 @@ def main():
 
     else:
         # Start listening and exit cleanly if interrupted.
+        start_dispatcher()
         try:
             logger.info ("Listening on %s", addresses_text)
-            server.listen(opts.community, trapHandler)
+            server.listen(opts.community, dispatcher.receive)
         except KeyboardInterrupt, why:
             logger.error("Received keyboardinterrupt, exiting.")
+            dispatcher.log_stats()
             server.close()
 
 
+def start_dispatcher():
+    """Starts the pool of trap handler worker processes"""
+    global dispatcher
+
+    # The worker processes must open their own database connections
+    closeConnections()
+
+    def _getopt(option, default):
+        if config.has_option('snmptrapd', option):
+            return config.get('snmptrapd', option)
+        return default
+
+    priorities = TrapPriorities(
+        high=_getopt('highpriority', '').split(','),
+        low=_getopt('lowpriority', '').split(','))
+    dispatcher = TrapDispatcher(trapHandler,
+                                workers=int(_getopt('workers', 2)),
+                                queue_size=int(_getopt('queuesize', 10000)),
+                                priorities=priorities,
+                                batch_handler=handle_trap_batch)
+    dispatcher.start()
+
+
 def parse_args():
     usage = "usage: %prog [options] [address1 [address2 ...]]"
     parser = OptionParser(
@@ -267,7 +292,12 @@ def loginitfile(logfile, traplogfile, loglevel):
 
 
 def trapHandler(trap):
-    """Handle a trap"""
+    """Handle a trap.
+
+    This is called from the trap handler worker processes, not from the
+    process that receives the traps.
+
+    """
 
     traplogger.info(trap.trapText())
     connection = getConnection('default')
@@ -287,6 +317,21 @@ def trapHandler(trap):
         connection.rollback()
 
 
+def handle_trap_batch(handler, traps):
+    """Handles a batch of traps, posting all the events generated by the
+    handler modules as a single batch.
+
+    """
+    batch = EventBatch()
+    try:
+        with batch:
+            handle_batch(handler, traps)
+    except Exception:
+        logger.exception("Error posting a batch of %d events, posting them "
+                         "one by one", len(batch))
+        batch.post_individually()
+
+
 def verifySubsystem ():
     """Verify that subsystem exists, if not insert it into database"""
     db = getConnection('default')
@@ -299,14 +344,23 @@ def verifySubsystem ():
 
 
 def signal_handler(signum, _):
-    """Signal handler to close and reopen log file(s) on HUP and exit on TERM."""
+    """Signal handler to close and reopen log file(s) and clear the lookup
+    cache on HUP, and exit on TERM.
+
+    """
     if signum == signal.SIGHUP:
         logger.info("SIGHUP received; reopening log files.")
         nav.logs.reopen_log_files()
         daemon.redirect_std_fds(stderr=nav.logs.get_logfile_from_logger())
-        logger.info("Log files reopened.")
+        lookup.clear()
+        logger.info("Log files reopened, lookup cache cleared.")
+        if dispatcher and dispatcher.in_receiver():
+            dispatcher.log_stats()
+            dispatcher.signal_workers(signum)
     elif signum == signal.SIGTERM:
         logger.warn('SIGTERM received: Shutting down.')
+        if dispatcher and dispatcher.in_receiver():
+            dispatcher.log_stats()
         sys.exit(0)
 
 if __name__ == '__main__':
@@ -14,86 +14,250 @@
 # more details.  You should have received a copy of the GNU General Public
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""Counts active ip-addresses in a prefix and stores the data in rrd-files"""
+"""Counts active ip-addresses in a prefix and stores the data in rrd-files
 
+The current counts are collected incrementally: Only the prefixes that
+contain addresses whose arp records have started or ended since the last
+collection, and prefixes that weren't counted last time, are counted again.
+The counts of all other prefixes are read from the prefix_usage table, which
+is rewritten after each collection.
+
+Historic data is collected in a single sweep over the arp records of each
+prefix, sorted by their start and end times.
+
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
 import logging
 import time
 
 from nav.models.manage import Netbox  # Needed!
-from django.db import connection
+from django.db import connection, transaction
 
 LOG = logging.getLogger(__name__)
 
+INTERVAL = timedelta(minutes=30)
+
+# A full collection is made if the last one is older than this
+MAX_INCREMENTAL_AGE = timedelta(days=1)
+# arp records may be committed a while after their start or end times were
+# set, so changes this long before the last collection are also considered
+CHANGE_MARGIN = timedelta(minutes=15)
+
+FETCH_SIZE = 10000
+
+PREFIXES = """
+FROM vlan
+JOIN prefix USING (vlanid)
+LEFT JOIN arp ON (ip << netaddr AND arp.end_time = 'infinity')
+WHERE vlan.nettype NOT IN ('loopback')
+"""
+
+CHANGED_PREFIXES_QUERY = """
+SELECT netaddr
+FROM vlan
+JOIN prefix USING (vlanid)
+JOIN (
+  SELECT DISTINCT ip
+  FROM arp
+  WHERE start_time >= %(since)s
+        OR (end_time >= %(since)s AND end_time < 'infinity')
+) AS changed ON (ip << netaddr)
+WHERE vlan.nettype NOT IN ('loopback')
+UNION
+SELECT netaddr
+FROM vlan
+JOIN prefix USING (vlanid)
+WHERE vlan.nettype NOT IN ('loopback')
+  AND netaddr NOT IN (SELECT netaddr FROM prefix_usage)
+"""
+
+CACHED_COUNTS_QUERY = """
+SELECT netaddr, active_addresses, active_macs
+FROM prefix_usage
+JOIN prefix USING (netaddr)
+JOIN vlan USING (vlanid)
+WHERE vlan.nettype NOT IN ('loopback')
+"""
+
+HISTORY_QUERY = """
+SELECT netaddr, ip, mac, start_time, NULLIF(end_time, 'infinity')
+FROM vlan
+JOIN prefix USING (vlanid)
+JOIN arp ON (ip << netaddr)
+WHERE vlan.nettype NOT IN ('loopback')
+  AND end_time >= %s
+  AND start_time <= %s
+ORDER BY netaddr
+"""
+
 
 def collect(days=None):
     """Collect data from database
 
-    Use either a quick query for updates only, or a slow one for walking
-    through historic data.
-    """
+    Collect either the current counts incrementally, or walk through
+    historic data for the given number of days.
 
-    starttime = time.time()
-    intervals = get_intervals(days) if days else 0
+    :returns: A list of (netaddr, timeentry, ipcount, maccount) tuples.
 
-    if intervals:
+    """
+    starttime = time.time()
+    if days:
+        intervals = get_intervals(days)
         LOG.debug('Collecting %s intervals' % intervals)
-        query = get_interval_query(intervals)
+        result = collect_history(intervals)
     else:
-        query = get_static_query()
+        result = collect_current()
 
-    LOG.debug(query)
+    LOG.debug('Collected %s rows in %.2f seconds', len(result),
+              time.time() - starttime)
+    return result
 
+
+def collect_current():
+    """Collects the current number of active addresses of all prefixes,
+    only counting the prefixes that have changed since the last collection
+    if possible.
+
+    """
     cursor = connection.cursor()
-    cursor.execute(query)
+    cursor.execute("SELECT LOCALTIMESTAMP, MAX(updated) FROM prefix_usage")
+    now, last_run = cursor.fetchone()
+
+    if not last_run or now - last_run > MAX_INCREMENTAL_AGE:
+        LOG.debug('Counting all prefixes')
+        return [(netaddr, now, ipcount, maccount)
+                for netaddr, ipcount, maccount in count_prefixes()]
+
+    cursor.execute(CHANGED_PREFIXES_QUERY,
+                   {'since': last_run - CHANGE_MARGIN})
+    changed = [netaddr for netaddr, in cursor.fetchall()]
+    LOG.debug('Counting %s prefixes changed since %s', len(changed),
+              last_run)
+
+    cursor.execute(CACHED_COUNTS_QUERY)
+    counts = dict((netaddr, (ipcount, maccount))
+                  for netaddr, ipcount, maccount in cursor.fetchall())
+    if changed:
+        counts.update((netaddr, (ipcount, maccount))
+                      for netaddr, ipcount, maccount
+                      in count_prefixes(changed))
+
+    return [(netaddr, now, ipcount, maccount)
+            for netaddr, (ipcount, maccount) in counts.iteritems()]
+
 
-    LOG.debug('Query executed in %.2f seconds' % (time.time() - starttime))
+def count_prefixes(prefixes=None):
+    """Counts the active addresses of prefixes, or of all prefixes.
 
+    :returns: A list of (netaddr, ipcount, maccount) tuples.
+
+    """
+    query = ("SELECT netaddr, COUNT(DISTINCT ip), COUNT(DISTINCT mac)"
+             + PREFIXES)
+    params = []
+    if prefixes is not None:
+        query += " AND netaddr = ANY(%s::cidr[])"
+        params.append(list(prefixes))
+    query += " GROUP BY netaddr"
+
+    cursor = connection.cursor()
+    cursor.execute(query, params)
     return cursor.fetchall()
 
 
-def get_interval_query(intervals):
-    """Return query for collecting data for a time interval"""
-
-    query = """
-    SELECT
-        netaddr,
-        timeentry,
-        COUNT(DISTINCT ip) AS ipcount,
-        COUNT(DISTINCT mac) AS maccount
-    FROM vlan
-    JOIN prefix USING (vlanid)
-    CROSS JOIN (
-        SELECT
-            now() - generate_series(0,%s) * INTERVAL '30 minutes' AS timeentry)
-        AS series
-    LEFT JOIN arp ON (
-        ip << netaddr AND
-        (timeentry >= start_time AND timeentry <= end_time))
-    WHERE vlan.nettype NOT IN ('loopback') AND ip IS NOT NULL
-    GROUP BY netaddr, timeentry
-    ORDER BY timeentry
-    """ % intervals
-
-    return query
-
-
-def get_static_query():
-    """Return for query for doing a static collection"""
-    query = """
-    SELECT
-        netaddr,
-        now() AS timeentry,
-        COUNT(DISTINCT ip) AS ipcount,
-        COUNT(DISTINCT mac) AS maccount
-    FROM vlan
-    JOIN prefix USING (vlanid)
-    LEFT JOIN arp ON (ip << netaddr AND arp.end_time = 'infinity')
-    WHERE vlan.nettype NOT IN ('loopback')
-    GROUP BY netaddr, timeentry
-    ORDER BY timeentry
+def collect_history(intervals, now=None):
+    """Collects the number of active addresses of all prefixes at 30 minute
+    intervals back in time.
+
+    :param intervals: The number of intervals to go back in time.
+    :returns: A list of (netaddr, timeentry, ipcount, maccount) tuples.
+
     """
+    now = now or datetime.now()
+    timeentries = [now - step * INTERVAL
+                   for step in range(intervals, -1, -1)]
 
-    return query
+    connection.cursor()  # ensures the connection is open
+    cursor = connection.connection.cursor('active_ip_history')
+    cursor.itersize = FETCH_SIZE
+    result = []
+    try:
+        cursor.execute(HISTORY_QUERY, (timeentries[0], timeentries[-1]))
+        for netaddr, records in groupby(cursor, itemgetter(0)):
+            records = [record[1:] for record in records]
+            result.extend((netaddr, timeentry, ipcount, maccount)
+                          for timeentry, ipcount, maccount
+                          in count_active(records, timeentries)
+                          if ipcount)
+    finally:
+        cursor.close()
+    return result
+
+
+def count_active(records, timeentries):
+    """Counts the distinct addresses that were active at each point in time,
+    by sweeping over arp records sorted by their start and end times.
+
+    :param records: A list of (ip, mac, start_time, end_time) tuples. An
+                    end_time of None means the record is still active.
+    :param timeentries: A sorted list of datetime objects.
+    :returns: A list of (timeentry, ipcount, maccount) tuples.
+
+    """
+    starts = sorted(records, key=itemgetter(2))
+    ends = sorted((record for record in records if record[3] is not None),
+                  key=itemgetter(3))
+    ips = defaultdict(int)
+    macs = defaultdict(int)
+    started = ended = 0
+    result = []
+
+    for timeentry in timeentries:
+        while started < len(starts) and starts[started][2] <= timeentry:
+            ip, mac = starts[started][:2]
+            ips[ip] += 1
+            macs[mac] += 1
+            started += 1
+        # a record that ended before timeentry also started before it
+        while ended < len(ends) and ends[ended][3] < timeentry:
+            ip, mac = ends[ended][:2]
+            _decrement(ips, ip)
+            _decrement(macs, mac)
+            ended += 1
+        result.append((timeentry, len(ips), len(macs)))
+
+    return result
+
+
+def _decrement(counts, key):
+    counts[key] -= 1
+    if not counts[key]:
+        del counts[key]
+
+
+def update_usage_cache(data):
+    """Replaces the contents of the prefix_usage cache table with the current
+    active address counts from a collection.
+
+    :param data: The rows returned by a collection of current counts.
+
+    """
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM prefix_usage")
+    if data:
+        values = ",".join(
+            cursor.mogrify("(%s, %s, %s, %s)",
+                           (netaddr, ipcount, maccount, timeentry))
+            for netaddr, timeentry, ipcount, maccount in data)
+        cursor.execute("INSERT INTO prefix_usage "
+                       "(netaddr, active_addresses, active_macs, updated) "
+                       "VALUES " + values)
+    transaction.commit_unless_managed()
+    LOG.debug('Updated usage cache for %s prefixes', len(data))
 
 
 def get_intervals(days):
@@ -26,36 +26,47 @@ from nav.metrics.templates import metric_path_for_prefix
 
 LOG = logging.getLogger(__name__)
 DATABASE_CATEGORY = 'activeip'
+# The max number of metrics sent to carbon in one go, and the number of
+# seconds to pause between each such batch
+METRICS_PER_BATCH = 1500
+BATCH_INTERVAL = 1
 
 
 def run(days=None):
     """Fetch and store active ip"""
-    return store(collector.collect(days))
+    data = collector.collect(days)
+    if not days:
+        collector.update_usage_cache(data)
+    return store(data)
 
 
 def store(data):
     """Store data in rrd-files and update rrd-database
 
-    :param data: a cursor.fetchall object containing all database rows we
-    are to store
+    The metrics are sent in slices of at most METRICS_PER_BATCH metrics,
+    which send_metrics packs into as few packets as possible, with a pause of
+    BATCH_INTERVAL seconds between slices.  Carbon has been seen to drop
+    packets when sent large bursts of updates, such as during a backfill.
 
-    """
+    :param data: a list of (prefix, timeentry, ip_count, mac_count) tuples
 
-    # Suspecting package drop - dividing into chunks and giving some
-    # breathing room for each batch of updates.
-    chunks = [data[x:x+100] for x in xrange(0, len(data), 100)]
-    for chunk in chunks:
-        for db_tuple in chunk:
-            store_tuple(db_tuple)
-        time.sleep(2)
+    """
+    metrics = []
+    for db_tuple in data:
+        metrics.extend(get_metrics(db_tuple))
+    for index in xrange(0, len(metrics), METRICS_PER_BATCH):
+        if index:
+            time.sleep(BATCH_INTERVAL)
+        send_metrics(metrics[index:index + METRICS_PER_BATCH])
 
     LOG.info('Sent %s updates', len(data))
 
 
-def store_tuple(db_tuple):
-    """Sends data to whisper with correct metric path
+def get_metrics(db_tuple):
+    """Returns the metrics for a row of collected data, with correct metric
+    paths
 
-    :param db_tuple: a row from a rrd_fetchall object
+    :param db_tuple: a (prefix, timeentry, ip_count, mac_count) tuple
 
     """
     prefix, when, ip_count, mac_count = db_tuple
@@ -63,13 +74,11 @@ def store_tuple(db_tuple):
 
     when = get_timestamp(when)
 
-    metrics = [
+    return [
         (metric_path_for_prefix(prefix, 'ip_count'), (when, ip_count)),
         (metric_path_for_prefix(prefix, 'mac_count'), (when, mac_count)),
         (metric_path_for_prefix(prefix, 'ip_range'), (when, ip_range))
     ]
-    LOG.debug(metrics)
-    send_metrics(metrics)
 
 
 def find_range(prefix):
@@ -20,14 +20,16 @@
 
 import gc
 import logging
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
 
-from django.db import transaction, reset_queries
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction, reset_queries
 from django.utils.functional import memoize
 
 from nav.models.profiles import (Account, AccountAlertQueue, AlertSubscription,
-                                 AlertAddress, FilterGroup, AlertPreference,
-                                 TimePeriod)
+                                 AlertAddress, AlertSender, FilterGroup,
+                                 AlertPreference, TimePeriod)
 from nav.models.event import AlertQueue
 
 
@@ -68,9 +70,12 @@ def check_alerts(debug=False):
     logger.debug('Checking %d queued alerts' % len(queued_alerts))
 
     if len(queued_alerts):
-        (sent_daily, sent_weekly, num_sent_alerts, num_failed_sends,
-         num_resolved_alerts_ignored) = handle_queued_alerts(queued_alerts,
-                                                             now)
+        try:
+            (sent_daily, sent_weekly, num_sent_alerts, num_failed_sends,
+             num_resolved_alerts_ignored) = handle_queued_alerts(queued_alerts,
+                                                                 now)
+        finally:
+            AlertSender.close_handlers()
     else:
         (sent_daily, sent_weekly, num_sent_alerts, num_failed_sends,
          num_resolved_alerts_ignored) = [], [], 0, 0, 0
@@ -126,52 +131,7 @@ def handle_new_alerts(new_alerts):
     memoized_check_alert = memoize(check_alert_against_filtergroupcontents, {},
                                    2)
     logger = logging.getLogger('nav.alertengine.handle_new_alerts')
-    accounts = []
-
-    def subscription_sort_key(subscription):
-        """Return a key to sort alertsubscriptions in a prioritized order."""
-        sort_order = [
-            AlertSubscription.NOW,
-            AlertSubscription.NEXT,
-            AlertSubscription.DAILY,
-            AlertSubscription.WEEKLY,
-            ]
-        try:
-            return sort_order.index(subscription.type)
-        except ValueError:
-            return subscription.type
-
-    # Build datastructure that contains accounts and corresponding
-    # filtergroupcontent_set so that we don't redo db queries to much
-    for account in Account.objects.filter(
-            alertpreference__active_profile__isnull=False):
-        time_period = account.get_active_profile().get_active_timeperiod()
-
-        if not time_period:
-            continue
-
-        current_alertsubscriptions = sorted(
-            time_period.alertsubscription_set.all(),
-            key=subscription_sort_key)
-
-        tmp = []
-        for alertsubscription in current_alertsubscriptions:
-            tmp.append(
-                (alertsubscription,
-                 alertsubscription.filter_group.filtergroupcontent_set.all()))
-
-        if tmp:
-            permissions = []
-            for filtergroup in FilterGroup.objects.filter(
-                    group_permissions__accounts__in=[account]):
-                permissions.append(filtergroup.filtergroupcontent_set.all())
-
-            accounts.append( (account, tmp, permissions) )
-            del permissions
-
-        del tmp
-        del current_alertsubscriptions
-        del account
+    accounts = _snapshot.get_accounts()
 
     # Remember which alerts are sent where to avoid duplicates
     dupemap = set()
@@ -193,6 +153,132 @@ def handle_new_alerts(new_alerts):
     gc.collect()
 
 
+def subscription_sort_key(subscription):
+    """Return a key to sort alertsubscriptions in a prioritized order."""
+    sort_order = [
+        AlertSubscription.NOW,
+        AlertSubscription.NEXT,
+        AlertSubscription.DAILY,
+        AlertSubscription.WEEKLY,
+        ]
+    try:
+        return sort_order.index(subscription.type)
+    except ValueError:
+        return subscription.type
+
+
+class SubscriptionSnapshot(object):
+    """An in-memory snapshot of all accounts with active alert profiles, their
+    currently active alert subscriptions and their permission filter groups.
+
+    The snapshot is rebuilt only when the alert profile tables have been
+    changed (as told by the version counter maintained by database triggers),
+    or when a time period boundary has been crossed and a different set of
+    time periods may be active.
+
+    """
+    VERSION_SQL = ("SELECT last_value, is_called "
+                   "FROM profiles.alertprofiles_version_seq")
+
+    def __init__(self):
+        self.accounts = []
+        self.version = None
+        self.valid_until = None
+        self._logger = logging.getLogger(
+            'nav.alertengine.subscriptionsnapshot')
+
+    def get_accounts(self, now=None):
+        """Returns a list of (account, subscriptions, permissions) tuples,
+        rebuilding the snapshot first if it has become stale.
+
+        subscriptions is a priority-sorted list of (alertsubscription,
+        filtergroupcontents) tuples, while permissions is a list of
+        filtergroupcontents of the filter groups the account has been given
+        permission to.
+
+        """
+        now = now or datetime.now()
+        version = self.get_current_version()
+        if self.is_stale(version, now):
+            self.refresh(version, now)
+        return self.accounts
+
+    def is_stale(self, version, now):
+        """Returns True if the snapshot needs to be rebuilt"""
+        if self.valid_until is None or now >= self.valid_until:
+            return True
+        return version is None or version != self.version
+
+    def invalidate(self):
+        """Forces a rebuild of the snapshot on the next request"""
+        self.valid_until = None
+
+    @staticmethod
+    def get_current_version():
+        """Returns the current alert profile version counter value"""
+        cursor = connection.cursor()
+        cursor.execute(SubscriptionSnapshot.VERSION_SQL)
+        return cursor.fetchone()
+
+    def refresh(self, version, now):
+        """Rebuilds the snapshot from the database"""
+        accounts = []
+        for account in Account.objects.filter(
+                alertpreference__active_profile__isnull=False):
+            time_period = account.get_active_profile().get_active_timeperiod()
+            if not time_period:
+                continue
+
+            current_alertsubscriptions = sorted(
+                time_period.alertsubscription_set.all(),
+                key=subscription_sort_key)
+            subscriptions = [
+                (subscription,
+                 _get_filtergroupcontents(subscription.filter_group))
+                for subscription in current_alertsubscriptions]
+
+            if subscriptions:
+                permissions = [
+                    _get_filtergroupcontents(filtergroup)
+                    for filtergroup in FilterGroup.objects.filter(
+                        group_permissions__accounts__in=[account])]
+                accounts.append((account, subscriptions, permissions))
+
+        self.accounts = accounts
+        self.version = version
+        self.valid_until = get_next_timeperiod_boundary(now)
+        self._logger.debug("rebuilt subscription snapshot of %d accounts, "
+                           "valid until %s (version %r)",
+                           len(accounts), self.valid_until, version)
+
+
+def _get_filtergroupcontents(filtergroup):
+    return tuple(filtergroup.filtergroupcontent_set.select_related(
+        'filter').prefetch_related('filter__expression_set__match_field'))
+
+
+def get_next_timeperiod_boundary(now, start_times=None):
+    """Returns the first point in time after now where the active time period
+    of any active alert profile may change.
+
+    Time periods are only ever switched at their start times, or at midnight,
+    when the week may turn from weekdays to weekends or vice versa.
+
+    """
+    if start_times is None:
+        start_times = TimePeriod.objects.filter(
+            profile__alertpreference__isnull=False).values_list(
+            'start', flat=True).distinct()
+    midnight = datetime.combine(now.date() + timedelta(days=1),
+                                datetime.min.time())
+    later_today = [datetime.combine(now.date(), start)
+                   for start in start_times if start > now.time()]
+    return min(later_today + [midnight])
+
+
+_snapshot = SubscriptionSnapshot()
+
+
 def _check_match_and_permission(account, alert, alertsubscriptions, dupemap,
                                 logger, memoized_check_alert, permissions):
     for alertsubscription, filtergroupcontents in alertsubscriptions:
@@ -258,6 +344,9 @@ def handle_queued_alerts(queued_alerts, now=None):
     num_resolved_alerts_ignored = 0
     num_failed_sends = 0
 
+    # Alerts that should be sent, along with their daily and weekly flags
+    to_send = []
+
     for queued_alert in queued_alerts:
         send, daily, weekly = False, False, False
 
@@ -395,26 +484,70 @@ def handle_queued_alerts(queued_alerts, now=None):
 
                 num_resolved_alerts_ignored += 1
                 queued_alert.delete()
-
-            # Try to send alert
-            elif queued_alert.send():
-                num_sent_alerts += 1
-
-                if weekly:
-                    sent_weekly.append(queued_alert.account)
-                elif daily:
-                    sent_daily.append(queued_alert.account)
-            # Count failure
             else:
-                num_failed_sends += 1
+                to_send.append((queued_alert, daily, weekly))
 
         del queued_alert
     del queued_alerts
 
+    deliver_queued_alerts([queued_alert for queued_alert, _, _ in to_send])
+
+    for queued_alert, daily, weekly in to_send:
+        # Try to send alert
+        if queued_alert.send():
+            num_sent_alerts += 1
+
+            if weekly:
+                sent_weekly.append(queued_alert.account)
+            elif daily:
+                sent_daily.append(queued_alert.account)
+        # Count failure
+        else:
+            num_failed_sends += 1
+
+        del queued_alert
+    del to_send
+
     return (sent_daily, sent_weekly, num_sent_alerts, num_failed_sends,
             num_resolved_alerts_ignored)
 
 
+def deliver_queued_alerts(queued_alerts):
+    """Lets the dispatchers of the queued alerts that are about to be sent
+    deliver them in bulk, before each alert is sent and accounted for.
+
+    """
+    logger = logging.getLogger('nav.alertengine.deliver_queued_alerts')
+    senders = {}
+    batches = defaultdict(list)
+    languages = {}
+
+    for queued_alert in queued_alerts:
+        try:
+            address = queued_alert.subscription.alert_address
+            sender = address.type
+            alert = queued_alert.alert
+        except ObjectDoesNotExist:
+            # these are dealt with when the alert is sent
+            continue
+        if not (address.address or '').strip() or sender.is_blacklisted():
+            continue
+
+        if address.id not in languages:
+            languages[address.id] = address.get_language()
+        senders[sender.handler] = sender
+        batches[sender.handler].append(
+            (address, alert, languages[address.id]))
+
+    for handler, items in batches.items():
+        try:
+            senders[handler].get_handler().deliver_many(items)
+        except Exception:
+            logger.exception('Could not deliver %d alert(s) in bulk using '
+                             '%s, will send them one by one', len(items),
+                             handler)
+
+
 def alert_should_be_ignored(queued_alert, subscription, now):
     """Returns True if the subscription specifies that the queued_alert should
     be ignored.
@@ -49,6 +49,21 @@ class dispatcher:
     def send(alert, address, language='en'):
         raise NotImplementedError
 
+    def deliver_many(self, items):
+        """Optionally delivers a batch of alerts ahead of the alertengine
+        calling send() for each of them.
+
+        items is a list of (address, alert, language) tuples. Dispatchers
+        that can deliver concurrently may do so here, remember the outcome
+        of each delivery, and report it when send() is later called for the
+        same address and alert.  The default is to do nothing.
+        """
+        pass
+
+    def close(self):
+        """Called at the end of each alertengine run"""
+        pass
+
     def get_message(self, alert, language, message_type):
         try:
             return alert.messages.get(language=language, type=message_type).message
@@ -14,48 +14,255 @@
 # more details.  You should have received a copy of the GNU General Public
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""
+"""Email dispatcher.
+
+Each thread keeps its SMTP connection open for the entire alertengine run,
+and reconnects once if the server has dropped it.  Alerts that are about to
+be sent are delivered ahead of time by deliver_many(), through a small pool of
+worker threads, and send() only reports the outcome of those deliveries.  If
+batching is enabled, all alerts to the same address are sent as one email.
+
+The [email] section of alertengine.conf accepts these options:
+
+  workers - the number of concurrent SMTP connections (default 4)
+  batch   - whether to batch alerts per address (default no)
 """
 
 import logging
-from smtplib import SMTPException, SMTPRecipientsRefused
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from smtplib import (SMTPException, SMTPRecipientsRefused,
+                     SMTPServerDisconnected)
 
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 
 from nav.alertengine.dispatchers import dispatcher, DispatcherException, \
 FatalDispatcherException, is_valid_email
 
 logger = logging.getLogger('nav.alertengine.dispatchers.email')
 
+DEFAULT_WORKERS = 4
+
+
 class email(dispatcher):
+    def __init__(self, config={}):
+        dispatcher.__init__(self, config)
+        self.workers = max(int(config.get('workers', DEFAULT_WORKERS)), 1)
+        self.batch = config.get('batch', 'no').lower() in ('yes', 'true',
+                                                           'on', '1')
+        self.stats = SendStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._delivered = {}
+
     def send(self, address, alert, language='en'):
+        if address.DEBUG_MODE:
+            logger.debug('alert %d: In testing mode, would have sent email '
+                         'to %s', alert.id, address.address)
+            return
+
+        key = (address.id, alert.id)
+        if key in self._delivered:
+            error = self._delivered.pop(key)
+            if error is not None:
+                raise_for(error)
+            return
+
+        subject, body = self._render(alert, language)
+        try:
+            self._deliver(EmailMessage(subject=subject, body=body,
+                                       to=[address.address]))
+        except SMTPException, error:
+            raise_for(error)
+
+    def deliver_many(self, items):
+        """Renders and delivers emails for a list of (address, alert,
+        language) tuples using the worker pool, remembering the outcome of
+        each delivery for send().
+
+        """
+        messages = self._make_messages(
+            [item for item in items if not item[0].DEBUG_MODE])
+        if not messages:
+            return
+
+        workers = min(self.workers, len(messages))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                errors = pool.map(self._deliver_quietly,
+                                  [message for _keys, message in messages])
+            finally:
+                pool.close()
+                pool.join()
+                self._close_connections(other_threads=True)
+        else:
+            errors = [self._deliver_quietly(message)
+                      for _keys, message in messages]
+
+        for (keys, _message), error in zip(messages, errors):
+            for key in keys:
+                self._delivered[key] = error
+        logger.debug('delivered %d email(s) using %d worker(s)',
+                     len(messages), workers)
+
+    def close(self):
+        """Closes all SMTP connections and reports statistics for the run"""
+        self._close_connections()
+        if self._delivered:
+            logger.warning('%d delivered alert(s) were never accounted for',
+                           len(self._delivered))
+            self._delivered.clear()
+        if self.stats.count:
+            self.stats.report()
+        self.stats = SendStats()
+
+    def _render(self, alert, language):
         message = self.get_message(alert, language, 'email')
 
         # Extract the subject
         subject = message.splitlines(1)[0].lstrip('Subject:').strip()
         # Remove the subject line
-        message = '\n'.join(message.splitlines()[1:])
+        body = '\n'.join(message.splitlines()[1:])
+        return subject, body
 
-        headers = {
-            'X-NAV-alert-netbox': alert.netbox,
-            'X-NAV-alert-device': alert.device,
-            'X-NAV-alert-subsystem': alert.source,
-        }
+    def _make_messages(self, items):
+        """Returns a list of ([(address id, alert id), ...], EmailMessage)
+        tuples for items, with one message per address if batching is
+        enabled.
 
-        try:
-            if not address.DEBUG_MODE:
-                email = EmailMessage(subject=subject, body=message, to=[address.address])
-                email.send(fail_silently=False)
+        """
+        rendered = []
+        grouped = {}
+        for address, alert, language in items:
+            subject, body = self._render(alert, language)
+            entry = ((address.id, alert.id), subject, body)
+            if not self.batch:
+                rendered.append((address.address, [entry]))
+            elif address.address in grouped:
+                grouped[address.address].append(entry)
             else:
-                logger.debug('alert %d: In testing mode, would have sent email to %s' % (alert.id, address.address))
+                grouped[address.address] = [entry]
+                rendered.append((address.address, grouped[address.address]))
 
-        except SMTPException, e:
-            if isinstance(e, SMTPRecipientsRefused) or \
-                (hasattr(e, "smtp_code") and str(e.smtp_code).startswith('5')):
-                raise FatalDispatcherException('Could not send email: %s" ' % e)
-            # Reraise as DispatcherException so that we can catch it further up
-            raise DispatcherException('Could not send email: %s' % e)
+        messages = []
+        for to_address, entries in rendered:
+            keys = [key for key, _subject, _body in entries]
+            if len(entries) == 1:
+                _key, subject, body = entries[0]
+            else:
+                subject = '%d NAV alerts' % len(entries)
+                body = ('\n\n' + '-' * 72 + '\n\n').join(
+                    '%s\n\n%s' % (subject_, body_)
+                    for _key, subject_, body_ in entries)
+            messages.append((keys, EmailMessage(subject=subject, body=body,
+                                                to=[to_address])))
+        return messages
+
+    def _deliver_quietly(self, message):
+        """Delivers message, returning any error instead of raising it"""
+        try:
+            self._deliver(message)
+        except Exception, error:
+            return error
+
+    def _deliver(self, message):
+        """Sends message over this thread's SMTP connection, reconnecting
+        once if a connection that was kept open has been dropped.
+
+        """
+        start = time.time()
+        reused = getattr(self._local, 'connection', None) is not None
+        try:
+            for attempt in (1, 2):
+                connection = self._get_connection()
+                try:
+                    connection.send_messages([message])
+                    break
+                except (SMTPServerDisconnected, socket.error):
+                    self._drop_connection()
+                    if attempt > 1 or not reused:
+                        raise
+                    logger.debug('SMTP connection was dropped, reconnecting')
+        except Exception:
+            self.stats.add(time.time() - start, failed=True)
+            raise
+        self.stats.add(time.time() - start)
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            self._local.connection = connection
+            with self._lock:
+                self._connections[threading.current_thread()] = connection
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        with self._lock:
+            self._connections.pop(threading.current_thread(), None)
+        if connection is not None:
+            _close(connection)
+
+    def _close_connections(self, other_threads=False):
+        current = threading.current_thread()
+        with self._lock:
+            threads = [thread for thread in self._connections
+                       if not other_threads or thread is not current]
+            connections = [self._connections.pop(thread)
+                           for thread in threads]
+        if current in threads:
+            self._local.connection = None
+        for connection in connections:
+            _close(connection)
 
     @staticmethod
     def is_valid_address(address):
         return is_valid_email(address)
+
+
+class SendStats(object):
+    """Thread safe accounting of email send latencies and failures"""
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed, failed=False):
+        with self._lock:
+            self.count += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if failed:
+                self.failures += 1
+
+    def report(self):
+        logger.info('%d email(s) sent, %d failed, send latency avg %.1f ms, '
+                    'max %.1f ms', self.count - self.failures, self.failures,
+                    1000 * self.total_time / self.count, 1000 * self.max_time)
+
+
+def raise_for(error):
+    """Re-raises an error from sending an email as a dispatcher exception"""
+    if not isinstance(error, SMTPException):
+        raise error
+    if isinstance(error, SMTPRecipientsRefused) or \
+        (hasattr(error, "smtp_code") and str(error.smtp_code).startswith('5')):
+        raise FatalDispatcherException('Could not send email: %s" ' % error)
+    # Reraise as DispatcherException so that we can catch it further up
+    raise DispatcherException('Could not send email: %s' % error)
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception, error:
+        logger.debug('error closing SMTP connection: %s', error)
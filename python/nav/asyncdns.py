@@ -24,6 +24,7 @@ support.
 """
 
 import socket
+import time
 from IPy import IP
 from itertools import cycle
 from collections import defaultdict
@@ -40,14 +41,17 @@ from twisted.names.error import DNSServerError, DNSNameError
 from twisted.names.error import DNSNotImplementedError, DNSQueryRefusedError
 
 
-def reverse_lookup(addresses):
+def reverse_lookup(addresses, timeout=None):
     """Runs parallel reverse DNS lookups for addresses.
 
-    :returns: A dict of {address: [name, ...]} items
+    :param timeout: If set, the maximum number of seconds to wait for all
+                    lookups to complete.
+    :returns: A dict of {address: [name, ...]} items. Failed lookups, and
+              lookups that didn't complete in time, map to an exception.
 
     """
     resolver = ReverseResolver()
-    return resolver.resolve(addresses)
+    return resolver.resolve(addresses, timeout)
 
 
 def forward_lookup(names):
@@ -68,26 +72,38 @@ class Resolver(object):
         self.results = defaultdict(list)
         self._finished = False
 
-    def resolve(self, names):
-        """Resolves DNS names in parallel"""
+    def resolve(self, names, timeout=None):
+        """Resolves DNS names in parallel.
+
+        :param timeout: If set, the maximum number of seconds to wait for
+                        the lookups.  Names whose lookups are still pending
+                        when time runs out map to a DNSQueryTimeoutError.
+
+        """
         self._finished = False
-        self.results = defaultdict(list)
+        self.results = results = defaultdict(list)
 
         deferred_list = []
         for name in names:
             for deferred in self.lookup(name):
                 deferred.addCallback(self._extract_records, name)
                 deferred.addErrback(self._errback, name)
+                deferred.addCallback(self._add_result, results)
                 deferred_list.append(deferred)
 
         deferred_list = defer.DeferredList(deferred_list)
-        deferred_list.addCallback(self._parse_result)
         deferred_list.addCallback(self._finish)
 
+        deadline = time.time() + timeout if timeout is not None else None
         while not self._finished:
+            if deadline is not None and time.time() > deadline:
+                for name in names:
+                    if name not in results:
+                        results[name] = DNSQueryTimeoutError(name)
+                break
             reactor.iterate()
 
-        return dict(self.results)
+        return dict(results)
 
     def lookup(self, name):
         """Initiates possibly multiple asynchronous DNS lookups for a name"""
@@ -97,13 +113,15 @@ class Resolver(object):
     def _extract_records(result, name):
         raise NotImplementedError
 
-    def _parse_result(self, result):
-        """Parses the result to the correct format"""
-        for _success, (name, response) in result:
-            if isinstance(response, Exception):
-                self.results[name] = response
-            else:
-                self.results[name].extend(response)
+    @staticmethod
+    def _add_result(result, results):
+        """Adds the result of a single lookup to the results dict"""
+        name, response = result
+        if isinstance(response, Exception):
+            results[name] = response
+        elif not isinstance(results[name], Exception):
+            results[name].extend(response)
+        return result
 
     @staticmethod
     def _errback(failure, host):
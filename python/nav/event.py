@@ -16,6 +16,8 @@
 """Simple API to interface with NAVs event queue."""
 
 from __future__ import absolute_import
+import logging
+import threading
 import nav.db
 from nav.errors import GeneralException
 from UserDict import UserDict
@@ -23,6 +25,15 @@ from UserDict import UserDict
 from nav.models.event import EventType, AlertType
 from django.db import transaction
 
+_logger = logging.getLogger(__name__)
+
+EVENTQ_FIELDS = ('source', 'target', 'deviceid', 'netboxid', 'subid',
+                 'time', 'eventtypeid', 'state', 'value', 'severity')
+# Maps eventq columns to EventQueue model attribute names
+EVENTQ_MODEL_ATTRS = ('source_id', 'target_id', 'device_id', 'netbox_id',
+                      'subid', 'time', 'event_type_id', 'state', 'value',
+                      'severity')
+
 
 class Event(UserDict):
     """Represents a single event on or off the queue.
@@ -58,7 +69,15 @@ class Event(UserDict):
         return "<Event %s / %s>" % (attr_list, UserDict.__repr__(self))
 
     def post(self):
-        """Post this event to the eventq"""
+        """Post this event to the eventq.
+
+        If called within an active EventBatch context, the event is added to
+        the batch, and will not be posted until the batch is.
+
+        """
+        batch = EventBatch.current()
+        if batch is not None:
+            return batch.add(self)
         return EventQ.post_event(self)
 
     def delete(self):
@@ -110,8 +129,7 @@ class EventQ(object):
         # First post the relevant fields to eventq
         fields = []
         values = []
-        for attr in ('source', 'target', 'deviceid', 'netboxid', 'subid',
-                     'time', 'eventtypeid', 'state', 'value', 'severity'):
+        for attr in EVENTQ_FIELDS:
             if hasattr(event, attr) and getattr(event, attr):
                 fields.append(attr)
                 values.append(getattr(event, attr))
@@ -188,7 +206,189 @@ class EventQ(object):
         conn.commit()
         return cursor.statusmessage
 
-    
+
+
+class EventBatch(object):
+    """Posts a batch of events to the event queue in a single transaction.
+
+    Event ids are allocated with a single query, and all events and their
+    variables are inserted using multi-row INSERT statements.  Since
+    PostgreSQL folds identical notifications sent within a single
+    transaction, eventengine receives only one `new_event` notification for
+    the whole batch.
+
+    Events can be nav.event.Event objects or unsaved
+    nav.models.event.EventQueue objects.  When used as a context manager,
+    calling post() on any nav.event.Event within the context will add it to
+    the batch, and the batch is posted when the context exits without
+    errors::
+
+        with EventBatch():
+            for box in boxes:
+                Event(source='ipdevpoll', ...).post()
+
+    :param connection: A DB-API connection to post events through.  Defaults
+                       to the connection used by EventQ.
+    :param commit: Whether to commit the transaction after posting.
+
+    """
+    _context = threading.local()
+
+    def __init__(self, connection=None, commit=True):
+        self.connection = connection
+        self.commit = commit
+        self.events = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def __nonzero__(self):
+        return True
+
+    def __enter__(self):
+        stack = self._get_stack()
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = self._get_stack()
+        stack.remove(self)
+        if exc_type is None:
+            self.post()
+
+    @classmethod
+    def _get_stack(cls):
+        if not hasattr(cls._context, 'stack'):
+            cls._context.stack = []
+        return cls._context.stack
+
+    @classmethod
+    def current(cls):
+        """Returns the innermost active EventBatch context of this thread,
+        if any.
+
+        """
+        stack = cls._get_stack()
+        return stack[-1] if stack else None
+
+    def add(self, event):
+        """Adds an event to this batch"""
+        if _get_event_id(event):
+            raise EventAlreadyPostedError(_get_event_id(event))
+        self.events.append(event)
+
+    def post(self):
+        """Posts all the events of this batch to the event queue.
+
+        On errors, the exception is raised and the events are kept in the
+        batch, so that the transaction can be rolled back and the events can
+        be posted individually using post_individually().
+
+        :returns: The number of posted events.
+
+        """
+        if not self.events:
+            return 0
+
+        rows = [_get_event_row(event) for event in self.events]
+        conn = self.connection or EventQ._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT nextval('eventq_eventqid_seq') "
+                       "FROM generate_series(1, %s)", (len(rows),))
+        ids = [row[0] for row in cursor.fetchall()]
+
+        eventq = ",".join(_make_values(cursor, (eventqid,) + fields)
+                          for eventqid, (fields, _) in zip(ids, rows))
+        cursor.execute("INSERT INTO eventq (eventqid, %s) VALUES %s" %
+                       (", ".join(EVENTQ_FIELDS), eventq))
+
+        eventqvar = ",".join(
+            _make_values(cursor, (eventqid, var, val))
+            for eventqid, (_, variables) in zip(ids, rows)
+            for var, val in variables.items())
+        if eventqvar:
+            cursor.execute("INSERT INTO eventqvar (eventqid, var, val) "
+                           "VALUES %s" % eventqvar)
+        if self.commit:
+            conn.commit()
+
+        for eventqid, event in zip(ids, self.events):
+            _set_event_id(event, eventqid)
+        count = len(self.events)
+        self.events = []
+        _logger.debug("posted batch of %d events", count)
+        return count
+
+    def post_individually(self):
+        """Posts the events of this batch one by one, each in a transaction of
+        its own, logging and skipping those that fail.
+
+        This is normally used after post() has failed, so the current
+        transaction of the connection is rolled back first.
+
+        :returns: The number of posted events.
+
+        """
+        conn = self.connection or EventQ._get_connection()
+        conn.rollback()
+        count = 0
+        for event in self.events:
+            batch = EventBatch(self.connection, commit=True)
+            batch.add(event)
+            try:
+                count += batch.post()
+            except Exception:
+                _logger.exception("unable to post event %r", event)
+                conn.rollback()
+        self.events = []
+        return count
+
+
+def _get_event_id(event):
+    if isinstance(event, Event):
+        return event.eventqid
+    else:
+        return event.pk
+
+
+def _set_event_id(event, eventqid):
+    if isinstance(event, Event):
+        event.eventqid = eventqid
+    else:
+        event.pk = eventqid
+        event._state.adding = False
+
+
+DEFAULT = object()
+
+
+def _get_event_row(event):
+    """Returns a tuple of eventq column values and a dict of variables for a
+    nav.event.Event or EventQueue object.
+
+    Columns that are unset will get their database default value.
+
+    """
+    if isinstance(event, Event):
+        fields = tuple(getattr(event, attr, None) or DEFAULT
+                       for attr in EVENTQ_FIELDS)
+        variables = dict(event)
+    else:
+        fields = tuple(DEFAULT if getattr(event, attr) is None
+                       else getattr(event, attr)
+                       for attr in EVENTQ_MODEL_ATTRS)
+        variables = event.varmap
+    if DEFAULT in (fields[0], fields[1], fields[6]):
+        raise EventIncompleteError(repr(event))
+    return fields, variables
+
+
+def _make_values(cursor, values):
+    return "(%s)" % ", ".join(
+        "DEFAULT" if value is DEFAULT else cursor.mogrify("%s", (value,))
+        for value in values)
+
+
 class EventIdAllocationError(GeneralException):
     """Error allocating a new event ID from the queue"""
     pass
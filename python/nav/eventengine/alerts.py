@@ -220,40 +220,150 @@ def render_templates(alert):
 
 
 def _render_template(details, alert):
-    template = loader.get_template(details.name)
+    template = _registry.get_template(details)
     context = dict(alert)
     context.update(vars(alert))
     context.update(dict(msgtype=details.msgtype,
                         language=details.language))
-    context.update(dict(context_dump=pformat(context)))
+    context['context_dump'] = ContextDump(context)
 
-    _template_logger.debug("rendering alert template with context:\n%s",
-                           context['context_dump'])
+    debug = _template_logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        _template_logger.debug("rendering alert template with context:\n%s",
+                               context['context_dump'])
     output = template.render(Context(context)).strip()
-    _template_logger.debug("rendered as:\n%s", output)
+    if debug:
+        _template_logger.debug("rendered as:\n%s", output)
     return details, output
 
 
+class ContextDump(object):
+    """A lazily formatted dump of a template context.
+
+    The pretty-printing is expensive, and is only performed if the dump
+    is actually used by a template or a log statement.
+
+    """
+    def __init__(self, context):
+        self.context = context
+        self._dump = None
+
+    def __unicode__(self):
+        if self._dump is None:
+            context = dict((key, value)
+                           for key, value in self.context.items()
+                           if value is not self)
+            self._dump = pformat(context)
+        return self._dump
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
 def get_list_of_templates_for(event_type, alert_type="default"):
     """Returns a list of TemplateDetails objects for the available alert
     message templates for the given event_type and alert_type.
 
     """
-    def _matcher(name):
-        match = TEMPLATE_PATTERN.search(name)
-        if match and match.group('alert_type') == alert_type:
-            return match
-
-    directory = os.path.join(ALERT_TEMPLATE_DIR, event_type)
-    if os.path.isdir(directory):
-        matches = [(_matcher(name), os.path.join(event_type, name))
-                   for name in os.listdir(directory)]
-    else:
-        matches = []
-    return [TemplateDetails(name,
-                            match.group('msgtype'),
-                            match.group('language') or DEFAULT_LANGUAGE)
-            for match, name in matches if match]
+    return _registry.get_list_of_templates_for(event_type, alert_type)
+
+
+def clear_template_cache():
+    """Forgets all cached alert template listings and compiled templates"""
+    _registry.clear()
+
+
+class TemplateRegistry(object):
+    """Keeps track of available alert message templates.
+
+    Template directory listings are cached per event type, and are only
+    re-read when the modification time of the event type directory changes.
+    Compiled templates are cached by template name, which maps directly to a
+    (event type, alert type, msgtype, language) combination, and are
+    recompiled when the modification time of the template file changes.
+
+    """
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._listings = {}
+        self._templates = {}
+
+    @property
+    def directory(self):
+        """The alert template root directory"""
+        return self._directory or ALERT_TEMPLATE_DIR
+
+    def clear(self):
+        """Clears all cached listings and templates"""
+        self._listings.clear()
+        self._templates.clear()
+
+    def get_list_of_templates_for(self, event_type, alert_type="default"):
+        """Returns a list of TemplateDetails objects for the available alert
+        message templates for the given event_type and alert_type.
+
+        """
+        listing = self._get_listing(event_type)
+        return listing.get(alert_type, [])
+
+    def get_template(self, details):
+        """Returns a compiled template for the given TemplateDetails object"""
+        try:
+            mtime = os.stat(
+                os.path.join(self.directory, details.name)).st_mtime
+        except OSError:
+            mtime = None
+
+        cached = self._templates.get(details.name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        template = loader.get_template(details.name)
+        self._templates[details.name] = (mtime, template)
+        return template
+
+    def _get_listing(self, event_type):
+        directory = os.path.join(self.directory, event_type)
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = None
+
+        cached = self._listings.get(event_type)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        if cached:
+            self._forget_templates_for(event_type)
+        listing = self._scan_directory(event_type, directory, mtime)
+        self._listings[event_type] = (mtime, listing)
+        return listing
+
+    def _forget_templates_for(self, event_type):
+        prefix = event_type + os.sep
+        for name in [name for name in self._templates
+                     if name.startswith(prefix)]:
+            del self._templates[name]
+
+    @staticmethod
+    def _scan_directory(event_type, directory, mtime):
+        listing = {}
+        if mtime is None or not os.path.isdir(directory):
+            return listing
+
+        for name in sorted(os.listdir(directory)):
+            match = TEMPLATE_PATTERN.search(name)
+            if match:
+                details = TemplateDetails(
+                    os.path.join(event_type, name),
+                    match.group('msgtype'),
+                    match.group('language') or DEFAULT_LANGUAGE)
+                listing.setdefault(match.group('alert_type'), []).append(
+                    details)
+        return listing
+
+
+_registry = TemplateRegistry()
 
 # pylint sucks on namedtuples
 # pylint: disable=C0103
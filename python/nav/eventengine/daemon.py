@@ -24,6 +24,7 @@ import signal
 from nav import buildconf
 import nav.daemon
 from nav.eventengine.engine import EventEngine
+from nav.eventengine.alerts import clear_template_cache
 import nav.logs
 
 
@@ -114,14 +115,16 @@ def sigterm_handler(signum, _frame):
 
 
 def sighup_handler(_signum, _frame):
-    """Reopens log files."""
+    """Reopens log files and forgets cached alert message templates."""
     _logger.info("SIGHUP received; reopening log files")
     nav.logs.reopen_log_files()
     nav.daemon.redirect_std_fds(
         stderr=nav.logs.get_logfile_from_logger())
     nav.logs.reset_log_levels()
     nav.logs.set_log_levels()
-    _logger.info("Log files reopened, log levels reloaded.")
+    clear_template_cache()
+    _logger.info("Log files reopened, log levels and alert templates "
+                 "reloaded.")
 
 
 def start_engine():
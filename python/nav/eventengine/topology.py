@@ -17,9 +17,8 @@
 import socket
 import datetime
 
-import networkx
-from networkx.exception import NetworkXException
 from nav.models.manage import SwPortVlan, Netbox, Prefix, Arp, Cam
+from nav.topology.compact import CompactLayer2Graph
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -63,87 +62,77 @@ def get_path_to_netbox(netbox):
     _logger.debug("reachability check for %s on %s (router: %s)",
                   netbox, prefix, router)
 
-    graph = get_graph_for_vlan(prefix.vlan)
     try:
-        netbox.add_to_graph(graph)
+        extra_links = netbox.get_graph_links()
     except AttributeError:
-        pass
-    strip_down_nodes_from_graph(graph, keep=netbox)
+        extra_links = ()
+    graph = get_graph_for_vlan(prefix.vlan, extra_links)
+    down = get_down_nodes(graph, keep=netbox.id)
 
-    if netbox not in graph or router not in graph:
+    if (netbox.id not in graph or router.id not in graph
+            or router.id in down):
         if router.up == router.UP_UP:
             _logger.warning("%(netbox)s topology problem: router %(router)s "
                             "is up, but not in VLAN graph for %(prefix)r. "
                             "Defaulting to 'reachable' status.", locals())
             return True
-        _logger.debug("%s not reachable, router or box not in graph: %r",
-                      netbox, graph.edges())
+        _logger.debug("%s not reachable, router or box not in graph of %d "
+                      "nodes", netbox, len(graph))
         return False
 
-    try:
-        path = networkx.shortest_path(graph, netbox, router)
-    except NetworkXException as error:
-        _logger.debug("an internal networkx exception was raised in "
-                      "shortest_path, assuming no path was found: %s", error)
-        path = []
-    else:
-        _logger.debug("path to %s: %r", netbox, path)
+    path = graph.shortest_path(netbox.id, router.id, exclude=down)
+    if not path:
+        return []
+    path = resolve_path(path, (netbox, router))
+    _logger.debug("path to %s: %r", netbox, path)
     return path
 
 
-def get_graph_for_vlan(vlan):
-    """Builds a simple topology graph of the active netboxes in vlan.
+def get_graph_for_vlan(vlan, extra_links=()):
+    """Builds a simple topology graph of the netboxes in vlan.
 
-    Any netbox that seems to be down at the moment will not be included in
-    the graph.
-
-    :returns: A networkx.Graph object.
+    :param extra_links: (netbox id, netbox id) tuples to add as links.
+    :returns: An undirected CompactLayer2Graph.
 
     """
-    swpvlan = SwPortVlan.objects.filter(vlan=vlan).select_related(
-        'interface', 'interface__netbox',  'interface__to_netbox',
+    swpvlan = SwPortVlan.objects.filter(
+        vlan=vlan, interface__to_netbox__isnull=False).values_list(
+        'interface__netbox', 'interface', 'interface__to_netbox',
         'interface__to_interface')
-    graph = networkx.MultiGraph(name='graph for vlan %s' % vlan)
-    for swp in swpvlan:
-        source = swp.interface.netbox
-        source_ifc = swp.interface
-        target = swp.interface.to_netbox
-        target_ifc = swp.interface.to_interface
-        if target:
-            key = tuple(sorted(
-                (source_ifc.id, target_ifc.id if target_ifc else None)))
-            data = set([source_ifc, target_ifc])
-            graph.add_edge(source, target, key=key, data=data)
-    return graph
+    links = []
+    for source, source_ifc, target, target_ifc in swpvlan.iterator():
+        links.append((source, target, source_ifc, None))
+        links.append((target, source, target_ifc, None))
+    for source, target in extra_links:
+        links.append((source, target, None, None))
+        links.append((target, source, None, None))
+    return CompactLayer2Graph(links)
 
 
-def strip_down_nodes_from_graph(graph, keep=None):
-    """Strips all nodes (netboxes) from graph that are currently down.
+def get_down_nodes(graph, keep=None):
+    """Returns the ids of the netboxes in graph that are currently down.
 
-    :param keep: A node to keep regardless of its current status.
+    :param keep: A netbox id to leave out regardless of its current status.
 
     """
-    removable = set(node for node in graph.nodes_iter()
-                    if node.up != node.UP_UP and node != keep)
-    graph.remove_nodes_from(removable)
-    return len(removable)
+    down = set(Netbox.objects.filter(id__in=graph.nodes).exclude(
+        up=Netbox.UP_UP).values_list('id', flat=True))
+    down.discard(keep)
+    return down
+
 
-def strip_down_links_from_graph(graph):
-    """Strips all edges (links) from graph where any of the involved
-    interfaces are down.
+def resolve_path(path, known=()):
+    """Resolves a path of netbox ids into a list of Netbox objects.
+
+    :param known: Already loaded Netbox objects, or NAVServer objects, that
+                  may be on the path.
 
     """
-    def _is_down(data):
-        ifcs = data.get('data', [])
-        return any(ifc and ifc.ifoperstatus == ifc.OPER_DOWN for ifc in ifcs)
-
-    removable = set(
-        (u, v, key)
-        for u, v, key, data in graph.edges_iter(data=True, keys=True)
-        if _is_down(data)
-    )
-    graph.remove_edges_from(removable)
-    return len(removable)
+    netboxes = dict((netbox.id, netbox) for netbox in known)
+    missing = [node for node in path if node not in netboxes]
+    if missing:
+        netboxes.update(Netbox.objects.in_bulk(missing))
+    return [netboxes[node] for node in path]
 
 ###
 ### Functions for locating the NAV server itself
@@ -153,6 +142,8 @@ def strip_down_links_from_graph(graph):
 class NAVServer(object):
     """A simple mockup of a Netbox representing the NAV server itself"""
     UP_UP = Netbox.UP_UP
+    # No actual netbox has this id
+    NODE_ID = 0
 
     @classmethod
     def make_for(cls, dest):
@@ -167,6 +158,7 @@ class NAVServer(object):
             return cls(ipaddr)
 
     def __init__(self, ip):
+        self.id = self.NODE_ID
         self.sysname = "NAV"
         self.ip = ip
         self.up = Netbox.UP_UP
@@ -177,10 +169,13 @@ class NAVServer(object):
         if matches:
             return matches[0]
 
-    def add_to_graph(self, graph):
-        """Adds edge between myself and all neighboring switches"""
-        for switch in self.get_switches_from_cam():
-            graph.add_edge(self, switch)
+    def get_graph_links(self):
+        """Returns links between myself and all neighboring switches, as
+        (netbox id, netbox id) tuples.
+
+        """
+        return [(self.id, switch.id)
+                for switch in self.get_switches_from_cam()]
 
     def get_switches_from_cam(self):
         """Gets all neighboring switches"""
@@ -20,7 +20,6 @@ from collections import defaultdict
 from twisted.internet import defer
 
 from nav.models import manage
-from nav.util import splitby
 from nav.mibs.bridge_mib import MultiBridgeMib
 from nav.mibs.qbridge_mib import QBridgeMib
 from nav.ipdevpoll import Plugin, db
@@ -48,6 +47,7 @@ class Cam(Plugin):
     baseports = None
     linkports = None
     accessports = None
+    neighbors = None
     blocking = None
     my_macs = None
 
@@ -142,14 +142,22 @@ class Cam(Plugin):
                            prefix, mac_count, len(fdb))
 
     def _classify_ports(self):
-        def _is_linkport(portmacs):
-            _port, macs = portmacs
-            return any(mac in self.monitored and mac not in self.my_macs
-                       for mac in macs)
+        """Splits the forwarding table into link ports and access ports, and
+        maps each link port to the set of monitored netboxes seen on it.
 
-        linkports, accessports = splitby(_is_linkport, self.fdb.items())
-        self.linkports = dict(linkports)
-        self.accessports = dict(accessports)
+        """
+        self.neighbors = {}
+        self.linkports = {}
+        self.accessports = {}
+        for port, macs in self.fdb.items():
+            netboxids = set(self.monitored[mac] for mac in macs
+                            if mac in self.monitored
+                            and mac not in self.my_macs)
+            if netboxids:
+                self.linkports[port] = macs
+                self.neighbors[port] = netboxids
+            else:
+                self.accessports[port] = macs
 
         self._logger.debug("up/downlinks: %r", sorted(self.linkports.keys()))
         self._logger.debug("access ports: %r", sorted(self.accessports.keys()))
@@ -163,20 +171,16 @@ class Cam(Plugin):
 
     def _store_adjacency_candidates(self):
         shadows.AdjacencyCandidate.sentinel(self.containers, 'cam')
-        for port in self.linkports:
-            macs = self.fdb.get(port, None) or set()
-            macs = macs.intersection(self.monitored).difference(self.my_macs)
-            if macs:
-                self._logger.debug(
-                    "%r sees the following monitored mac addresses: %r",
-                    port, macs)
-                candidates = [self.monitored[mac] for mac in macs]
-                self._make_candidates(port, candidates)
+        for port, netboxids in self.neighbors.items():
+            self._logger.debug(
+                "%r sees monitored mac addresses of netboxes: %r",
+                port, netboxids)
+            self._make_candidates(port, netboxids)
 
     def _make_candidates(self, port, candidates):
+        ifc = self._factory_interface(port)
         for netboxid in candidates:
             otherbox = self._factory_netbox(netboxid)
-            ifc = self._factory_interface(port)
 
             candidate = self._factory_candidate(port, netboxid)
             candidate.interface = ifc
@@ -24,10 +24,12 @@ database I/O.
 import datetime
 import IPy
 
+import django.db
 from django.db.models import Q
 
 from nav.models import manage, oid
 from nav.models.event import EventQueue as Event, EventQueueVar as EventVar
+from nav.event import EventBatch
 
 from nav.ipdevpoll.storage import MetaShadow, Shadow
 from nav.ipdevpoll import descrparsers
@@ -204,16 +206,24 @@ class Module(Shadow):
         return event
 
     @classmethod
-    def _dispatch_down_event(cls, django_module):
+    def _make_down_event(cls, django_module):
         event = cls._make_modulestate_event(django_module)
         event.state = event.STATE_START
-        event.save()
+        return event
 
     @classmethod
-    def _dispatch_up_event(cls, django_module):
+    def _make_up_event(cls, django_module):
         event = cls._make_modulestate_event(django_module)
         event.state = event.STATE_END
-        event.save()
+        return event
+
+    @classmethod
+    def _dispatch_down_event(cls, django_module):
+        cls._make_down_event(django_module).save()
+
+    @classmethod
+    def _dispatch_up_event(cls, django_module):
+        cls._make_up_event(django_module).save()
 
     @classmethod
     def _handle_missing_modules(cls, containers):
@@ -229,12 +239,16 @@ class Module(Shadow):
         missing_modules = modules_up.exclude(id__in=collected_module_pks)
         reappeared_modules = modules_down.filter(id__in=collected_module_pks)
 
+        # Post all module events in a single batch, within the current
+        # transaction
+        batch = EventBatch(connection=django.db.connection, commit=False)
+
         if missing_modules:
             shortlist = ", ".join(m.name for m in missing_modules)
             cls._logger.info("%d modules went missing on %s (%s)",
                              netbox.sysname, len(missing_modules), shortlist)
             for module in missing_modules:
-                cls._dispatch_down_event(module)
+                batch.add(cls._make_down_event(module))
 
         if reappeared_modules:
             shortlist = ", ".join(m.name for m in reappeared_modules)
@@ -242,7 +256,9 @@ class Module(Shadow):
                              netbox.sysname, len(reappeared_modules),
                              shortlist)
             for module in reappeared_modules:
-                cls._dispatch_up_event(module)
+                batch.add(cls._make_up_event(module))
+
+        batch.post()
 
 
     @classmethod
@@ -25,7 +25,12 @@ Record expiry
 
 A database record that is not in the ContainerRepository will have its
 miss_count incremented.  Any record whose miss_count >= MAX_MISS_COUNT will be
-deleted from the database.
+deleted from the database.  A database record that is found again will have
+its miss_count reset to zero.
+
+Only candidates that actually changed are written individually; the miss_count
+updates of missing and re-found records are each done as a single set-based
+UPDATE, and expired records are deleted in a single DELETE.
 
 The AdjacencyManager will make note of which sources placed records in the
 ContainerRepository.  If only the lldp collector plugin ran, records that came
@@ -43,6 +48,8 @@ is None, and whose source attribute is a non-empty string.
 
 """
 
+from django.db.models import F
+
 from nav.models import manage
 from nav.ipdevpoll.storage import Shadow, DefaultManager
 from nav.ipdevpoll.utils import is_invalid_utf8
@@ -55,6 +62,7 @@ class AdjacencyManager(DefaultManager):
 
     _existing = None
     _missing = None
+    _found_again = None
     _sources = None
 
     def __init__(self, *args, **kwargs):
@@ -73,11 +81,14 @@ class AdjacencyManager(DefaultManager):
     def _map_existing(self):
         found = dict((candidate_key(c), c) for c in self.get_managed())
         self._sources = set()
+        self._found_again = []
         for key, cand in found.items():
             if key in self._existing:
-                cand.set_existing_model(self._existing[key])
-                # always reset miss_count of found records
-                cand.miss_count = 0
+                existing = self._existing[key]
+                cand.set_existing_model(existing)
+                # miss_counts of found records are reset in bulk in cleanup
+                if existing.miss_count:
+                    self._found_again.append(existing)
             if cand.source:
                 self._sources.add(cand.source)
 
@@ -87,12 +98,23 @@ class AdjacencyManager(DefaultManager):
 
         self._logger.debug("existing: %r", self._existing)
         self._logger.debug("missing: %r", self._missing)
+        self._logger.debug("found again: %r", self._found_again)
         self._logger.debug("sources: %r", self._sources)
 
     def cleanup(self):
+        self._reset_found_again()
         self._handle_missing()
         self._delete_expired()
 
+    def _reset_found_again(self):
+        """Resets the miss_count of all previously missed adjacency candidates
+        that were found again during this collection run.
+
+        """
+        if self._found_again:
+            manage.AdjacencyCandidate.objects.filter(
+                id__in=[c.id for c in self._found_again]).update(miss_count=0)
+
     def _handle_missing(self):
         """Increments the miss_count of each missing adjacency candidate.
 
@@ -102,12 +124,20 @@ class AdjacencyManager(DefaultManager):
         lldp candidates to be missing.
 
         """
-        missing = (c for c in self._missing if c.source in self._sources)
-        for cand in missing:
-            db_cand = manage.AdjacencyCandidate.objects.filter(id=cand.id)
-            db_cand.update(miss_count=cand.miss_count+1)
+        missing = [c.id for c in self._missing if c.source in self._sources]
+        if missing:
+            manage.AdjacencyCandidate.objects.filter(id__in=missing).update(
+                miss_count=F('miss_count') + 1)
 
     def _delete_expired(self):
+        """Deletes expired adjacency candidates.
+
+        Only candidates whose miss_count was just incremented can have
+        expired, so nothing is deleted if none were missing.
+
+        """
+        if not self._missing:
+            return
         expired = manage.AdjacencyCandidate.objects.filter(
             netbox__id=self.netbox.id,
             miss_count__gte=MAX_MISS_COUNT)
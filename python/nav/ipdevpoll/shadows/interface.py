@@ -23,6 +23,7 @@ from nav.models import manage
 from nav.models.event import EventQueue as Event, EventQueueVar as EventVar
 from nav.models.event import AlertHistory
 from nav import natsort
+from nav.netmap.cache import invalidate_topology_cache
 
 from nav.ipdevpoll.storage import Shadow, DefaultManager
 from nav.ipdevpoll import db
@@ -31,6 +32,8 @@ from .netbox import Netbox
 
 MISSING_THRESHOLD = datetime.timedelta(days=1)
 INFINITY = datetime.datetime.max
+# Interface attributes that are shown in the netmap topology
+TOPOLOGY_ATTRS = frozenset(('ifname', 'speed'))
 
 # pylint: disable=C0111
 
@@ -41,6 +44,7 @@ class InterfaceManager(DefaultManager):
     _by_ifnamedescr = {}
     _by_ifindex = {}
     _missing_ifcs = {}
+    _topology_changed = False
 
     def __init__(self, *args, **kwargs):
         super(InterfaceManager, self).__init__(*args, **kwargs)
@@ -58,6 +62,7 @@ class InterfaceManager(DefaultManager):
         for ifc in self.get_managed():
             ifc.prepare(self.containers)
         self._load_existing_objects()
+        self._topology_changed = self._is_topology_changed()
         self._resolve_changed_ifindexes()
         self._resolve_linkstate_alerts()
 
@@ -124,6 +129,18 @@ class InterfaceManager(DefaultManager):
         elif result:
             return result[0]
 
+    def _is_topology_changed(self):
+        """Returns True if any interface that is linked to a neighbor has
+        changed in a way that is visible in the netmap topology.
+
+        """
+        for found, existing in self._found_existing_map.items():
+            if existing and existing.to_netbox_id:
+                changed = found.get_diff_attrs(existing)
+                if TOPOLOGY_ATTRS.intersection(changed):
+                    return True
+        return False
+
     def _resolve_changed_ifindexes(self):
         """Resolves conflicts that arise from changed ifindexes.
 
@@ -173,6 +190,8 @@ class InterfaceManager(DefaultManager):
             self._mark_missing_interfaces()
             self._delete_missing_interfaces()
         self._generate_linkstate_events()
+        if self._topology_changed:
+            invalidate_topology_cache()
 
     @db.commit_on_success
     def _mark_missing_interfaces(self):
@@ -201,6 +220,8 @@ class InterfaceManager(DefaultManager):
                               len(deleteable), ifnames(deleteable))
             pks = [ifc.id for ifc in deleteable]
             manage.Interface.objects.filter(pk__in=pks).delete()
+            if any(ifc.to_netbox_id for ifc in deleteable):
+                self._topology_changed = True
 
     def _get_indexless_ifcs(self):
         return [ifc for ifc in self._db_ifcs
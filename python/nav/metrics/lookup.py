@@ -13,17 +13,40 @@
 # details.  You should have received a copy of the GNU General Public License
 # along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""Functions for reverse-mapping metric names to NAV objects"""
+"""Functions for reverse-mapping metric names to NAV objects.
 
+Metric names are grouped by the reverse lookup handler that matches them, and
+each group is resolved using a single database query that compares the
+escaped metric name components to escaped object names.  Results are kept in
+a bounded cache for a limited time.
+
+"""
+
+from collections import defaultdict
 import re
+
 from nav.models.manage import Netbox, Interface, Prefix, Sensor
-from django.utils.functional import memoize
+from nav.metrics.names import escape_metric_name
+from nav.util import TimedLRUCache
 
-__all__ = ['reverses', 'lookup']
+__all__ = ['reverses', 'lookup', 'lookup_many', 'clear_cache']
 _reverse_handlers = []
 
+# Mimics nav.metrics.names.escape_metric_name() in SQL
+ESCAPED_COLUMN = "translate({column}::TEXT, './ ()', '_____')"
+
+
+class LookupCache(TimedLRUCache):
+    """A bounded LRU cache of metric lookup results, whose entries expire
+    after a given time.
 
-def _lookup(metric):
+    """
+    pass
+
+_cache = LookupCache()
+
+
+def lookup(metric):
     """
     Looks up a NAV object from a metric path.
 
@@ -33,16 +56,58 @@ def _lookup(metric):
              nav.models package.
 
     """
-    for pattern, func in _reverse_handlers:
-        match = pattern.search(metric)
-        if match:
-            return func(**match.groupdict())
-# pylint: disable=C0103
-lookup = memoize(_lookup, {}, 1)
+    return lookup_many([metric])[metric]
+
+
+def lookup_many(metrics):
+    """
+    Looks up NAV objects from a list of metric paths, using one database
+    query per type of object.
+
+    :param metrics: A list of Graphite metric paths.
+    :returns: A dict of {metric: object} items.  Metrics that could not be
+              mapped to an object map to None.
+
+    """
+    result = {}
+    groups = defaultdict(lambda: defaultdict(list))
+    for metric in metrics:
+        found, obj = _cache.get(metric)
+        if found:
+            result[metric] = obj
+            continue
+        for pattern, func in _reverse_handlers:
+            match = pattern.search(metric)
+            if match:
+                groups[func][match.groups()].append(metric)
+                break
+        else:
+            result[metric] = None
+            _cache.put(metric, None)
+
+    for func, keys in groups.iteritems():
+        objects = func(keys.keys())
+        for key, key_metrics in keys.iteritems():
+            obj = objects.get(key)
+            for metric in key_metrics:
+                result[metric] = obj
+                _cache.put(metric, obj)
+    return result
+
+
+def clear_cache():
+    """Forgets all cached lookup results"""
+    _cache.clear()
 
 
 def reverses(pattern):
-    """Decorator to map regex patterns to reverse lookup functions"""
+    """Decorator to map regex patterns to reverse lookup functions.
+
+    A reverse lookup function receives a list of tuples of the groups matched
+    by the pattern in a number of metric paths, and returns a dict mapping
+    these tuples to objects.
+
+    """
     try:
         pattern.pattern
     except AttributeError:
@@ -58,50 +123,91 @@ def reverses(pattern):
 ### Reverse lookup functions
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)\.ports\.(?P<ifname>[^\.]+)')
-def _reverse_interface(sysname, ifname):
-    return _single_like_match(Interface, related=['netbox'],
-                              sysname=sysname, ifname=ifname)
+def _reverse_interface(keys):
+    return _escaped_match(
+        Interface, keys, ['netbox.sysname', 'interface.ifname'],
+        lambda ifc: (ifc.netbox.sysname, ifc.ifname), related=['netbox'])
 
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)\.sensors\.(?P<name>[^\.]+)')
-def _reverse_sensor(sysname, name):
-    return _single_like_match(Sensor, related=['netbox'],
-                              sysname=sysname, internal_name=name)
+def _reverse_sensor(keys):
+    return _escaped_match(
+        Sensor, keys, ['netbox.sysname', 'sensor.internal_name'],
+        lambda sensor: (sensor.netbox.sysname, sensor.internal_name),
+        related=['netbox'])
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)\.cpu\.(?P<name>[^\.]+)')
-def _reverse_cpu(sysname, name):
-    return _single_like_match(Netbox, sysname=sysname)
+def _reverse_cpu(keys):
+    return _netbox_match(keys)
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)\.system\.(?P<name>[^\.]+)')
-def _reverse_system(sysname, name):
-    return _single_like_match(Netbox, sysname=sysname)
+def _reverse_system(keys):
+    return _netbox_match(keys)
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)\.ping\.(?P<name>[^\.]+)')
-def _reverse_ping(sysname, name):
-    return _single_like_match(Netbox, sysname=sysname)
+def _reverse_ping(keys):
+    return _netbox_match(keys)
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)\.ipdevpoll\.(?P<name>[^\.]+)')
-def _reverse_ipdevpoll(sysname, name):
-    return _single_like_match(Netbox, sysname=sysname)
+def _reverse_ipdevpoll(keys):
+    return _netbox_match(keys)
 
 @reverses(r'\.devices\.(?P<sysname>[^.]+)$')
-def _reverse_device(sysname):
-    return _single_like_match(Netbox, sysname=sysname)
+def _reverse_device(keys):
+    return _netbox_match(keys)
 
 
 @reverses(r'\.prefixes\.(?P<netaddr>[^.]+)')
-def _reverse_prefix(netaddr):
-    return _single_like_match(Prefix, netaddr=netaddr)
+def _reverse_prefix(keys):
+    return _escaped_match(Prefix, keys, ['prefix.netaddr'],
+                          lambda prefix: (prefix.net_address,))
 
 
 ### Helper functions
 
-def _single_like_match(model, related=None, **kwargs):
-    args = [("{field}::TEXT LIKE %s".format(field=key), value)
-            for key, value in kwargs.iteritems()]
-    where, params = zip(*args)
+def _netbox_match(keys):
+    return _escaped_match(Netbox, keys, ['netbox.sysname'],
+                          lambda netbox: (netbox.sysname,))
+
+
+def _escaped_match(model, keys, columns, get_names, related=None):
+    """Looks up model objects by escaped names.
+
+    :param keys: A list of tuples of escaped names, as found in metric paths.
+                 Only the first len(columns) elements of each tuple are used
+                 in the lookup.
+    :param columns: A list of SQL column expressions that correspond to the
+                    elements of the keys.
+    :param get_names: A function that returns a tuple of the unescaped names
+                      of an object, corresponding to the columns.
+    :param related: A list of related fields to select along with the
+                    objects.
+    :returns: A dict of {key: object} items.  Keys that don't match exactly
+              one object are omitted.
+
+    """
+    size = len(columns)
+    where = []
+    params = []
+    for index, column in enumerate(columns):
+        where.append(ESCAPED_COLUMN.format(column=column) + " IN %s")
+        params.append(tuple(set(key[index] for key in keys)))
+
     qset = model.objects.extra(where=where, params=params)
     if related:
         qset = qset.select_related(*related)
-    if len(qset) == 1:
-        return qset[0]
+
+    wanted = set(key[:size] for key in keys)
+    matches = defaultdict(list)
+    for obj in qset:
+        names = tuple(escape_metric_name(unicode(name))
+                      for name in get_names(obj))
+        if names in wanted:
+            matches[names].append(obj)
+
+    result = {}
+    for key in keys:
+        objects = matches.get(key[:size], [])
+        if len(objects) == 1:
+            result[key] = objects[0]
+    return result
@@ -15,7 +15,8 @@
 #
 """Provides reverse lookups for metrics"""
 
-from nav.models.manage import Netbox, Prefix
+from nav.models.manage import Netbox, Prefix, Interface
+from nav.metrics.lookup import lookup_many
 from nav.metrics.templates import (metric_prefix_for_device,
                                    metric_prefix_for_interface,
                                    metric_prefix_for_prefix)
@@ -35,20 +36,32 @@ def metric_reverse(metrics):
 
 def device_reverse(metrics):
     """Tries to reverse metric to a netbox object"""
-    return get_reverses(get_device_lookups(), metrics)
+    return _bulk_reverse(metrics, 3, Netbox)
 
 
 def prefix_reverse(metrics):
     """Tries to reverse metric to a prefix object"""
-    return get_reverses(get_prefix_lookups(), metrics)
+    return _bulk_reverse(metrics, 3, Prefix)
 
 
 def interface_reverse(metrics):
     """Tries to reverse metric to an interface object"""
-    reverses = device_reverse(metrics)
-    if reverses:
-        netboxes = reverses.values()
-        return get_reverses(get_interface_lookups(netboxes), metrics, 5)
+    return _bulk_reverse(metrics, 5, Interface)
+
+
+def _bulk_reverse(metrics, metric_index, model):
+    """Maps metrics to model objects using a bulk lookup of the first
+    metric_index parts of each metric.
+
+    """
+    prefixes = dict((metric, shorten(metric, metric_index))
+                    for metric in metrics)
+    objects = lookup_many(set(prefixes.values()))
+    results = {}
+    for metric, prefix in prefixes.items():
+        obj = objects.get(prefix)
+        results[metric] = obj if isinstance(obj, model) else None
+    return results
 
 
 def get_device_lookups():
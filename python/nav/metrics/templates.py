@@ -98,6 +98,16 @@ def metric_path_for_sysuptime(sysname):
     return tmpl.format(system=metric_prefix_for_system(sysname))
 
 
+def metric_path_for_threshold_rule(rule_id, timer):
+    tmpl = "nav.thresholdmon.rules.{rule_id}.{timer}"
+    return tmpl.format(rule_id=rule_id, timer=escape_metric_name(timer))
+
+
+def metric_path_for_thresholdmon_scan(timer):
+    tmpl = "nav.thresholdmon.scan.{timer}"
+    return tmpl.format(timer=escape_metric_name(timer))
+
+
 def metric_prefix_for_cpu(sysname):
     tmpl = "{device}.cpu"
     return tmpl.format(device=metric_prefix_for_device(sysname))
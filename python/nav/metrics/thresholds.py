@@ -70,7 +70,7 @@ from nav.metrics.graphs import get_metric_meta, extract_series_name
 
 # Pattern to extract the ID of a metric from a series name returned in a
 # Graphite render response.
-from nav.metrics.lookup import lookup
+from nav.metrics.lookup import lookup, lookup_many
 from nav.models.manage import Interface
 
 
@@ -131,11 +131,26 @@ class ThresholdEvaluator(object):
         """
         Retrieves actual values from Graphite based on the evaluators target.
         """
-        start = "-{0}".format(interval_to_graphite(self.period))
         averages = get_metric_average(
-            self.target, start=start, end='now', ignore_unknown=True)
+            self.target, start=self.get_start(), end='now',
+            ignore_unknown=True)
         _logger.debug("retrieved %d values from graphite for %r",
                       len(averages), self.target)
+        return self.set_values(averages)
+
+    def get_start(self):
+        """Returns the Graphite start time specification of this evaluator's
+        period.
+        """
+        return "-{0}".format(interval_to_graphite(self.period))
+
+    def set_values(self, averages):
+        """
+        Sets the values to evaluate from already retrieved Graphite data.
+
+        :param averages: A dict of {series_name: average_value} items, as
+                         returned by get_metric_average().
+        """
         self.result = dict((extract_series_name(key), dict(value=value))
                            for key, value in averages.iteritems())
         return self.result
@@ -165,6 +180,10 @@ class ThresholdEvaluator(object):
             raise InvalidExpressionError(expression)
         value = float(match.group('value'))
         percent = bool(match.group('percent'))
+        if percent:
+            # look up the objects of all the metrics in one go, rather than
+            # one by one in get_metric_maximum()
+            lookup_many(self.result.keys())
         oper = match.group('operator')
         if oper == '<':
             matcher = partial(self._lt, value, percent)
@@ -315,6 +315,14 @@ class AlertAddress(models.Model):
     def __unicode__(self):
         return self.type.scheme() + self.address
 
+    def get_language(self):
+        """Returns the right language for alerts sent to the user"""
+        try:
+            return self.account.accountproperty_set.get(
+                property='language').value or 'en'
+        except AccountProperty.DoesNotExist:
+            return 'en'
+
     @transaction.commit_manually
     def send(self, alert, subscription, dispatcher={}):
         """Handles sending of alerts to with defined alert notification types
@@ -323,12 +331,7 @@ class AlertAddress(models.Model):
 
         logger = logging.getLogger('nav.alertengine.alertaddress.send')
 
-        # Determine the right language for the user.
-        try:
-            lang = self.account.accountproperty_set.get(
-                property='language').value or 'en'
-        except AccountProperty.DoesNotExist:
-            lang = 'en'
+        lang = self.get_language()
 
         if not (self.address or '').strip():
             logger.error(
@@ -412,6 +415,13 @@ class AlertSender(models.Model):
 
     def send(self, *args, **kwargs):
         """Sends an alert via this medium."""
+        return self.get_handler().send(*args, **kwargs)
+
+    def get_handler(self):
+        """Returns the dispatcher instance of this medium, loading it on first
+        use.
+
+        """
         if self.handler not in self._handlers:
             # Get config
             if not hasattr(AlertSender, 'config'):
@@ -428,8 +438,16 @@ class AlertSender(models.Model):
                 module, self.handler)(config=AlertSender.config.get(
                     self.handler, {}))
 
-        # Delegate sending of message
-        return self._handlers[self.handler].send(*args, **kwargs)
+        return self._handlers[self.handler]
+
+    @classmethod
+    def close_handlers(cls):
+        """Tells all loaded dispatchers that the current alertengine run has
+        ended.
+
+        """
+        for handler in cls._handlers.values():
+            handler.close()
 
     def blacklist(self, reason=None):
         """Blacklists this sender/medium from further alert dispatch."""
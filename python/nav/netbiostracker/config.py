@@ -29,6 +29,7 @@ class NetbiosTrackerConfig(NAVConfigParser):
     DEFAULT_CONFIG = """
 [main]
 encoding = cp850
+workers = 4
 """
 
     def get_exceptions(self):
@@ -44,6 +45,14 @@ encoding = cp850
         """Get the encoding option"""
         return self.get('main', 'encoding')
 
+    def get_workers(self):
+        """Get the number of concurrent scanner processes to use"""
+        try:
+            return max(self.getint('main', 'workers'), 1)
+        except ValueError:
+            _logger.error('Invalid number of workers, using default')
+            return 4
+
 
 def create_list(exceptions):
     """Create a list of single ip-adresses from a list of IP instances"""
@@ -15,11 +15,20 @@
 # more details. You should have received a copy of the GNU General Public
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""Module for doing netbios scans"""
+"""Module for doing netbios scans
+
+Addresses are scanned by several concurrent nbtscan processes, whose output
+is parsed line by line as it arrives.  The results are compared to the open
+entries in the netbios table, and the differences are written back in bulk.
+
+"""
 import logging
+import tempfile
+import threading
 from collections import namedtuple
 from datetime import datetime
 from functools import wraps
+from Queue import Queue
 from time import time
 from subprocess import Popen, PIPE
 from nav.models.manage import Arp, Netbios
@@ -27,6 +36,9 @@ from nav.macaddress import MacAddress
 from django.db.transaction import commit_on_success
 
 SPLITCHAR = '!'
+DEFAULT_WORKERS = 4
+# The max number of rows updated or inserted by each database query
+BATCH_SIZE = 1000
 
 # pylint: disable=C0103
 NetbiosResult = namedtuple('NetbiosResult',
@@ -70,27 +82,101 @@ def get_addresses_to_scan(exclude_list=None):
         where=['family(ip)=4']).distinct('ip').values_list('ip', flat=True)
     return [str(ip) for ip in addresses if not _is_excluded(ip)]
 
-@timed
-def scan(addresses):
-    """Scan a list of ip-addresses for netbios names"""
+def scan(addresses, workers=DEFAULT_WORKERS):
+    """Scan a list of ip-addresses for netbios names
+
+    The addresses are divided between a number of concurrent nbtscan
+    processes.
+
+    :returns: An iterator over the lines of output from all the scanners,
+              in the order they arrive.  As the scan runs while the iterator
+              is consumed, its duration is included in the timing of parse().
+
+    """
+    _logger.debug('Scanning %s addresses using %s scanners',
+                  len(addresses), workers)
+    shards = split(addresses, workers)
+    lines = Queue()
+    for shard in shards:
+        thread = threading.Thread(target=_run_scanner, args=(shard, lines))
+        thread.daemon = True
+        thread.start()
+    return _read_output(lines, len(shards))
+
+
+def split(addresses, parts):
+    """Splits a list of addresses into at most parts lists of equal size"""
+    parts = max(min(parts, len(addresses)), 1)
+    size = max(-(-len(addresses) // parts), 1)
+    return [addresses[x:x+size] for x in xrange(0, len(addresses), size)]
 
-    _logger.debug('Scanning %s addresses' % len(addresses))
-    proc = Popen(['nbtscan', '-f-', '-s', SPLITCHAR], stdin=PIPE, stdout=PIPE)
-    stdout, stderr = proc.communicate('\n'.join(addresses))
-    if stderr:
-        raise Exception(stderr)
 
-    _logger.debug('Result from scan:\n%s', stdout)
-    return stdout
+def _run_scanner(addresses, lines):
+    """Scans addresses using nbtscan, putting each line of output on the
+    lines queue, followed by None and an error message, if any, when done.
+
+    Anything nbtscan writes to stderr is logged as warnings.  Only a non-zero
+    exit status is considered a scanner failure.
+
+    """
+    error = None
+    try:
+        with tempfile.NamedTemporaryFile(prefix='netbiostracker') as infile:
+            infile.write('\n'.join(addresses))
+            infile.flush()
+            proc = Popen(['nbtscan', '-f', infile.name, '-s', SPLITCHAR],
+                         stdout=PIPE, stderr=PIPE)
+            stderr_logger = threading.Thread(target=_log_stderr,
+                                             args=(proc.stderr,))
+            stderr_logger.daemon = True
+            stderr_logger.start()
+            for line in iter(proc.stdout.readline, ''):
+                lines.put(line)
+            returncode = proc.wait()
+            stderr_logger.join()
+            if returncode:
+                error = 'nbtscan exited with status %d' % returncode
+    except Exception, err:  # pylint: disable=W0703
+        error = str(err)
+    lines.put(None)
+    lines.put(error)
+
+
+def _log_stderr(stream):
+    """Logs each line read from a scanner's stderr stream as a warning"""
+    for line in iter(stream.readline, ''):
+        _logger.warning('nbtscan: %s', line.rstrip('\n'))
+
+
+def _read_output(lines, scanners):
+    """Yields lines from the lines queue until all scanners are done"""
+    errors = []
+    while scanners:
+        line = lines.get()
+        if line is None:
+            scanners -= 1
+            error = lines.get()
+            if error:
+                errors.append(error)
+        else:
+            yield line
+    if errors:
+        raise Exception('\n'.join(errors))
 
 
 @timed
 def parse(output, encoding=None):
-    """Parse the results from a netbios scan"""
+    """Parse the results from a netbios scan
 
-    results = output.split('\n')
+    :param output: The output from a scan, either as a string or as an
+                   iterator over its lines.
+
+    """
+    if isinstance(output, basestring):
+        output = output.split('\n')
     parsed_results = []
-    for result in results:
+    for result in output:
+        result = result.rstrip('\n')
         if result:
             try:
                 args = [wash(x, encoding) for x in result.split(SPLITCHAR)]
@@ -112,6 +198,7 @@ def wash(string, encoding='cp850'):
 
 
 @timed
+@commit_on_success
 def update_database(netbiosresults):
     """Update database with results from a scan
 
@@ -132,7 +219,7 @@ def update_database(netbiosresults):
     entries_to_end = database_set - scan_set
     entries_to_create = scan_set - database_set
 
-    set_end_time(database_entries, entries_to_end)
+    set_end_time([database_entries[key] for key in entries_to_end])
     create_entries(entries_to_create)
 
 
@@ -143,31 +230,31 @@ def fetch_database_entries():
     Create a structure that is suitable for comparing as a set with other
     structures
 
+    :returns: A dict mapping (ip, name, server, username, mac) tuples to the
+              ids of the entries.
+
     """
-    database_entries = {}
-    for entry in Netbios.objects.filter(end_time=datetime.max):
-        database_entries[(entry.ip, entry.name, entry.server, entry.username,
-                          entry.mac)] = entry
-    return database_entries
+    entries = Netbios.objects.filter(end_time=datetime.max).values_list(
+        'id', 'ip', 'name', 'server', 'username', 'mac')
+    return dict((tuple(entry[1:]), entry[0]) for entry in entries.iterator())
 
 
 @timed
-@commit_on_success
-def set_end_time(database_entries, entries_to_end):
-    """End the entries given"""
-    _logger.debug('Ending %s entries', len(entries_to_end))
-    for key in entries_to_end:
-        entry = database_entries[key]
-        entry.end_time = datetime.now()
-        entry.save()
+def set_end_time(entry_ids):
+    """End the entries with the given ids"""
+    _logger.debug('Ending %s entries', len(entry_ids))
+    now = datetime.now()
+    for x in xrange(0, len(entry_ids), BATCH_SIZE):
+        Netbios.objects.filter(id__in=entry_ids[x:x+BATCH_SIZE]).update(
+            end_time=now)
 
 
 @timed
-@commit_on_success
 def create_entries(entries_to_create):
     """Create new netbios entries for the data given"""
     _logger.debug('Creating %s new entries', len(entries_to_create))
-    for entry in entries_to_create:
-        netbios = Netbios(ip=entry.ip, mac=entry.mac or None, name=entry.name,
-                          server=entry.server, username=entry.username)
-        netbios.save()
+    Netbios.objects.bulk_create(
+        [Netbios(ip=entry.ip, mac=entry.mac or None, name=entry.name,
+                 server=entry.server, username=entry.username)
+         for entry in entries_to_create],
+        batch_size=BATCH_SIZE)
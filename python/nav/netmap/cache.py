@@ -0,0 +1,96 @@
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Caching of netmap's base topology graphs.
+
+Building the netmap topology from the database is expensive, but the result
+only changes when navtopology has run, or when ipdevpoll has changed
+interfaces that are part of the topology.  The JSON-ready base topology of
+each layer is therefore cached, keyed by a generation token that is replaced
+whenever the topology is invalidated.
+
+The generation token is the value of a database sequence, as the processes
+that invalidate the topology cannot be expected to be able to write to the
+web server's cache.
+
+Everything that may differ between views or requests, such as node
+positions, netbox status and traffic load, is kept out of the cached base
+topology and must be overlaid by the caller.
+
+"""
+import hashlib
+import logging
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils import simplejson
+
+_logger = logging.getLogger(__name__)
+
+GENERATION_SQL = ("SELECT last_value, is_called "
+                  "FROM manage.netmap_topology_version_seq")
+INVALIDATE_SQL = "SELECT nextval('manage.netmap_topology_version_seq')"
+TOPOLOGY_KEY = 'netmap:topology:layer%s:%s'
+# Upper bound on the life of a cached topology, in case of changes that
+# don't invalidate it, such as netbox details edited in SeedDB
+TOPOLOGY_TIMEOUT = 60 * 60
+
+
+def get_generation():
+    """Returns the current topology generation token"""
+    cursor = connection.cursor()
+    cursor.execute(GENERATION_SQL)
+    return '%s.%s' % cursor.fetchone()
+
+
+def invalidate_topology_cache():
+    """Invalidates all cached netmap topologies"""
+    _logger.debug("invalidating cached netmap topologies")
+    cursor = connection.cursor()
+    cursor.execute(INVALIDATE_SQL)
+
+
+def get_topology(layer, build, generation=None):
+    """Returns the cached base topology of a layer, building it if necessary.
+
+    :param layer: The topology layer, 2 or 3.
+    :param build: A callable that builds the base topology for this layer.
+                  Its return value must be picklable.
+    :param generation: The generation token to look up, or None to use the
+                       current one.
+    :returns: The topology dict returned by build, with an added 'digest'
+              item; a digest of its 'json' item, which changes whenever a
+              rebuild changes the topology.
+
+    """
+    if generation is None:
+        generation = get_generation()
+    key = TOPOLOGY_KEY % (layer, generation)
+    topology = cache.get(key)
+    if topology is None:
+        _logger.debug("building layer %s netmap topology", layer)
+        topology = build()
+        topology['digest'] = hashlib.sha1(
+            simplejson.dumps(topology['json'], sort_keys=True)).hexdigest()
+        cache.set(key, topology, TOPOLOGY_TIMEOUT)
+    return topology
+
+
+def make_etag(*parts):
+    """Makes an entity tag from the repr of the given parts"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(repr(part))
+    return '"%s"' % digest.hexdigest()
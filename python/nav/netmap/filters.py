@@ -0,0 +1,140 @@
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Server-side pruning of netmap base topologies.
+
+The functions in this module work on the JSON-ready base topologies built by
+the netmap graph API, so that the nodes and links that a view won't show are
+dropped before any per-request data is overlaid on them.
+
+"""
+from collections import defaultdict, deque
+
+ELINK_CATEGORY = 'ELINK'
+
+
+def filter_topology(topology, categories=None, locations=None, focus=None,
+                    depth=1):
+    """Returns a copy of a base topology pruned to the nodes that match the
+    given filters, and the links and vlans between them.
+
+    :param topology: A base topology dict, as built by the netmap views.
+    :param categories: A collection of category ids to include, or None to
+                       include all.  Elink nodes are included by the ELINK
+                       category.
+    :param locations: A collection of location ids to include, or None to
+                      include all.  Elink nodes are not filtered by
+                      location.
+    :param focus: The id of a node to focus on, or None.  When set, only
+                  nodes within depth hops of the focus node are included.
+    :param depth: The number of hops around the focus node to include.
+
+    """
+    json = topology['json']
+    nodes = dict((node_id, node) for node_id, node in json['nodes'].items()
+                 if _node_matches(node, categories, locations))
+    links = [(index, link) for index, link in enumerate(json['links'])
+             if link['source'] in nodes and link['target'] in nodes]
+
+    if focus is not None:
+        keep = get_neighbourhood([link for _, link in links], focus, depth)
+        nodes = dict((node_id, node) for node_id, node in nodes.items()
+                     if node_id in keep)
+        links = [(index, link) for index, link in links
+                 if link['source'] in keep and link['target'] in keep]
+
+    # elink nodes only exist as the far end of links
+    linked = set()
+    for _, link in links:
+        linked.add(link['source'])
+        linked.add(link['target'])
+    nodes = dict((node_id, node) for node_id, node in nodes.items()
+                 if node_id in linked or not node['is_elink_node'])
+
+    new_index = dict((old, new) for new, (old, _) in enumerate(links))
+    port_pairs = [((new_index[path[0]],) + path[1:], pair)
+                  for path, pair in topology['port_pairs']
+                  if path[0] in new_index]
+    links = [link for _, link in links]
+
+    return {
+        'json': {
+            'vlans': _filter_vlans(json['vlans'], nodes, links),
+            'nodes': nodes,
+            'links': links,
+        },
+        'port_pairs': port_pairs,
+    }
+
+
+def get_neighbourhood(links, focus, depth):
+    """Returns the set of node ids that are at most depth hops away from the
+    focus node along links.
+
+    """
+    neighbours = defaultdict(set)
+    for link in links:
+        neighbours[link['source']].add(link['target'])
+        neighbours[link['target']].add(link['source'])
+
+    found = set([focus])
+    queue = deque([(focus, 0)])
+    while queue:
+        node, distance = queue.popleft()
+        if distance >= depth:
+            continue
+        for neighbour in neighbours[node] - found:
+            found.add(neighbour)
+            queue.append((neighbour, distance + 1))
+    return found
+
+
+def find_node(nodes, name):
+    """Returns the id of the node in nodes whose id or sysname is name, or
+    None if there is no such node.
+
+    """
+    if name in nodes:
+        return name
+    for node_id, node in nodes.iteritems():
+        if node['sysname'] == name:
+            return node_id
+
+
+def _node_matches(node, categories, locations):
+    if node['is_elink_node']:
+        return categories is None or ELINK_CATEGORY in categories
+    if categories is not None and node['category'] not in categories:
+        return False
+    return locations is None or node['locationid'] in locations
+
+
+def _filter_vlans(vlans, nodes, links):
+    """Filters the vlans of a layer 2 or layer 3 topology to those referred
+    to by the remaining nodes and links.
+
+    """
+    used = set()
+    for node in nodes.itervalues():
+        used.update(node.get('vlans', ()))
+    for link in links:
+        used.update(link.get('vlans', ()))
+        if isinstance(link['edges'], dict):
+            used.update(link['edges'])
+
+    if isinstance(vlans, dict):
+        return dict((vlan_id, vlan) for vlan_id, vlan in vlans.items()
+                    if vlan_id in used)
+    return [vlan for vlan in vlans if vlan['nav_vlan'] in used]
@@ -16,6 +16,8 @@
 #
 """Represents the meta information and result from a database query."""
 
+import uuid
+
 from nav import db
 import psycopg2
 
@@ -62,3 +64,64 @@ class DatabaseResult(object):
             #raise ProblemExistBetweenKeyboardAndChairException
             self.error = ("Configuration error! The report generator is not "
                           "able to do such things. " + str(error))
+
+
+class StreamedResult(object):
+    """The results of a report query, streamed from a server side cursor.
+
+    The query is executed when the object is created, so that errors can be
+    reported before any rows are consumed.  Iterating yields the result rows,
+    which are fetched from the database batch_size rows at a time.
+
+    """
+    BATCH_SIZE = 1000
+
+    def __init__(self, report_config, batch_size=BATCH_SIZE):
+        """Executes the report query.
+
+        :param report_config: a ReportConfig object containing the SQL query.
+                              Its sql_select attribute is set to the column
+                              names of the result.
+        :param batch_size: the number of rows to fetch at a time.
+        :raises psycopg2.Error: if the query fails.
+
+        """
+        self.sql = report_config.make_sql()
+        self.batch_size = batch_size
+
+        self._connection = db.getConnection('default')
+        self._cursor = self._connection.cursor(
+            'report_%s' % uuid.uuid4().hex)
+        try:
+            self._cursor.execute(self.sql)
+            # column names are only known after the first fetch from a
+            # server side cursor
+            self._batch = self._cursor.fetchmany(self.batch_size)
+        except psycopg2.Error:
+            self.close()
+            raise
+        report_config.sql_select = [column[0]
+                                    for column in self._cursor.description]
+
+    def __iter__(self):
+        try:
+            while self._batch:
+                batch, self._batch = self._batch, None
+                for row in batch:
+                    yield row
+                if len(batch) == self.batch_size:
+                    self._batch = self._cursor.fetchmany(self.batch_size)
+        finally:
+            self.close()
+
+    def close(self):
+        """Closes the cursor and ends its transaction"""
+        if self._cursor is None:
+            return
+        cursor, self._cursor = self._cursor, None
+        self._batch = None
+        try:
+            cursor.close()
+        except psycopg2.Error:
+            pass
+        self._connection.rollback()
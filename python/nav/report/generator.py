@@ -54,16 +54,7 @@ class Generator(object):
                 return None, None, None, None, None, None, None
 
         arg_parser = ArgumentParser(config)
-
-        # Remove non-query arguments
-        if "export" in args:
-            del args["export"]
-
-        if "exportcsv" in args:
-            del args["exportcsv"]
-            # Export *everything* in CSV file
-            args["offset"] = 0
-            args["limit"] = 0
+        strip_export_arguments(args)
 
         if "adv" in args:
             if args["adv"]:
@@ -89,6 +80,42 @@ class Generator(object):
             return report, contents, neg, operator, advanced, config, dbresult
 
 
+    def make_export_config(self, report_name, config_file, config_file_local,
+                           query_dict):
+        """Makes the configuration of a report export, without running the
+        report query.
+
+        :returns: A ReportConfig object whose make_sql() method returns the
+                  query of the entire report, or None if there is no such
+                  report.
+
+        """
+        conf_parser = ConfigParser(config_file, config_file_local)
+        if not conf_parser.parse_report(report_name):
+            return None
+        config = conf_parser.configuration
+
+        args = dict(query_dict.items())
+        strip_export_arguments(args)
+        args.pop("adv", None)
+        ArgumentParser(config).parse_query(args)
+        return config
+
+
+def strip_export_arguments(args):
+    """Removes export related arguments from a dict of query arguments"""
+    # Remove non-query arguments
+    if "export" in args:
+        del args["export"]
+
+    for export in ("exportcsv", "exportjson"):
+        if export in args:
+            del args[export]
+            # Export *everything*
+            args["offset"] = 0
+            args["limit"] = 0
+
+
 class ReportList(object):
 
     def __init__(self, config_file):
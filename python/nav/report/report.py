@@ -457,6 +457,7 @@ class Table(object):
 
 class Row(object):
     """A row of a table"""
+    __slots__ = ('cells',)
 
     def __init__(self):
         self.cells = []
@@ -472,7 +473,7 @@ class Row(object):
 
 class Cell(object):
     """One cell of the table"""
-    text = uri = explanation = sum = None
+    __slots__ = ('text', 'uri', 'explanation', 'sum')
 
     def __init__(self, text=u"", uri=u"", explanation=u""):
         self.set_text(text)
@@ -513,6 +514,56 @@ class Cell(object):
         self.sum = unicode_utf8(colsum)
 
 
+class ExportFormatter(object):
+    """Formats raw result rows of a report for export, using the same columns
+    and column titles as the report table.
+
+    """
+
+    def __init__(self, configuration):
+        """
+        :param configuration: a ReportConfig object, whose sql_select
+                              attribute lists the columns of the result rows.
+
+        """
+        fields = configuration.sql_select + configuration.extra
+        self.shown = [num for num, field in enumerate(fields)
+                      if field not in configuration.hidden]
+        self.fields = [fields[num] for num in self.shown]
+        self.headers = [unicode_utf8(configuration.name.get(field, field))
+                        for field in self.fields]
+        # extra columns are not part of the result, and show their names
+        self._constants = dict(
+            (index, unicode_utf8(field))
+            for index, field in enumerate(self.fields)
+            if field in configuration.extra)
+
+    def format_row(self, row):
+        """Returns the shown values of a result row as a list of unicode
+        strings, with None for NULL values.
+
+        """
+        return [self._constants[index] if index in self._constants
+                else unicode_utf8(row[num])
+                for index, num in enumerate(self.shown)]
+
+    def format_values(self, row):
+        """Returns the shown values of a result row as a list, keeping
+        numbers and booleans as they are, and converting other values to
+        unicode strings.
+
+        """
+        return [self._constants[index] if index in self._constants
+                else _json_value(row[num])
+                for index, num in enumerate(self.shown)]
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    return unicode_utf8(value)
+
+
 class Headers(object):
     """The top row of the report table. Where the titles and descriptions
     etc, is displayed.
@@ -0,0 +1,256 @@
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Decoupled trap reception and handling for snmptrapd.
+
+The trap listener's callback should only decode a trap and put it on a
+bounded queue, so that it can get back to reading the trap socket as quickly
+as possible.  A pool of worker processes consume the queue and run the trap
+handler modules.  When the queue is filling up, traps are shed according to
+the priority of their snmpTrapOID.
+
+"""
+from Queue import Empty, Full
+import logging
+import multiprocessing
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: 'high', NORMAL: 'normal', LOW: 'low'}
+
+# Traps of a given priority are shed when the queue is filled to or beyond
+# this fraction of its capacity.  High priority traps are only dropped when
+# the queue is completely full.
+SHED_LEVELS = {LOW: 0.5, NORMAL: 0.9, HIGH: 1.0}
+
+STATS_INTERVAL = 60
+
+
+class TrapPriorities(object):
+    """Classifies traps by their snmpTrapOID.
+
+    :param high: A list of OID prefixes of high priority traps.
+    :param low: A list of OID prefixes of low priority traps.
+
+    Any trap whose OID doesn't match any of the prefixes has normal priority.
+    The longest matching prefix wins.
+
+    """
+    def __init__(self, high=(), low=()):
+        self._prefixes = sorted(
+            [(_normalize_oid(oid), HIGH) for oid in high if oid.strip()] +
+            [(_normalize_oid(oid), LOW) for oid in low if oid.strip()],
+            key=lambda item: len(item[0]),
+            reverse=True)
+        self._cache = {}
+
+    def get_priority(self, trap_oid):
+        """Returns the priority of a trap with the given snmpTrapOID"""
+        try:
+            return self._cache[trap_oid]
+        except KeyError:
+            pass
+
+        oid = _normalize_oid(trap_oid)
+        priority = NORMAL
+        for prefix, prio in self._prefixes:
+            if oid == prefix or oid.startswith(prefix + '.'):
+                priority = prio
+                break
+        if len(self._cache) < 10000:
+            self._cache[trap_oid] = priority
+        return priority
+
+
+def _normalize_oid(oid):
+    return '.' + str(oid).strip().strip('.')
+
+
+class TrapDispatcher(object):
+    """Queues received traps for handling by a pool of worker processes.
+
+    :param handler: A callable that handles a single trap.  It is called in
+                    the worker processes.
+    :param workers: The number of worker processes to run.
+    :param queue_size: The maximum number of traps waiting to be handled.
+    :param batch_size: The maximum number of traps a worker will take off
+                       the queue in one go.
+    :param priorities: A TrapPriorities instance, used for shedding load.
+    :param batch_handler: A callable that will be called with the handler
+                          and a list of traps by the worker processes. Can be
+                          used to wrap the handling of a batch of traps in
+                          a transaction or similar.
+
+    """
+    def __init__(self, handler, workers=2, queue_size=10000, batch_size=100,
+                 priorities=None, batch_handler=None, queue=None):
+        self.handler = handler
+        self.batch_handler = batch_handler or handle_batch
+        self.num_workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.priorities = priorities or TrapPriorities()
+        if queue is None:
+            queue = multiprocessing.Queue(queue_size)
+        self.queue = queue
+
+        self.received = 0
+        self.queued = 0
+        self.dropped = dict((prio, 0) for prio in PRIORITY_NAMES)
+        self.handled = multiprocessing.Value('L', 0)
+        self.workers = []
+        self._last_stats = time.time()
+        self._receiver_pid = os.getpid()
+
+    def in_receiver(self):
+        """Returns True if called from the trap receiving process, False if
+        called from one of the worker processes.
+
+        """
+        return os.getpid() == self._receiver_pid
+
+    def start(self):
+        """Starts the worker processes.
+
+        Any open database connections should be closed before this is
+        called, to avoid sharing them with the worker processes.
+
+        """
+        while len(self.workers) < self.num_workers:
+            worker = multiprocessing.Process(
+                target=worker_loop,
+                args=(self.queue, self.handler, self.batch_handler,
+                      self.batch_size, self.handled))
+            worker.daemon = True
+            worker.start()
+            _logger.debug("started trap handler worker, pid=%s", worker.pid)
+            self.workers.append(worker)
+
+    def stop(self):
+        """Stops all worker processes"""
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.workers:
+            worker.join(5)
+        self.workers = []
+
+    def signal_workers(self, signum):
+        """Sends the signal signum to all worker processes"""
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+
+    def receive(self, trap):
+        """Receives a trap from a TrapListener, and puts it on the queue,
+        unless it needs to be shed.
+
+        """
+        self.received += 1
+        priority = self.priorities.get_priority(trap.snmpTrapOID)
+        if self._should_shed(priority):
+            self._drop(trap, priority)
+        else:
+            try:
+                self.queue.put_nowait(trap)
+            except Full:
+                self._drop(trap, priority)
+            else:
+                self.queued += 1
+
+        if time.time() - self._last_stats >= STATS_INTERVAL:
+            self.log_stats()
+            self.restart_dead_workers()
+
+    def _should_shed(self, priority):
+        if priority == HIGH:
+            return False
+        try:
+            size = self.queue.qsize()
+        except NotImplementedError:
+            return False
+        return size >= SHED_LEVELS[priority] * self.queue_size
+
+    def _drop(self, trap, priority):
+        self.dropped[priority] += 1
+        _logger.debug("dropped %s priority trap %s from %s",
+                      PRIORITY_NAMES[priority], trap.snmpTrapOID, trap.agent)
+
+    def get_stats(self):
+        """Returns a dict of trap counters"""
+        stats = dict(received=self.received, queued=self.queued,
+                     handled=self.handled.value,
+                     dropped=sum(self.dropped.values()))
+        for priority, count in self.dropped.items():
+            stats['dropped_' + PRIORITY_NAMES[priority]] = count
+        return stats
+
+    def log_stats(self):
+        """Logs the current trap counters"""
+        self._last_stats = time.time()
+        stats = self.get_stats()
+        log = _logger.warning if stats['dropped'] else _logger.info
+        log("traps received: %(received)d, queued: %(queued)d, "
+            "handled: %(handled)d, dropped: %(dropped)d "
+            "(high: %(dropped_high)d, normal: %(dropped_normal)d, "
+            "low: %(dropped_low)d)", stats)
+
+    def restart_dead_workers(self):
+        """Replaces any worker processes that have died"""
+        dead = [worker for worker in self.workers if not worker.is_alive()]
+        for worker in dead:
+            _logger.error("trap handler worker %s died with exit code %s, "
+                          "restarting", worker.pid, worker.exitcode)
+            self.workers.remove(worker)
+        if dead:
+            self.start()
+
+
+def worker_loop(queue, handler, batch_handler, batch_size, handled):
+    """Main loop of a trap handler worker process"""
+    try:
+        while True:
+            traps = get_batch(queue, batch_size)
+            try:
+                batch_handler(handler, traps)
+            except Exception:
+                _logger.exception("Unhandled error while handling traps")
+            with handled.get_lock():
+                handled.value += len(traps)
+    except KeyboardInterrupt:
+        pass
+
+
+def get_batch(queue, batch_size):
+    """Blocks until at least one trap is available on queue, and returns a
+    list of up to batch_size traps.
+
+    """
+    traps = [queue.get()]
+    while len(traps) < batch_size:
+        try:
+            traps.append(queue.get_nowait())
+        except Empty:
+            break
+    return traps
+
+
+def handle_batch(handler, traps):
+    """Calls handler for every trap in traps"""
+    for trap in traps:
+        handler(trap)
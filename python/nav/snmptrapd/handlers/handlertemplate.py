@@ -23,6 +23,7 @@ import nav.errors
 import re
 from nav.db import getConnection
 from nav.event import Event
+from nav.snmptrapd import lookup
 
 
 # Create logger with modulename here
@@ -48,6 +49,15 @@ def handleTrap(trap, config=None):
     # config may be fetched like this
     variable = config.get('template','variable')
 
+    # Look up the netbox that sent the trap (and possibly the interface the
+    # trap concerns) through the shared, cached lookup service instead of
+    # querying the database for every trap.
+    netbox = lookup.get_netbox(trap.agent)
+    if not netbox:
+        return False
+    netboxid = netbox.netboxid
+    interface = lookup.get_interface(netboxid, ifindex)
+
 
     if doSomething:
 
@@ -23,7 +23,7 @@ Climate Monitor, versions 1 and 2.
 import logging
 
 import nav.event
-from nav.db import getConnection
+from nav.snmptrapd import lookup
 
 logger = logging.getLogger('nav.snmptrapd.weathergoose')
 
@@ -182,16 +182,12 @@ class WeatherGoose2(WeatherGoose1):
 def handleTrap(trap, config=None):
     """ This function is called from snmptrapd """
 
-    conn = getConnection('default')
-    cur = conn.cursor()
-    cur.execute("SELECT netboxid, sysname, roomid FROM netbox WHERE ip = %s",
-                (trap.agent,))
-
-    if cur.rowcount < 1:
+    netbox = lookup.get_netbox(trap.agent)
+    if not netbox:
         logger.error("Could not find trapagent %s in database." %trap.agent)
         return False
 
-    netboxid, sysname, roomid = cur.fetchone()
+    netboxid, sysname, roomid = netbox
 
     oid = trap.snmpTrapOID
     for handler_class in WeatherGoose1, WeatherGoose2:
@@ -0,0 +1,186 @@
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Cached netbox and interface lookups for snmptrapd trap handlers.
+
+Trap handlers typically need to map the trap agent's IP address to a netbox,
+and sometimes an ifIndex to an interface.  Doing this with a database query
+per trap is too slow during trap storms, so this module keeps an in-memory
+map of all netbox addresses, and a bounded LRU cache of the interfaces of
+recently seen netboxes.  Both are refreshed periodically and on cache misses.
+
+"""
+from collections import namedtuple, OrderedDict
+import logging
+import threading
+import time
+
+from nav.db import getConnection
+
+_logger = logging.getLogger(__name__)
+
+# pylint: disable=C0103
+NetboxInfo = namedtuple("NetboxInfo", "netboxid sysname roomid")
+InterfaceInfo = namedtuple("InterfaceInfo",
+                           "interfaceid deviceid modulename ifname ifalias")
+
+NETBOX_QUERY = "SELECT ip, netboxid, sysname, roomid FROM netbox"
+INTERFACE_QUERY = """SELECT
+                       ifindex, interfaceid, module.deviceid,
+                       module.name AS modulename,
+                       interface.ifname, interface.ifalias
+                     FROM interface
+                     LEFT JOIN module USING (moduleid)
+                     WHERE interface.netboxid = %s AND ifindex IS NOT NULL"""
+
+
+class TrapLookupCache(object):
+    """Caches agent IP -> netbox and (netbox, ifindex) -> interface mappings.
+
+    :param refresh_interval: Maximum age, in seconds, of cached data.
+    :param miss_interval: Minimum number of seconds between database lookups
+                          caused by cache misses for the same key.
+    :param max_netboxes: Maximum number of netboxes to keep interface details
+                         for.
+
+    """
+    def __init__(self, refresh_interval=300, miss_interval=60,
+                 max_netboxes=1000):
+        self.refresh_interval = refresh_interval
+        self.miss_interval = miss_interval
+        self.max_netboxes = max_netboxes
+
+        self._lock = threading.RLock()
+        self._netboxes = {}
+        self._netboxes_loaded = None
+        self._netbox_misses = {}
+        self._interfaces = OrderedDict()
+
+    def clear(self):
+        """Forgets all cached data"""
+        with self._lock:
+            self._netboxes = {}
+            self._netboxes_loaded = None
+            self._netbox_misses = {}
+            self._interfaces.clear()
+
+    def get_netbox(self, agent):
+        """Returns a NetboxInfo tuple for the netbox with the IP address
+        agent, or None if no such netbox is known.
+
+        """
+        agent = str(agent)
+        with self._lock:
+            if self._is_stale(self._netboxes_loaded):
+                self._load_netboxes()
+
+            netbox = self._netboxes.get(agent)
+            if netbox is None and self._should_retry(self._netbox_misses,
+                                                     agent):
+                netbox = self._load_netbox(agent)
+                if netbox is None:
+                    self._netbox_misses[agent] = time.time()
+                else:
+                    self._netboxes[agent] = netbox
+            return netbox
+
+    def get_interface(self, netboxid, ifindex):
+        """Returns an InterfaceInfo tuple for the interface with the given
+        ifindex on the given netbox, or None if no such interface is known.
+
+        """
+        try:
+            ifindex = int(ifindex)
+        except (TypeError, ValueError):
+            return None
+
+        with self._lock:
+            loaded, interfaces, misses = self._interfaces.pop(
+                netboxid, (None, None, {}))
+            if self._is_stale(loaded):
+                loaded, interfaces = self._load_interfaces(netboxid)
+                misses = {}
+            elif (ifindex not in interfaces
+                  and self._should_retry(misses, ifindex)):
+                loaded, interfaces = self._load_interfaces(netboxid)
+
+            if ifindex not in interfaces:
+                misses[ifindex] = time.time()
+
+            self._interfaces[netboxid] = (loaded, interfaces, misses)
+            while len(self._interfaces) > self.max_netboxes:
+                self._interfaces.popitem(last=False)
+            return interfaces.get(ifindex)
+
+    def _is_stale(self, timestamp):
+        return (timestamp is None
+                or time.time() - timestamp > self.refresh_interval)
+
+    def _should_retry(self, misses, key):
+        last_miss = misses.get(key)
+        return (last_miss is None
+                or time.time() - last_miss > self.miss_interval)
+
+    def _load_netboxes(self):
+        cursor = getConnection('default').cursor()
+        cursor.execute(NETBOX_QUERY)
+        self._netboxes = dict((ip, NetboxInfo(netboxid, sysname, roomid))
+                              for ip, netboxid, sysname, roomid
+                              in cursor.fetchall())
+        self._netboxes_loaded = time.time()
+        self._netbox_misses = {}
+        _logger.debug("loaded %d netbox addresses", len(self._netboxes))
+
+    @staticmethod
+    def _load_netbox(agent):
+        cursor = getConnection('default').cursor()
+        cursor.execute(NETBOX_QUERY + " WHERE ip = %s", (agent,))
+        row = cursor.fetchone()
+        if row:
+            return NetboxInfo(*row[1:])
+
+    @staticmethod
+    def _load_interfaces(netboxid):
+        cursor = getConnection('default').cursor()
+        cursor.execute(INTERFACE_QUERY, (netboxid,))
+        interfaces = dict((row[0], InterfaceInfo(*row[1:]))
+                          for row in cursor.fetchall())
+        _logger.debug("loaded %d interfaces for netbox %s",
+                      len(interfaces), netboxid)
+        return time.time(), interfaces
+
+
+_cache = TrapLookupCache()
+
+
+def get_netbox(agent):
+    """Returns a NetboxInfo tuple for the netbox with the IP address agent,
+    or None if no such netbox is known.
+
+    """
+    return _cache.get_netbox(agent)
+
+
+def get_interface(netboxid, ifindex):
+    """Returns an InterfaceInfo tuple for the interface with the given ifindex
+    on the given netbox, or None if no such interface is known.
+
+    """
+    return _cache.get_interface(netboxid, ifindex)
+
+
+def clear():
+    """Forgets all cached lookup data"""
+    _cache.clear()
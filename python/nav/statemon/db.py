@@ -38,6 +38,7 @@ from service import Service
 from debug import debug
 
 from nav.db import get_connection_string
+from nav.event import EventBatch, Event as QueuedEvent
 from nav.util import synchronized
 
 def db():
@@ -116,16 +117,21 @@ class _db(threading.Thread):
     def run(self):
         self.connect()
         while 1:
-            event = self.queue.get()
-            debug("Got event: [%s]" % event, 7)
+            events = [self.queue.get()]
+            while 1:
+                try:
+                    events.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            debug("Got %d events" % len(events), 7)
             try:
-                self.commitEvent(event)
-                self.db.commit()
+                self.commitEvents(events)
             except Exception, e:
-                # If we fail to commit the event, place it
+                # If we fail to commit the events, place them
                 # back in our queue
-                debug("Failed to commit event, rescheduling...", 7)
-                self.newEvent(event)
+                debug("Failed to commit events, rescheduling...", 7)
+                for event in events:
+                    self.newEvent(event)
                 time.sleep(5)
 
     @synchronized(_queryLock)
@@ -179,36 +185,61 @@ class _db(threading.Thread):
         self.queue.put(event)
 
     def commitEvent(self, event):
-        if event.source not in ("serviceping","pping"):
-            debug("Invalid source for event: %s" % event.source, 1)
-            return
-        if event.eventtype == "version":
-            statement = """UPDATE service SET version = %s
-                           WHERE serviceid = %s"""
-            self.execute(statement, (event.version, event.serviceid))
-            return
-
-        if event.status == Event.UP:
-            value = 100
-            state = 'e'
-        elif event.status == Event.DOWN:
-            value = 1
-            state = 's'
-
-        nextid = self.query("SELECT nextval('eventq_eventqid_seq')")[0][0]
-        statement = """INSERT INTO eventq
-                       (eventqid, subid, netboxid, deviceid, eventtypeid,
-                        state, value, source, target)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
-        values = (nextid, event.serviceid, event.netboxid, event.deviceid,
-                  event.eventtype, state, value, event.source, "eventEngine")
-        self.execute(statement, values)
-
-        statement = """INSERT INTO eventqvar
-                       (eventqid, var, val) VALUES
-                       (%s, %s, %s)"""
-        values = (nextid, 'descr', event.info)
-        self.execute(statement, values)
+        self.commitEvents([event])
+
+    def commitEvents(self, events):
+        """Posts a list of events to the event queue in a single batch.
+
+        Version events are not posted, but update the version of the
+        service directly.
+        """
+        batch = []
+        for event in events:
+            if event.source not in ("serviceping","pping"):
+                debug("Invalid source for event: %s" % event.source, 1)
+                continue
+            if event.eventtype == "version":
+                statement = """UPDATE service SET version = %s
+                               WHERE serviceid = %s"""
+                self.execute(statement, (event.version, event.serviceid))
+                continue
+
+            if event.status == Event.UP:
+                value = 100
+                state = 'e'
+            elif event.status == Event.DOWN:
+                value = 1
+                state = 's'
+
+            queued = QueuedEvent(source=event.source, target="eventEngine",
+                                 deviceid=event.deviceid,
+                                 netboxid=event.netboxid,
+                                 subid=event.serviceid,
+                                 eventtypeid=event.eventtype,
+                                 state=state, value=value)
+            queued['descr'] = event.info
+            batch.append(queued)
+
+        if batch:
+            self.postEvents(batch)
+
+    @synchronized(_queryLock)
+    def postEvents(self, events):
+        # getting a cursor will reconnect if necessary
+        self.cursor()
+        batch = EventBatch(connection=self.db)
+        for event in events:
+            batch.add(event)
+        try:
+            batch.post()
+            debug("Posted %d events" % len(events), 7)
+        except Exception, e:
+            debug("Failed to post events: %s" % e, 2)
+            try:
+                self.db.rollback()
+            except Exception:
+                debug("Failed to rollback", 2)
+            raise dbError()
 
     def hostsToPing(self):
         query = """SELECT netboxid, deviceid, sysname, ip, up FROM netbox """
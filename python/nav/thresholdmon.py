@@ -19,9 +19,13 @@ from __future__ import absolute_import
 
 import os
 import sys
+import time
 import logging
+import urllib2
 from optparse import OptionParser
 from collections import defaultdict
+from itertools import chain
+from multiprocessing.pool import ThreadPool
 
 from nav import buildconf
 from nav.models.fields import INFINITY
@@ -29,22 +33,34 @@ from nav.models.manage import Netbox, Interface, Sensor
 from nav.models.thresholds import ThresholdRule
 from nav.models.event import EventQueue as Event, AlertHistory
 from nav.metrics.lookup import lookup
-
-from django.db.transaction import commit_on_success
+from nav.metrics.data import get_metric_average
+from nav.metrics.errors import GraphiteUnreachableError
+from nav.metrics.graphs import (extract_series_name,
+                                translate_serieslist_to_regex)
+from nav.metrics.carbon import send_metrics
+from nav.metrics.templates import (metric_path_for_threshold_rule,
+                                   metric_path_for_thresholdmon_scan)
+from nav.event import EventBatch
+
+from django.db import connection
+from django.db.transaction import commit_on_success, set_dirty
 
 LOGFILE_NAME = 'thresholdmon.log'
 LOGFILE_PATH = os.path.join(buildconf.localstatedir, 'log', LOGFILE_NAME)
 
+DEFAULT_WORKERS = 4
+MAX_TARGETS_PER_REQUEST = 20
+
 _logger = logging.getLogger('nav.thresholdmon')
 
 
 def main():
     """Main thresholdmon program"""
     parser = make_option_parser()
-    (_options, _args) = parser.parse_args()
+    (options, _args) = parser.parse_args()
 
     init_logging()
-    scan()
+    scan(workers=options.workers)
 
 
 def make_option_parser():
@@ -54,6 +70,10 @@ def make_option_parser():
         description=("Scans metric values for exceeded thresholds, according"
                      "to configured threshold rules.")
     )
+    parser.add_option("-w", "--workers", type="int", dest="workers",
+                      default=DEFAULT_WORKERS, metavar="NUM",
+                      help="The maximum number of concurrent requests to "
+                           "Graphite (default: %default)")
     return parser
 
 
@@ -76,27 +96,264 @@ def init_logging():
     nav.logs.set_log_levels()
 
 
-def scan():
-    """Scans for threshold rules and evaluates them"""
+def scan(workers=DEFAULT_WORKERS):
+    """Scans for threshold rules and evaluates them.
+
+    Metric values for all rules are fetched from Graphite up front, using
+    multi-target requests for rules with the same period, running up to
+    `workers` requests concurrently.
+
+    """
+    start = time.time()
     rules = ThresholdRule.objects.all()
     alerts = get_unresolved_threshold_alerts()
 
     _logger.info("evaluating %d rules", len(rules))
-    for rule in rules:
-        evaluate_rule(rule, alerts)
-    _logger.info("done")
+    evaluators = [(rule, rule.get_evaluator()) for rule in rules]
+    fetch_start = time.time()
+    fetch_times = fetch_values([evaluator for _rule, evaluator in evaluators],
+                               workers=workers)
+    fetch_time = time.time() - fetch_start
+
+    timings = []
+    evaluate_start = time.time()
+    for rule, evaluator in evaluators:
+        if evaluator not in fetch_times:
+            _logger.error("could not fetch values for rule %r, skipping",
+                          rule)
+            continue
+        rule_start = time.time()
+        evaluate_rule(rule, alerts, evaluator)
+        timings.append((rule, fetch_times[evaluator],
+                        time.time() - rule_start))
+    evaluate_time = time.time() - evaluate_start
+
+    _logger.info("done (fetch: %.02fs, evaluate: %.02fs)",
+                 fetch_time, evaluate_time)
+    send_timings(timings, fetch_time, evaluate_time, time.time() - start)
+
+
+def fetch_values(evaluators, workers=DEFAULT_WORKERS,
+                 max_targets=MAX_TARGETS_PER_REQUEST):
+    """Fetches and sets current values for a list of ThresholdEvaluators.
+
+    Evaluators with the same period have their targets combined into
+    multi-target render requests of up to `max_targets` targets each, and up
+    to `workers` requests are run concurrently.
+
+    :returns: A dict of {evaluator: fetch_time} for the evaluators whose
+              values were successfully fetched, fetch_time being the duration
+              of the request that fetched them.
+
+    """
+    requests = make_fetch_requests(evaluators, max_targets)
+    if not requests:
+        return {}
+    _logger.debug("fetching values for %d evaluators in %d requests",
+                  len(evaluators), len(requests))
+
+    pool = ThreadPool(min(workers, len(requests)))
+    try:
+        results = pool.map(_fetch_request, requests)
+    finally:
+        pool.close()
+        pool.join()
+
+    fetch_times = {}
+    for targets, averages, duration in chain(*results):
+        if averages is None:
+            continue
+        for target, values in split_by_target(targets, averages).items():
+            for evaluator in targets[target]:
+                evaluator.set_values(values)
+                fetch_times[evaluator] = duration
+    return fetch_times
+
+
+def make_fetch_requests(evaluators, max_targets=MAX_TARGETS_PER_REQUEST):
+    """Groups evaluators into Graphite render requests.
+
+    Targets whose series list expressions may match the same series are never
+    put in the same request, as the series in a response could otherwise not
+    be reliably attributed to the target that requested them.
+
+    :returns: A list of (start, targets) tuples, where targets is a dict of
+              {target: [evaluator, ...]}, with at most max_targets items.
+
+    """
+    by_period = defaultdict(lambda: defaultdict(list))
+    for evaluator in evaluators:
+        by_period[evaluator.get_start()][evaluator.target].append(evaluator)
+
+    requests = []
+    for start, targets in by_period.items():
+        chunks = []
+        for name in sorted(targets):
+            series = extract_series_name(name)
+            for chunk in chunks:
+                if (len(chunk) < max_targets and
+                        not any(_series_may_overlap(series, other)
+                                for other in chunk.values())):
+                    break
+            else:
+                chunk = {}
+                chunks.append(chunk)
+            chunk[name] = series
+        for chunk in chunks:
+            requests.append((start, dict((name, targets[name])
+                                         for name in chunk)))
+    return requests
+
+
+def _series_may_overlap(series, other):
+    """Returns True if the two series list expressions may match any of the
+    same series names.
+
+    This errs on the side of caution: Any pair of path components is assumed
+    to overlap if one of them contains wildcards.
+
+    """
+    if series == other:
+        return True
+    nodes, other_nodes = _split_series(series), _split_series(other)
+    if nodes is None or other_nodes is None:
+        return True
+    if len(nodes) != len(other_nodes):
+        return False
+    return all(node == other_node or _is_wildcard(node)
+               or _is_wildcard(other_node)
+               for node, other_node in zip(nodes, other_nodes))
+
+
+def _split_series(series):
+    """Splits a series list expression into its path components, or returns
+    None if a component contains a wildcard list that spans several.
+
+    """
+    nodes = series.split('.')
+    if any(node.count('{') != node.count('}') for node in nodes):
+        return None
+    return nodes
+
+
+def _is_wildcard(node):
+    return any(char in node for char in '*?[{')
+
+
+def _fetch_request(request):
+    """Runs a render request, returning a list of (targets, averages,
+    duration) tuples.
+
+    If Graphite rejects a request for more than one target, the request is
+    split in two and retried, so that a single broken target won't prevent
+    the values of the others from being fetched.  If Graphite cannot be
+    reached at all, the request is not retried.  The averages of targets that
+    could not be fetched are None.
+
+    """
+    start, targets = request
+    before = time.time()
+    try:
+        averages = get_metric_average(list(targets), start=start, end='now',
+                                      ignore_unknown=True)
+    except Exception as error:
+        if len(targets) == 1 or not _is_rejection(error):
+            _logger.exception("failed to fetch %d targets from graphite: %r",
+                              len(targets), list(targets))
+            return [(targets, None, time.time() - before)]
+        _logger.warning("graphite rejected a request for %d targets, "
+                        "retrying in smaller requests", len(targets),
+                        exc_info=True)
+        names = sorted(targets)
+        middle = len(names) // 2
+        return list(chain(*[
+            _fetch_request((start, dict((name, targets[name])
+                                        for name in half)))
+            for half in (names[:middle], names[middle:])]))
+    return [(targets, averages, time.time() - before)]
+
+
+def _is_rejection(error):
+    """Returns True if error means that Graphite responded to, but rejected,
+    a request, as opposed to not being reachable at all.
+
+    """
+    return (isinstance(error, GraphiteUnreachableError) and
+            isinstance(error.cause, urllib2.HTTPError))
+
+
+def split_by_target(targets, averages):
+    """Splits the response to a multi-target render request by target.
+
+    A series is attributed to every requested target whose series list
+    expression matches the series name, and whose function calls are
+    formatted identically to the returned series.  If no target is an exact
+    match, the series is attributed to every target whose series list
+    expression matches; make_fetch_requests() ensures there is only one such
+    target in a request.
+
+    :param targets: The list of requested targets.
+    :param averages: A dict of {series: value} from get_metric_average().
+    :returns: A dict of {target: {series: value}} items.
+
+    """
+    patterns = []
+    for target in targets:
+        series = extract_series_name(target)
+        pattern = translate_serieslist_to_regex(series)
+        patterns.append((target, series, pattern))
+
+    result = dict((target, {}) for target in targets)
+    for key, value in averages.items():
+        name = extract_series_name(key)
+        matches = [(target, series) for target, series, pattern in patterns
+                   if _matches_fully(pattern, name)]
+        exact = [target for target, series in matches
+                 if target.replace(series, name) == key]
+        for target in exact or [target for target, _series in matches]:
+            result[target][key] = value
+    return result
+
+
+def _matches_fully(pattern, string):
+    match = pattern.match(string)
+    return bool(match) and match.end() == len(string)
+
+
+def send_timings(timings, fetch_time, evaluate_time, total_time):
+    """Sends per-rule and total scan timings to Graphite"""
+    now = time.time()
+    metrics = [
+        (metric_path_for_thresholdmon_scan('fetch-time'), (now, fetch_time)),
+        (metric_path_for_thresholdmon_scan('evaluate-time'),
+         (now, evaluate_time)),
+        (metric_path_for_thresholdmon_scan('total-time'), (now, total_time)),
+    ]
+    for rule, rule_fetch_time, rule_evaluate_time in timings:
+        metrics.append((metric_path_for_threshold_rule(rule.id, 'fetch-time'),
+                        (now, rule_fetch_time)))
+        metrics.append((metric_path_for_threshold_rule(rule.id,
+                                                       'evaluate-time'),
+                        (now, rule_evaluate_time)))
+    send_metrics(metrics)
 
 
 # pylint: disable=W0703
-def evaluate_rule(rule, alerts):
+def evaluate_rule(rule, alerts, evaluator=None):
     """
     Evaluates the current status of a single rule and posts events if
     necessary.
+
+    :param evaluator: A ThresholdEvaluator for the rule, with values already
+                      fetched.  If omitted, one is made and values are
+                      fetched.
     """
     _logger.debug("evaluating rule %r", rule)
 
-    evaluator = rule.get_evaluator()
-    if not evaluator.get_values():
+    if evaluator is None:
+        evaluator = rule.get_evaluator()
+        evaluator.get_values()
+    if not evaluator.result:
         _logger.warning("did not find any matching values for rule %r %s",
                         rule.target, rule.alert)
 
@@ -108,31 +365,52 @@ def evaluate_rule(rule, alerts):
                           rule)
         return
 
+    events = []
     for metric, value in exceeded:
         alert = alerts.get(rule.id, {}).get(metric, None)
         _logger.info("%s: %s %s (=%s)",
                      "old" if alert else "new", metric, rule.alert, value)
         if not alert:
-            start_event(rule, metric, value)
+            events.append(start_event(rule, metric, value))
 
     # try to clear any existing threshold alerts
     if rule.id in alerts:
-        clearable = alerts[rule.id]
-        try:
-            if rule.clear:
-                cleared = evaluator.evaluate(rule.clear)
-            else:
-                cleared = evaluator.evaluate(rule.alert, invert=True)
-        except Exception:
-            _logger.exception(
-                "Unhandled exception while evaluating rule clear: %r", rule)
-            return
+        events.extend(_get_clear_events(rule, evaluator, alerts[rule.id]))
+
+    post_events(events)
 
-        for metric, value in cleared:
-            if metric in clearable:
-                _logger.info("cleared: %s %s (=%s)",
-                             metric, rule.clear, value)
-                end_event(rule, metric, value)
+
+def _get_clear_events(rule, evaluator, clearable):
+    try:
+        if rule.clear:
+            cleared = evaluator.evaluate(rule.clear)
+        else:
+            cleared = evaluator.evaluate(rule.alert, invert=True)
+    except Exception:
+        _logger.exception(
+            "Unhandled exception while evaluating rule clear: %r", rule)
+        return []
+
+    events = []
+    for metric, value in cleared:
+        if metric in clearable:
+            _logger.info("cleared: %s %s (=%s)",
+                         metric, rule.clear, value)
+            events.append(end_event(rule, metric, value))
+    return events
+
+
+@commit_on_success
+def post_events(events):
+    """Posts a list of events to the event queue as a single batch"""
+    if not events:
+        return
+    batch = EventBatch(connection=connection, commit=False)
+    for event in events:
+        batch.add(event)
+    batch.post()
+    # Let commit_on_success know there is something to commit
+    set_dirty()
 
 
 def get_unresolved_threshold_alerts():
@@ -156,22 +434,21 @@ def get_unresolved_threshold_alerts():
 
 
 def start_event(rule, metric, value):
-    """Makes and posts a threshold start event"""
+    """Makes a threshold start event"""
     event = make_event(True, rule, metric, value)
-    _logger.debug("posted start event: %r", event)
+    _logger.debug("made start event: %r", event)
     return event
 
 
 def end_event(rule, metric, value):
-    """Makes and posts a threshold end event"""
+    """Makes a threshold end event"""
     event = make_event(False, rule,  metric, value)
-    _logger.debug("posted end event: %r", event)
+    _logger.debug("made end event: %r", event)
     return event
 
 
-@commit_on_success
 def make_event(start, rule, metric, value):
-    """Makes and posts a threshold event"""
+    """Makes an unsaved threshold event, to be posted using post_events()"""
     event = _event_template()
     event.state = event.STATE_START if start else event.STATE_END
     event.subid = "{rule}:{metric}".format(rule=rule.id, metric=metric)
@@ -181,10 +458,7 @@ def make_event(start, rule, metric, value):
     if rule.clear:
         varmap['clear'] = unicode(rule.clear)
     _add_subject_details(event, metric, varmap)
-
-    event.save()
-    if varmap:
-        event.varmap = varmap
+    event.varmap = varmap
     return event
 
 
@@ -0,0 +1,420 @@
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Compact layer 2 topology graphs and VLAN topology analysis.
+
+The layer 2 graph is represented by netbox and interface ids only, stored in
+compressed sparse row (CSR) form: The links out of each netbox occupy a
+consecutive range of positions in a set of flat integer arrays, and the
+trunk status and allowed VLANs of the linked interfaces are stored as bit
+sets.  Unlike a graph of Django model objects, it is small, cheap to pickle
+and needs no database access, so that VLANs can be analyzed in a pool of
+worker processes.  Model objects are only looked up for the final results.
+
+"""
+from array import array
+from collections import namedtuple, deque
+import logging
+from multiprocessing import Pool
+
+from nav.bitvector import BitVector
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_VLAN = 4095
+
+# pylint: disable=C0103
+IfcInfo = namedtuple('IfcInfo', 'to_interface trunk vlan allowed_vlans')
+RoutedVlan = namedtuple('RoutedVlan', 'vlan router router_port to_netbox')
+
+NO_INFO = IfcInfo(None, False, None, None)
+
+
+def make_vlan_bitset(vlans):
+    """Returns a BitVector with the bits of the given VLAN numbers set"""
+    bits = BitVector('\x00' * ((MAX_VLAN + 8) // 8))
+    for vlan in vlans:
+        bits[vlan] = True
+    return bits
+
+
+class CompactLayer2Graph(object):
+    """A layer 2 graph of netbox ids, in compressed sparse row form.
+
+    Each link is a directed edge from one netbox to another, identified by
+    its position in the edge arrays.  The edges out of the netbox at node
+    index n are found at positions offsets[n] up to offsets[n + 1].
+
+    :ivar node_ids: An array of netbox ids, indexed by node index.
+    :ivar offsets: An array of the first edge position of each node.
+    :ivar edge_dest: The node index of the destination of each edge.
+    :ivar edge_ifc: The id of the interface of each edge.
+    :ivar edge_to_ifc: The id of the remote interface of each edge, or 0.
+    :ivar edge_vlan: The native VLAN of the interface of each edge, or 0.
+    :ivar trunks: A BitVector of the edges whose interface is a trunk.
+    :ivar edge_allowed: The index into allowed_vlans of the allowed VLAN
+                        set of each edge's interface, or -1.
+    :ivar allowed_vlans: A list of distinct VLAN BitVectors.
+    :ivar access_vlans: A dict mapping netbox ids to dicts mapping VLAN
+                        numbers to the ids of the netbox' non-trunk
+                        interfaces on that VLAN.
+
+    """
+    def __init__(self, links, access_vlans=None):
+        """Initializes a graph.
+
+        :param links: An iterable of (source netbox id, destination netbox
+                      id, interface id, IfcInfo) tuples, where the IfcInfo
+                      may be None.
+        :param access_vlans: A dict like the access_vlans attribute.
+
+        """
+        links = list(links)
+        nodes = set()
+        for source, dest, _ifc, _info in links:
+            nodes.add(source)
+            nodes.add(dest)
+        self.node_ids = array('i', sorted(nodes))
+        self._node_index = dict((node, index)
+                                for index, node in enumerate(self.node_ids))
+
+        links.sort(key=lambda link: self._node_index[link[0]])
+        self.offsets = array('i', [0] * (len(self.node_ids) + 1))
+        for source, _dest, _ifc, _info in links:
+            self.offsets[self._node_index[source] + 1] += 1
+        for index in xrange(len(self.node_ids)):
+            self.offsets[index + 1] += self.offsets[index]
+
+        self.edge_dest = array('i')
+        self.edge_ifc = array('i')
+        self.edge_to_ifc = array('i')
+        self.edge_vlan = array('i')
+        self.edge_allowed = array('i')
+        self.trunks = BitVector('\x00' * (len(links) // 8 + 1))
+        self.allowed_vlans = []
+        distinct_allowed = {}
+
+        for position, (_source, dest, ifc, info) in enumerate(links):
+            info = info or NO_INFO
+            self.edge_dest.append(self._node_index[dest])
+            self.edge_ifc.append(ifc or 0)
+            self.edge_to_ifc.append(info.to_interface or 0)
+            self.edge_vlan.append(info.vlan or 0)
+            if info.trunk:
+                self.trunks[position] = True
+            allowed = -1
+            if info.allowed_vlans is not None:
+                key = str(info.allowed_vlans)
+                if key not in distinct_allowed:
+                    distinct_allowed[key] = len(self.allowed_vlans)
+                    self.allowed_vlans.append(info.allowed_vlans)
+                allowed = distinct_allowed[key]
+            self.edge_allowed.append(allowed)
+
+        self.access_vlans = access_vlans or {}
+
+    def __contains__(self, node):
+        return node in self._node_index
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def nodes(self):
+        """Returns a list of the netbox ids in the graph"""
+        return list(self.node_ids)
+
+    def edges_from(self, node):
+        """Returns the positions of the edges out of the node netbox id"""
+        index = self._node_index.get(node)
+        if index is None:
+            return xrange(0)
+        return xrange(self.offsets[index], self.offsets[index + 1])
+
+    def dest(self, edge):
+        """Returns the destination netbox id of the edge at position edge"""
+        return self.node_ids[self.edge_dest[edge]]
+
+    def find_edges(self, source, dest):
+        """Returns the positions of the edges from source to dest"""
+        index = self._node_index.get(dest)
+        return [edge for edge in self.edges_from(source)
+                if self.edge_dest[edge] == index]
+
+    def find_interface_edge(self, source, ifc):
+        """Returns the position of the edge of interface ifc on netbox
+        source, or None if it doesn't exist.
+
+        """
+        for edge in self.edges_from(source):
+            if self.edge_ifc[edge] == ifc:
+                return edge
+
+    def is_trunk(self, edge):
+        """Returns True if the interface of edge is a trunk"""
+        return bool(self.trunks[edge])
+
+    def has_vlan(self, edge, vlan):
+        """Returns True if the interface of edge is on vlan, either natively
+        or as an allowed VLAN on a trunk.
+
+        """
+        if self.edge_vlan[edge] == vlan:
+            return True
+        allowed = self.edge_allowed[edge]
+        if allowed < 0 or not self.trunks[edge]:
+            return False
+        # reads the BitVector's octets directly, bit 0 being the MSB of the
+        # first octet, as BitVector.__getitem__ is too slow for this loop
+        octets = self.allowed_vlans[allowed].vector
+        block = vlan >> 3
+        return (block < len(octets)
+                and bool(octets[block] & (128 >> (vlan & 7))))
+
+    def shortest_path(self, source, target, exclude=()):
+        """Finds a shortest path between two netboxes by breadth first
+        search, treating the edges as undirected.
+
+        :param exclude: Netbox ids that the path may not pass through.
+        :returns: A list of netbox ids from source to target, or None if no
+                  path was found.
+
+        """
+        if source not in self or target not in self:
+            return None
+        index = self._node_index
+        start, goal = index[source], index[target]
+        excluded = set(index[node] for node in exclude if node in index)
+        excluded.discard(start)
+        if goal in excluded:
+            return None
+
+        neighbors = self._undirected_neighbors()
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(self.node_ids[node])
+                    node = previous[node]
+                return path[::-1]
+            for neighbor in neighbors[node]:
+                if neighbor not in previous and neighbor not in excluded:
+                    previous[neighbor] = node
+                    queue.append(neighbor)
+        return None
+
+    def _undirected_neighbors(self):
+        neighbors = [set() for _node in self.node_ids]
+        for node in xrange(len(self.node_ids)):
+            for edge in xrange(self.offsets[node], self.offsets[node + 1]):
+                dest = self.edge_dest[edge]
+                neighbors[node].add(dest)
+                neighbors[dest].add(node)
+        return neighbors
+
+
+class CompactVlanTopologyAnalyzer(object):
+    """Analyzer of a single routed VLAN topology on a compact layer 2 graph.
+
+    The analysis is the same as that of RoutedVlanTopologyAnalyzer, but an
+    edge is a (source netbox id, destination netbox id, edge position)
+    tuple.
+
+    """
+    def __init__(self, routed_vlan, graph, stp_blocked=None):
+        """Initializes an analyzer for a given routed VLAN.
+
+        :param routed_vlan: A RoutedVlan tuple.
+        :param graph: A CompactLayer2Graph.
+        :param stp_blocked: A dict mapping interface ids to lists of VLANs
+                            on which the interface is blocked.
+
+        """
+        self.vlan = routed_vlan.vlan
+        self.routed_vlan = routed_vlan
+        self.graph = graph
+        self.stp_blocked = stp_blocked or {}
+        self.ifc_directions = {}
+        self.edge_directions = {}
+
+    def analyze(self):
+        """Runs the analysis on the associated VLAN.
+
+        :returns: A dict mapping interface ids to directions.
+
+        """
+        router = self.routed_vlan.router
+        if router in self.graph:
+            start = None
+            if self.routed_vlan.to_netbox:
+                start = self.graph.find_interface_edge(
+                    router, self.routed_vlan.router_port)
+            if start is None:
+                # likely a GSW, descend on its switch ports by faking an edge
+                start_edge = (router, router, None)
+            else:
+                start_edge = (router, self.routed_vlan.to_netbox, start)
+            self._examine_edge(start_edge)
+
+        return self.ifc_directions
+
+    def _examine_edge(self, edge, visited_nodes=None):
+        source, dest, position = edge
+
+        visited_nodes = visited_nodes or set()
+        is_visited_before = dest in visited_nodes
+        if (source, dest) in self.edge_directions:
+            direction = self.edge_directions[(source, dest)]
+        else:
+            direction = 'up' if is_visited_before else 'down'
+            self.edge_directions[(source, dest)] = direction
+        visited_nodes.add(dest)
+
+        vlan_is_active = (
+            (direction == 'up'
+             and self._vlan_is_active_on_reverse_edge(edge, visited_nodes))
+            or self._is_vlan_active_on_destination(dest, position))
+
+        if direction == 'down' and not is_visited_before:
+            # Recursive depth first search on each outgoing edge
+            for next_edge in self._out_edges_on_vlan(dest):
+                if not self._is_blocked_on_any_end(next_edge):
+                    sub_active = self._examine_edge(next_edge, visited_nodes)
+                    vlan_is_active = vlan_is_active or sub_active
+                else:
+                    vlan_is_active = False
+                    self._mark_both_ends_as_blocked(next_edge)
+                    _LOGGER.info("interface %s is blocked on VLAN %s",
+                                 self.graph.edge_ifc[next_edge[2]],
+                                 self.vlan)
+
+        if vlan_is_active and position is not None:
+            self.ifc_directions[self.graph.edge_ifc[position]] = direction
+
+        return vlan_is_active
+
+    def _vlan_is_active_on_reverse_edge(self, edge, visited_nodes):
+        _source, dest, position = edge
+        reverse_edge = self._find_reverse_edge(edge)
+        if reverse_edge:
+            reverse_ifc = self.graph.edge_ifc[reverse_edge[2]]
+            been_there = (reverse_ifc in self.ifc_directions
+                          or dest in visited_nodes)
+            if been_there:
+                return self.graph.has_vlan(position, self.vlan)
+        return False
+
+    def _find_reverse_edge(self, edge):
+        source, dest, position = edge
+        dest_ifc = self.graph.edge_to_ifc[position]
+        reverse_edges = self.graph.find_edges(dest, source)
+        if reverse_edges:
+            for reverse in reverse_edges:
+                if dest_ifc and self.graph.edge_ifc[reverse] == dest_ifc:
+                    return (dest, source, reverse)
+            # pick first available return edge when any exist
+            return (dest, source, reverse_edges[0])
+
+    def _is_vlan_active_on_destination(self, dest, position):
+        if position is None:
+            return False
+
+        if not self.graph.is_trunk(position):
+            return self.graph.has_vlan(position, self.vlan)
+        else:
+            to_ifc = self.graph.edge_to_ifc[position]
+            non_trunks_on_vlan = self.graph.access_vlans.get(
+                dest, {}).get(self.vlan, ())
+            return any(ifc != to_ifc for ifc in non_trunks_on_vlan)
+
+    def _out_edges_on_vlan(self, node):
+        graph = self.graph
+        return ((node, graph.dest(edge), edge)
+                for edge in graph.edges_from(node)
+                if graph.has_vlan(edge, self.vlan))
+
+    def _is_blocked_on_any_end(self, edge):
+        """Returns True if at least one of the edge endpoints are blocked"""
+        reverse_edge = self._find_reverse_edge(edge)
+        return (self._is_edge_blocked(edge) or
+                self._is_edge_blocked(reverse_edge))
+
+    def _is_edge_blocked(self, edge):
+        if edge:
+            ifc = self.graph.edge_ifc[edge[2]]
+            return self.vlan in self.stp_blocked.get(ifc, [])
+        return False
+
+    def _mark_both_ends_as_blocked(self, edge):
+        self.ifc_directions[self.graph.edge_ifc[edge[2]]] = 'blocked'
+        reverse_edge = self._find_reverse_edge(edge)
+        if reverse_edge:
+            self.ifc_directions[self.graph.edge_ifc[reverse_edge[2]]] = (
+                'blocked')
+
+
+def analyze_routed_vlans(graph, stp_blocked, routed_vlans, workers=1):
+    """Analyzes a number of VLANs, optionally using a pool of worker
+    processes.
+
+    :param graph: A CompactLayer2Graph.
+    :param stp_blocked: A dict mapping interface ids to lists of VLANs on
+                        which the interface is blocked.
+    :param routed_vlans: A list of RoutedVlan tuples.
+    :param workers: The number of worker processes to use.  If 1, the
+                    VLANs are analyzed in this process.
+    :returns: An iterator over (routed_vlan, directions) tuples, in the
+              order of routed_vlans, where directions is a dict mapping
+              interface ids to directions.
+
+    """
+    if workers <= 1:
+        for routed_vlan in routed_vlans:
+            _LOGGER.debug("Analyzing VLAN %s", routed_vlan.vlan)
+            analyzer = CompactVlanTopologyAnalyzer(routed_vlan, graph,
+                                                   stp_blocked)
+            yield routed_vlan, analyzer.analyze()
+        return
+
+    pool = Pool(workers, _init_worker, (graph, stp_blocked))
+    try:
+        chunksize = max(len(routed_vlans) // (workers * 4), 1)
+        for result in pool.imap(_analyze_in_worker, routed_vlans, chunksize):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+_worker_graph = None
+_worker_stp_blocked = None
+
+
+def _init_worker(graph, stp_blocked):
+    global _worker_graph, _worker_stp_blocked  # pylint: disable=W0603
+    _worker_graph = graph
+    _worker_stp_blocked = stp_blocked
+
+
+def _analyze_in_worker(routed_vlan):
+    analyzer = CompactVlanTopologyAnalyzer(routed_vlan, _worker_graph,
+                                           _worker_stp_blocked)
+    return routed_vlan, analyzer.analyze()
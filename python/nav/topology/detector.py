@@ -26,6 +26,7 @@ import atexit
 from nav import buildconf
 from nav import daemon
 from nav.debug import log_stacktrace, log_last_django_query
+from nav.netmap.cache import invalidate_topology_cache
 from nav.topology.layer2 import update_layer2_topology
 from nav.topology.analyze import AdjacencyReducer, build_candidate_graph_from_db
 from nav.topology.vlan import VlanGraphAnalyzer, VlanTopologyUpdater
@@ -56,9 +57,11 @@ def main():
             vlans = [int(v) for v in options.include_vlans]
         else:
             vlans = []
-        do_vlan_detection(vlans)
+        do_vlan_detection(vlans, options.workers)
         delete_unused_prefixes()
         delete_unused_vlans()
+    if options.l2 or options.vlan:
+        invalidate_topology_cache()
 
 def make_option_parser():
     """Sets up and returns a command line option parser."""
@@ -75,6 +78,9 @@ def make_option_parser():
     parser.add_option("-i", dest="include_vlans", default="",
                       metavar="vlan[,...]",
                       help="Only analyze the VLANs included in this list")
+    parser.add_option("-w", "--workers", type="int", dest="workers",
+                      default=1, metavar="N",
+                      help="Analyze vlan subtopologies in N processes")
     return parser
 
 def init_logging():
@@ -120,12 +126,12 @@ def do_layer2_detection():
     update_layer2_topology(links)
 
 @with_exception_logging
-def do_vlan_detection(vlans):
+def do_vlan_detection(vlans, workers=1):
     analyzer = VlanGraphAnalyzer()
     if vlans:
-        analyzer.analyze_vlans_by_id(vlans)
+        analyzer.analyze_vlans_by_id(vlans, workers)
     else:
-        analyzer.analyze_all()
+        analyzer.analyze_all(workers)
     ifc_vlan_map = analyzer.add_access_port_vlans()
     update = VlanTopologyUpdater(ifc_vlan_map)
     update()
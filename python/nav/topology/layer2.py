@@ -14,63 +14,133 @@
 # along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """Functions for updating the database's layer 2 topology"""
+from itertools import chain
+import logging
+import time
 
 from nav.topology.analyze import AdjacencyReducer, build_candidate_graph_from_db
 from nav.topology.analyze import Port
 
 from nav.models.manage import Interface, Netbox
-from django.db import transaction
-from django.db.models import Q
+from django.db import connection, transaction
+
+_logger = logging.getLogger(__name__)
+
+# The max number of rows per INSERT into the temporary table of touched
+# interfaces
+BATCH_SIZE = 1000
+
 
 @transaction.commit_on_success
 def update_layer2_topology(links):
     """Updates the layer 2 topology in the NAV database.
 
+    The current topology of the interfaces that may be updated is loaded
+    once, and only the links that differ from it are written, using a single
+    UPDATE statement.
+
     :param links: a list of edges from an adjacency graph
 
     """
-    for source, dest in links:
-        _update_interface_topology(source, dest)
-
-    touched_ifc_ids = [source[1] for source, _dest in links]
-    _clear_topology_for_nontouched(touched_ifc_ids)
+    start = time.time()
+    wanted = dict((source[1], _get_link_target(dest))
+                  for source, dest in links)
+    changes = _find_changes(wanted, _get_current_topology())
+    _update_interfaces(changes)
+    cleared = _clear_topology_for_nontouched(wanted.keys())
+    _logger.info("layer 2 topology updated in %.2f seconds: %d of %d links "
+                 "changed, %d interfaces cleared", time.time() - start,
+                 len(changes), len(wanted), cleared)
 
-def _update_interface_topology(source_node, dest_node):
-    """Updates topology information for the source_node Interface.
 
-    The interface's topology will _only_ be updated if its netbox is up, it is
-    administratively up, is not missing, and its current topology information
-    differs from what we want to set it to.
+def _get_link_target(dest_node):
+    """Returns the (to_netbox, to_interface) ids an interface should have to
+    be linked to dest_node.
 
     """
-    _netboxid, interfaceid = source_node
-    ifc = Interface.objects.filter(id=interfaceid,
-                                   ifadminstatus=Interface.ADM_UP,
-                                   netbox__up=Netbox.UP_UP,
-                                   gone_since__isnull=True)
-
     if isinstance(dest_node, Port):
-        kwargs = {'to_netbox': int(dest_node[0]),
-                  'to_interface': int(dest_node[1])}
+        return int(dest_node[0]), int(dest_node[1])
     else:
-        kwargs = {'to_netbox': int(dest_node),
-                  'to_interface': None}
+        return int(dest_node), None
+
+
+def _get_current_topology():
+    """Returns the current topology of all interfaces whose topology may be
+    updated; those on netboxes that are up, that are administratively up and
+    not missing.
+
+    :returns: A dict mapping interface ids to (to_netbox, to_interface) ids.
+
+    """
+    ifcs = Interface.objects.filter(
+        ifadminstatus=Interface.ADM_UP,
+        netbox__up=Netbox.UP_UP,
+        gone_since__isnull=True).values_list('id', 'to_netbox',
+                                             'to_interface')
+    return dict((ifc, (to_netbox, to_interface))
+                for ifc, to_netbox, to_interface in ifcs.iterator())
+
+
+def _find_changes(wanted, current):
+    """Finds the interfaces whose topology needs updating.
+
+    :param wanted: A dict mapping interface ids to the (to_netbox,
+                   to_interface) ids they should have.
+    :param current: A dict of the current topology of the interfaces that may
+                    be updated, as returned by _get_current_topology().
+    :returns: A list of (interface, to_netbox, to_interface) id tuples.
+
+    """
+    return [(ifc,) + target for ifc, target in wanted.iteritems()
+            if ifc in current and current[ifc] != target]
+
+
+def _update_interfaces(changes):
+    """Sets new topology for a list of (interface, to_netbox, to_interface)
+    id tuples, in a single statement.
+
+    """
+    if not changes:
+        return
+    values = ", ".join(["(%s, %s::integer, %s::integer)"] * len(changes))
+    cursor = connection.cursor()
+    cursor.execute(
+        "UPDATE interface "
+        "SET to_netboxid = link.to_netboxid, "
+        "    to_interfaceid = link.to_interfaceid "
+        "FROM (VALUES %s) AS link (interfaceid, to_netboxid, to_interfaceid) "
+        "WHERE interface.interfaceid = link.interfaceid" % values,
+        list(chain(*changes)))
 
-    ifc = ifc.exclude(**kwargs)
-    ifc.update(**kwargs)
 
 def _clear_topology_for_nontouched(touched_ifc_ids):
     """Clears topology information for all interfaces that are administratively
     up, except for those in the touched_ifc_ids list and those who currently
     have no associated topology information.
 
+    The touched interface ids are loaded into a temporary table, to avoid
+    sending a huge exclusion list as part of the UPDATE statement.
+
+    :returns: The number of cleared interfaces.
+
     """
-    up_or_disabled = (
-        Q(ifoperstatus=Interface.OPER_UP) |
-        Q(ifadminstatus=Interface.ADM_DOWN)
-    )
-    up_or_disabled_ifcs = Interface.objects.filter(up_or_disabled,
-                                                   netbox__up=Netbox.UP_UP)
-    nontouched_ifcs = up_or_disabled_ifcs.exclude(id__in=touched_ifc_ids)
-    clearable_ifcs = nontouched_ifcs.exclude(to_netbox__isnull=True)
-    clearable_ifcs.update(to_netbox=None, to_interface=None)
+    cursor = connection.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE layer2_touched "
+                   "(interfaceid INTEGER PRIMARY KEY) ON COMMIT DROP")
+    for index in xrange(0, len(touched_ifc_ids), BATCH_SIZE):
+        batch = touched_ifc_ids[index:index + BATCH_SIZE]
+        cursor.execute(
+            "INSERT INTO layer2_touched (interfaceid) VALUES " +
+            ", ".join(["(%s)"] * len(batch)), batch)
+
+    cursor.execute(
+        "UPDATE interface SET to_netboxid = NULL, to_interfaceid = NULL "
+        "FROM netbox "
+        "WHERE interface.netboxid = netbox.netboxid "
+        "  AND netbox.up = %s "
+        "  AND (interface.ifoperstatus = %s OR interface.ifadminstatus = %s) "
+        "  AND interface.to_netboxid IS NOT NULL "
+        "  AND NOT EXISTS (SELECT 1 FROM layer2_touched "
+        "                  WHERE interfaceid = interface.interfaceid)",
+        [Netbox.UP_UP, Interface.OPER_UP, Interface.ADM_DOWN])
+    return cursor.rowcount
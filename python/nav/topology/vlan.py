@@ -19,26 +19,39 @@ import logging
 import networkx as nx
 from IPy import IP
 
-from nav.models.manage import GwPortPrefix, Interface, SwPortVlan, SwPortBlocked, Prefix
+from nav.bitvector import BitVector
+from nav.models.manage import (GwPortPrefix, Interface, SwPortVlan,
+                               SwPortBlocked, SwPortAllowedVlan, Prefix)
+from nav.topology.compact import (CompactLayer2Graph, IfcInfo, RoutedVlan,
+                                  analyze_routed_vlans)
 
 from django.db.models import Q
-from django.db import transaction
-from itertools import groupby, chain
+from django.db import connection, transaction
+from itertools import groupby, chain, izip
 from operator import attrgetter
 from collections import defaultdict
 from nav.netmap import stubs
 
 _LOGGER = logging.getLogger(__name__)
 NO_TRUNK = Q(trunk=False) | Q(trunk__isnull=True)
+# The max number of swportvlan records to insert or update per query
+BATCH_SIZE = 1000
 
 class VlanGraphAnalyzer(object):
-    """Analyzes VLAN topologies as a subset of the layer 2 topology"""
+    """Analyzes VLAN topologies as a subset of the layer 2 topology.
+
+    The analysis runs on a compact layer 2 graph of netbox and interface
+    ids.  Interface objects are only loaded for the interfaces that end up in
+    the resulting ifc_vlan_map.
+
+    """
     def __init__(self):
         self.vlans = self._build_vlan_router_dict()
-        self.layer2 = build_layer2_graph()
+        self.layer2 = build_compact_layer2_graph()
         self.stp_blocked = get_stp_blocked_ports()
         _LOGGER.debug("blocked ports: %r", self.stp_blocked)
         self.ifc_vlan_map = {}
+        self._interfaces = {}
 
     @staticmethod
     def _build_vlan_router_dict():
@@ -55,30 +68,64 @@ class VlanGraphAnalyzer(object):
         addrs = sorted(get_active_addresses_of_routed_vlans(), key=_sortkey)
         return dict((addr.prefix.vlan, addr) for addr in reversed(addrs))
 
-    def analyze_all(self):
-        """Analyze all VLAN topologies"""
-        for vlan in self.vlans:
-            _LOGGER.debug("Analyzing VLAN %s", vlan)
-            self.analyze_vlan(vlan)
+    def analyze_all(self, workers=1):
+        """Analyze all VLAN topologies
+
+        :param workers: The number of worker processes to analyze VLANs in.
+                        If 1, VLANs are analyzed one by one in this process.
+
+        """
+        self.analyze_vlans(self.vlans.keys(), workers)
         return self.ifc_vlan_map
 
-    def analyze_vlans_by_id(self, vlans):
+    def analyze_vlans_by_id(self, vlans, workers=1):
         """Analyzes a list of VLANs by their PVIDs"""
         vlan_id_map = dict((vlan.vlan, vlan) for vlan in self.vlans.keys())
-        for vlan in vlans:
-            if vlan in vlan_id_map:
-                self.analyze_vlan(vlan_id_map[vlan])
+        self.analyze_vlans(
+            [vlan_id_map[vlan] for vlan in vlans if vlan in vlan_id_map],
+            workers)
 
     def analyze_vlan(self, vlan):
         """Analyzes a single vlan"""
-        addr = self.vlans[vlan]
-        analyzer = RoutedVlanTopologyAnalyzer(addr, self.layer2,
-                                              self.stp_blocked)
-        topology = analyzer.analyze()
-        self._integrate_vlan_topology(vlan, topology)
-
-    def _integrate_vlan_topology(self, vlan, topology):
-        for ifc, direction in topology.items():
+        self.analyze_vlans([vlan])
+
+    def analyze_vlans(self, vlans, workers=1):
+        """Analyzes a list of VLANs, optionally in a pool of worker
+        processes.
+
+        """
+        routed_vlans = [self._get_routed_vlan(vlan) for vlan in vlans]
+        if workers > 1:
+            _LOGGER.debug("Analyzing %d VLANs using %d workers",
+                          len(routed_vlans), workers)
+
+        results = analyze_routed_vlans(self.layer2, self.stp_blocked,
+                                       routed_vlans, workers)
+        topologies = [(vlan, directions) for (_routed_vlan, directions), vlan
+                      in izip(results, vlans)]
+        self._load_interfaces(ifc_id for _vlan, directions in topologies
+                              for ifc_id in directions)
+        for vlan, directions in topologies:
+            self._integrate_vlan_topology(vlan, directions)
+
+    def _get_routed_vlan(self, vlan):
+        router_port = self.vlans[vlan].interface
+        return RoutedVlan(vlan.vlan, router_port.netbox_id,
+                          router_port.id, router_port.to_netbox_id)
+
+    def _load_interfaces(self, ifc_ids):
+        """Loads the Interface objects of the given ids, if not already
+        loaded.
+
+        """
+        missing = set(ifc_ids).difference(self._interfaces)
+        if missing:
+            self._interfaces.update(Interface.objects.select_related(
+                'netbox').in_bulk(list(missing)))
+
+    def _integrate_vlan_topology(self, vlan, directions):
+        for ifc_id, direction in directions.items():
+            ifc = self._interfaces[ifc_id]
             if ifc not in self.ifc_vlan_map:
                 self.ifc_vlan_map[ifc] = {}
             self.ifc_vlan_map[ifc][vlan] = direction
@@ -98,22 +145,35 @@ class VlanGraphAnalyzer(object):
         ports and yield those as tuples: (interface, {vlan: 'down'}).  These
         can be made into a dictionary suitable for updating ifc_vlan_map.
 
+        All access ports are found by a single query, and matched against
+        the active vlans of each netbox in memory.
+
         """
-        groups = groupby(self.ifc_vlan_map, lambda ifc: ifc.netbox)
-        for netbox, ifcs in groups:
-            for result in self._find_netbox_access_vlans(netbox, list(ifcs)):
-                yield result
-
-    def _find_netbox_access_vlans(self, netbox, ifcs):
-        vlans = chain(*(self.ifc_vlan_map[ifc].keys() for ifc in ifcs))
-        active_vlans = dict((vlan.vlan, vlan) for vlan in vlans)
-
-        access_ifcs = netbox.interface_set.filter(
-            vlan__isnull=False).filter(NO_TRUNK).exclude(
-            id__in=(ifc.id for ifc in ifcs))
-        for ifc in access_ifcs:
-            if ifc.vlan in active_vlans:
-                yield ifc, {active_vlans[ifc.vlan]: 'down'}
+        active_vlans = self._get_active_vlans_per_netbox()
+        if not active_vlans:
+            return
+        analyzed = set(ifc.id for ifc in self.ifc_vlan_map)
+
+        access_ifcs = Interface.objects.filter(
+            vlan__isnull=False, netbox__in=active_vlans.keys()).filter(
+            NO_TRUNK)
+        for ifc in access_ifcs.iterator():
+            vlans = active_vlans[ifc.netbox_id]
+            if ifc.id not in analyzed and ifc.vlan in vlans:
+                yield ifc, {vlans[ifc.vlan]: 'down'}
+
+    def _get_active_vlans_per_netbox(self):
+        """Returns a dict mapping netbox ids to dicts mapping VLAN numbers to
+        the Vlan objects that are active on the netbox, according to the
+        ifc_vlan_map.
+
+        """
+        active_vlans = defaultdict(dict)
+        for ifc, vlans in self.ifc_vlan_map.iteritems():
+            netbox_vlans = active_vlans[ifc.netbox_id]
+            for vlan in vlans:
+                netbox_vlans[vlan.vlan] = vlan
+        return dict(active_vlans)
 
 class RoutedVlanTopologyAnalyzer(object):
     """Analyzer of a single routed VLAN topology"""
@@ -313,25 +373,49 @@ class VlanTopologyUpdater(object):
 
     @transaction.commit_on_success
     def update(self):
-        """Updates the VLAN topology in the NAV database"""
-        for ifc, vlans in self.ifc_vlan_map.items():
-            for vlan, dirstr in vlans.items():
-                self._update_or_create_new_swportvlan_entry(ifc, vlan, dirstr)
-            self._remove_dead_swpvlan_records_for_ifc(ifc)
+        """Updates the VLAN topology in the NAV database.
 
-        self._delete_swportvlans_from_untouched_ifcs()
+        The existing swportvlan records are loaded once and compared to the
+        analyzed topology.  New records are bulk inserted, changed directions
+        are updated by a single query, and all records that are no longer
+        part of the topology are deleted by a single query.
 
-    @classmethod
-    def _update_or_create_new_swportvlan_entry(cls, ifc, vlan, dirstr):
-        direction = cls._direction_from_string(dirstr)
-        obj, created = SwPortVlan.objects.get_or_create(
-            interface=ifc, vlan=vlan,
-            defaults={'direction': direction})
-        if not created and obj.direction != direction:
-            obj.direction = direction
-            obj.save()
-        return object
+        """
+        wanted = self._get_wanted_records()
+        existing = self._get_existing_records()
+
+        to_create = [key for key in wanted if key not in existing]
+        to_update = [(existing[key][0], direction)
+                     for key, direction in wanted.iteritems()
+                     if key in existing and existing[key][1] != direction]
+        to_delete = [swpvlan_id for key, (swpvlan_id, _direction)
+                     in existing.iteritems() if key not in wanted]
+
+        _LOGGER.debug("swportvlan changes: %d new, %d updated, %d deleted",
+                      len(to_create), len(to_update), len(to_delete))
+        self._delete_swportvlans(to_delete)
+        self._update_directions(to_update)
+        self._create_swportvlans((key, wanted[key]) for key in to_create)
+
+    def _get_wanted_records(self):
+        """Returns a dict mapping (interfaceid, vlanid) tuples to directions,
+        as given by the ifc_vlan_map.
 
+        """
+        return dict(((ifc.pk, vlan.pk), self._direction_from_string(dirstr))
+                    for ifc, vlans in self.ifc_vlan_map.iteritems()
+                    for vlan, dirstr in vlans.iteritems())
+
+    @staticmethod
+    def _get_existing_records():
+        """Returns a dict mapping (interfaceid, vlanid) tuples to
+        (swportvlanid, direction) tuples for all existing swportvlan records.
+
+        """
+        records = SwPortVlan.objects.values_list(
+            'id', 'interface', 'vlan', 'direction')
+        return dict(((ifc, vlan), (swpvlan_id, direction))
+                    for swpvlan_id, ifc, vlan, direction in records.iterator())
 
     DIRECTION_MAP = {
         'up': SwPortVlan.DIRECTION_UP,
@@ -345,15 +429,37 @@ class VlanTopologyUpdater(object):
                 if string in cls.DIRECTION_MAP
                 else SwPortVlan.DIRECTION_UNDEFINED)
 
-    def _remove_dead_swpvlan_records_for_ifc(self, ifc):
-        records_for_ifc = SwPortVlan.objects.filter(interface=ifc)
-        active_vlans = self.ifc_vlan_map[ifc].keys()
-        dead = records_for_ifc.exclude(vlan__in=active_vlans)
-        dead.delete()
+    @staticmethod
+    def _create_swportvlans(records):
+        SwPortVlan.objects.bulk_create(
+            [SwPortVlan(interface_id=ifc, vlan_id=vlan, direction=direction)
+             for (ifc, vlan), direction in records],
+            batch_size=BATCH_SIZE)
+
+    @staticmethod
+    def _update_directions(updates):
+        """Sets new directions for a list of (swportvlanid, direction)
+        tuples.
+
+        """
+        cursor = connection.cursor()
+        for index in xrange(0, len(updates), BATCH_SIZE):
+            batch = updates[index:index + BATCH_SIZE]
+            values = ", ".join(["(%s, %s)"] * len(batch))
+            cursor.execute(
+                "UPDATE swportvlan SET direction = changed.direction "
+                "FROM (VALUES %s) AS changed (swportvlanid, direction) "
+                "WHERE swportvlan.swportvlanid = changed.swportvlanid"
+                % values,
+                list(chain(*batch)))
 
-    def _delete_swportvlans_from_untouched_ifcs(self):
-        touched = self.ifc_vlan_map.keys()
-        SwPortVlan.objects.exclude(interface__in=touched).delete()
+    @staticmethod
+    def _delete_swportvlans(swpvlan_ids):
+        if swpvlan_ids:
+            cursor = connection.cursor()
+            cursor.execute(
+                "DELETE FROM swportvlan WHERE swportvlanid = ANY(%s)",
+                (swpvlan_ids,))
 
 
 def build_layer2_graph(related_extra=None):
@@ -379,6 +485,46 @@ def build_layer2_graph(related_extra=None):
         graph.add_edge(link.netbox, dest, key=link)
     return graph
 
+def build_compact_layer2_graph():
+    """Builds a compact representation of the layer 2 topology stored in the
+    NAV database, without loading any model objects.
+
+    :returns: A CompactLayer2Graph, equivalent to the graph returned by
+              build_layer2_graph().
+
+    """
+    allowed_vlans = {}
+    distinct = {}
+    allowed = SwPortAllowedVlan.objects.filter(
+        interface__trunk=True, interface__to_netbox__isnull=False
+    ).values_list('interface', 'hex_string')
+    for ifc, hex_string in allowed.iterator():
+        if hex_string not in distinct:
+            try:
+                distinct[hex_string] = BitVector.from_hex(hex_string or '')
+            except ValueError:
+                _LOGGER.warning("invalid allowed vlans on interface %s: %r",
+                                ifc, hex_string)
+                distinct[hex_string] = None
+        allowed_vlans[ifc] = distinct[hex_string]
+
+    access_vlans = defaultdict(dict)
+    non_trunks = Interface.objects.filter(vlan__isnull=False).filter(
+        NO_TRUNK).values_list('netbox', 'vlan', 'id')
+    for netbox, vlan, ifc in non_trunks.iterator():
+        access_vlans[netbox].setdefault(vlan, []).append(ifc)
+
+    links = Interface.objects.filter(to_netbox__isnull=False).values_list(
+        'id', 'netbox', 'to_netbox', 'to_interface', 'to_interface__netbox',
+        'trunk', 'vlan')
+    return CompactLayer2Graph(
+        ((netbox, to_ifc_netbox or to_netbox, ifc,
+          IfcInfo(to_ifc, trunk, vlan, allowed_vlans.get(ifc)))
+         for ifc, netbox, to_netbox, to_ifc, to_ifc_netbox, trunk, vlan
+         in links.iterator()),
+        dict(access_vlans))
+
+
 def build_layer3_graph(related_extra=None):
     """Build a graph representation of the layer 3 topology stored in the NAV
     database.
@@ -19,6 +19,9 @@ import os
 import re
 import stat
 import datetime
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from itertools import chain, tee, ifilter
 
@@ -344,6 +347,50 @@ class cachedfor(object):
         return _wrapper
 
 
+class TimedLRUCache(object):
+    """A bounded, thread-safe LRU cache whose entries expire after a given
+    time.
+
+    :param max_size: The maximum number of cached entries.
+    :param ttl: The default number of seconds an entry is kept.
+
+    """
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Returns a (found, value) tuple for key"""
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return False, None
+            if time.time() > expires:
+                return False, None
+            self._entries[key] = (expires, value)
+            return True, value
+
+    def put(self, key, value, ttl=None):
+        """Caches value for key, for ttl seconds if given"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
 def synchronized(lock):
     """Synchronization decorator.
 
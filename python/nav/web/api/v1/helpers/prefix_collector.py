@@ -13,11 +13,54 @@
 # more details.  You should have received a copy of the GNU General Public
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-"""Provides functions for fetching prefix related data in the API"""
+"""Provides functions for fetching prefix related data in the API
 
+Usage for many prefixes is computed in bulk: For up to SQL_BATCH_SIZE
+prefixes, a single query counts the active addresses of every prefix, using
+index range scans on arp.ip.  For larger sets of prefixes, the distinct active
+addresses are streamed from the database in sorted order, and merged with the
+sorted list of prefixes in Python.
+
+Current usage can also be read from the prefix_usage table, which is
+refreshed by the active IP collector.
+
+"""
+
+from datetime import datetime, timedelta
 from IPy import IP
 from django.db import connection
 
+SQL_BATCH_SIZE = 1000
+FETCH_SIZE = 10000
+MAX_CACHE_AGE = timedelta(hours=1)
+
+USAGE_QUERY = """
+SELECT prefix.netaddr, COUNT(DISTINCT arp.ip) AS ipcount
+FROM (
+  SELECT netaddr,
+         set_masklen(netaddr::inet, maxlen) AS first_ip,
+         set_masklen(broadcast(netaddr), maxlen) AS last_ip
+  FROM (
+    SELECT netaddr, CASE family(netaddr) WHEN 4 THEN 32 ELSE 128 END AS maxlen
+    FROM unnest(%s::cidr[]) AS netaddr
+  ) AS prefixes
+) AS prefix
+LEFT JOIN arp ON (arp.ip BETWEEN prefix.first_ip AND prefix.last_ip
+                  AND arp.ip << prefix.netaddr
+                  AND {condition})
+GROUP BY prefix.netaddr
+"""
+
+ACTIVE_IPS_QUERY = """
+SELECT DISTINCT ip FROM arp WHERE {condition} ORDER BY ip
+"""
+
+CACHED_USAGE_QUERY = """
+SELECT netaddr, active_addresses
+FROM prefix_usage
+WHERE netaddr = ANY(%s::cidr[]) AND updated >= %s
+"""
+
 
 class UsageResult(object):
     """Container for creating usage results for serializing"""
@@ -37,9 +80,167 @@ class UsageResult(object):
         self.endtime = endtime if self.starttime else None
 
 
+class PrefixUsages(object):
+    """A lazily evaluated sequence of UsageResults for a list of prefixes.
+
+    Usage is only computed for the items that are actually accessed, in
+    bulk, which makes this suitable for pagination and streaming.
+
+    """
+    def __init__(self, prefixes, starttime=None, endtime=None,
+                 use_cache=False):
+        self.prefixes = list(prefixes)
+        self.starttime = starttime
+        self.endtime = endtime
+        self.use_cache = use_cache
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._get_usages(self.prefixes[index])
+        return self._get_usages([self.prefixes[index]])[0]
+
+    def __iter__(self):
+        for index in xrange(0, len(self.prefixes), SQL_BATCH_SIZE):
+            for usage in self[index:index + SQL_BATCH_SIZE]:
+                yield usage
+
+    def _get_usages(self, prefixes):
+        counts = count_active_addresses(prefixes, self.starttime,
+                                        self.endtime, self.use_cache)
+        return [UsageResult(prefix, counts.get(prefix, 0), self.starttime,
+                            self.endtime)
+                for prefix in prefixes]
+
+
 def fetch_usages(prefixes, starttime, endtime):
     """Fetch usage for a list of prefixes"""
-    return [fetch_usage(prefix, starttime, endtime) for prefix in prefixes]
+    counts = count_active_addresses(prefixes, starttime, endtime)
+    return [UsageResult(prefix, counts.get(prefix, 0), starttime, endtime)
+            for prefix in prefixes]
+
+
+def count_active_addresses(prefixes, starttime=None, endtime=None,
+                           use_cache=False):
+    """Counts the active addresses of a list of prefixes in bulk.
+
+    :param prefixes: A list of IPy.IP prefixes.
+    :param use_cache: If True, and no time window is given, current usage is
+                      read from the prefix_usage table, when it is fresh
+                      enough.
+    :returns: A dict of {prefix: active_address_count} items.
+
+    """
+    prefixes = list(prefixes)
+    counts = {}
+    if use_cache and not starttime:
+        counts = _get_cached_counts(prefixes)
+        prefixes = [prefix for prefix in prefixes if prefix not in counts]
+    if not prefixes:
+        return counts
+
+    if len(prefixes) <= SQL_BATCH_SIZE:
+        counts.update(_count_by_query(prefixes, starttime, endtime))
+    else:
+        addresses = _iter_active_addresses(starttime, endtime)
+        counts.update(count_sorted(prefixes, addresses))
+    return counts
+
+
+def _get_time_condition(starttime, endtime):
+    if starttime and endtime:
+        return ("(arp.start_time, arp.end_time) OVERLAPS (%s, %s)",
+                [starttime, endtime])
+    elif starttime:
+        return "%s BETWEEN arp.start_time AND arp.end_time", [starttime]
+    else:
+        return "arp.end_time = 'infinity'", []
+
+
+def _count_by_query(prefixes, starttime, endtime):
+    condition, params = _get_time_condition(starttime, endtime)
+    cursor = connection.cursor()
+    cursor.execute(USAGE_QUERY.format(condition=condition),
+                   [[prefix.strNormal() for prefix in prefixes]] + params)
+    return dict((IP(netaddr), int(count))
+                for netaddr, count in cursor.fetchall())
+
+
+def _iter_active_addresses(starttime, endtime):
+    """Yields all distinct active addresses in sorted order, using a server
+    side cursor.
+
+    """
+    condition, params = _get_time_condition(starttime, endtime)
+    connection.cursor()  # ensures the connection is open
+    cursor = connection.connection.cursor('prefix_usage_addresses')
+    cursor.itersize = FETCH_SIZE
+    try:
+        cursor.execute(ACTIVE_IPS_QUERY.format(condition=condition), params)
+        for (address,) in cursor:
+            yield address
+    finally:
+        cursor.close()
+
+
+def _get_cached_counts(prefixes):
+    cursor = connection.cursor()
+    cursor.execute(CACHED_USAGE_QUERY,
+                   ([prefix.strNormal() for prefix in prefixes],
+                    datetime.now() - MAX_CACHE_AGE))
+    return dict((IP(netaddr), int(count))
+                for netaddr, count in cursor.fetchall())
+
+
+def count_sorted(prefixes, addresses):
+    """Counts the addresses of each prefix by merging a sorted list of
+    prefixes with a sorted sequence of addresses.
+
+    Since CIDR prefixes are either nested or disjoint, the prefixes that
+    contain the current address always form a chain of nested prefixes,
+    kept on a stack.  Addresses are counted on the innermost prefix, and
+    added to the enclosing prefix when a prefix is popped off the stack.
+
+    :param prefixes: A list of IPy.IP prefixes.
+    :param addresses: An iterable of IP address strings, sorted the same way
+                      PostgreSQL sorts inet values.
+    :returns: A dict of {prefix: address_count} items.
+
+    """
+    # enclosing prefixes are sorted before the prefixes they contain
+    ranges = sorted(((prefix.version(), prefix.int(),
+                      prefix.int() + prefix.len() - 1, prefix)
+                     for prefix in prefixes),
+                    key=lambda item: (item[0], item[1], -item[2]))
+    counts = dict((prefix, 0) for prefix in prefixes)
+    stack = []
+
+    def _pop():
+        _version, _start, _end, prefix = stack.pop()
+        if stack:
+            counts[stack[-1][3]] += counts[prefix]
+
+    index = 0
+    for address in addresses:
+        address = IP(address)
+        key = (address.version(), address.int())
+        while stack and stack[-1][:3:2] < key:
+            _pop()
+        while index < len(ranges) and ranges[index][:2] <= key:
+            item = ranges[index]
+            index += 1
+            while stack and stack[-1][:3:2] < item[:2]:
+                _pop()
+            if item[:3:2] >= key:
+                stack.append(item)
+        if stack:
+            counts[stack[-1][3]] += 1
+
+    while stack:
+        _pop()
+    return counts
 
 
 def fetch_usage(prefix, starttime, endtime):
@@ -0,0 +1,210 @@
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Keyset pagination and sparse field selection for the NAV REST api.
+
+Keyset pagination is enabled by the cursor query parameter, which is empty
+for the first page.  Rows are ordered by one of the viewset's keyset fields,
+chosen by the keyset query parameter, with the primary key as a tie breaker.
+Each page links to the next using an opaque cursor holding the sort key of
+its last row, so that fetching a page costs the same regardless of how deep
+into the result it is.
+
+The fields query parameter is a comma separated list of the fields to
+include in each object.  Only those fields are selected from the database.
+
+"""
+import base64
+from datetime import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+CURSOR_PARAM = 'cursor'
+KEYSET_PARAM = 'keyset'
+FIELDS_PARAM = 'fields'
+
+
+def get_requested_fields(request):
+    """Returns the set of field names listed in the fields query parameter
+    of request, or None if all fields should be included.
+
+    """
+    if request is None:
+        return None
+    fields = request.QUERY_PARAMS.get(FIELDS_PARAM, '')
+    fields = set(field.strip() for field in fields.split(',')
+                 if field.strip())
+    return fields or None
+
+
+class SparseFieldsMixin(object):
+    """Serializer mixin that drops the fields that weren't listed in the
+    fields query parameter of the request, if given.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        fields = get_requested_fields(self.context.get('request'))
+        if fields:
+            for name in self.fields.keys():
+                if name not in fields:
+                    del self.fields[name]
+
+
+class KeysetPaginationMixin(object):
+    """Viewset mixin that adds keyset pagination to the list view, and
+    narrows the database query to the requested fields.
+
+    """
+    keyset_fields = ('id',)
+
+    def filter_queryset(self, queryset):
+        queryset = super(KeysetPaginationMixin, self).filter_queryset(queryset)
+        return project_queryset(queryset, get_requested_fields(self.request),
+                                self.keyset_fields)
+
+    def list(self, request, *args, **kwargs):
+        if CURSOR_PARAM not in request.QUERY_PARAMS:
+            return super(KeysetPaginationMixin, self).list(
+                request, *args, **kwargs)
+
+        keyset = request.QUERY_PARAMS.get(KEYSET_PARAM, self.keyset_fields[0])
+        if keyset not in self.keyset_fields:
+            return Response(
+                {'detail': 'keyset must be one of: %s' %
+                 ', '.join(self.keyset_fields)},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        order = get_keyset_order(queryset.model, keyset)
+        try:
+            last = decode_cursor(request.QUERY_PARAMS[CURSOR_PARAM])
+            page = get_keyset_page(queryset, order, last,
+                                   self.get_paginate_by())
+        except ValueError:
+            return Response({'detail': 'Invalid cursor'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        rows, next_key = page
+        next_url = None
+        if next_key is not None:
+            next_url = replace_query_param(request.build_absolute_uri(),
+                                           CURSOR_PARAM,
+                                           encode_cursor(next_key))
+        serializer = self.get_serializer(rows, many=True)
+        return Response({'next': next_url, 'results': serializer.data})
+
+
+def project_queryset(queryset, fields, required=()):
+    """Narrows queryset to select only the given model fields, and prefetches
+    many-to-many relations that will be serialized.
+
+    :param fields: a set of field names, or None to select all fields.
+    :param required: names of fields that must always be selected.
+
+    """
+    model = queryset.model
+    many_to_many = [field.name for field in model._meta.many_to_many
+                    if fields is None or field.name in fields]
+    if many_to_many:
+        queryset = queryset.prefetch_related(*many_to_many)
+    if fields is not None:
+        columns = set(field.name for field in model._meta.fields)
+        only = (fields | set(required)) & columns
+        queryset = queryset.only(*only)
+    return queryset
+
+
+def get_keyset_order(model, keyset):
+    """Returns the fields to order by when paginating on keyset"""
+    pk_name = model._meta.pk.name
+    if keyset in ('pk', pk_name):
+        return (pk_name,)
+    return (keyset, pk_name)
+
+
+def get_keyset_page(queryset, order, last, page_size):
+    """Fetches a page of rows following a position in a keyset ordering.
+
+    :param order: a tuple of the names of the non-NULL fields to order by,
+                  ending with the primary key.
+    :param last: the sort key of the last row of the previous page, or None
+                 to fetch the first page.
+    :returns: a list of rows, and the sort key of the last row, or None if
+              this is the last page.
+
+    """
+    if last:
+        queryset = filter_after(queryset, order, last)
+    rows = list(queryset.order_by(*order)[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, [getattr(rows[-1], name) for name in order]
+
+
+def filter_after(queryset, order, key):
+    """Filters queryset to rows that come after key in order, using a row
+    value comparison that can be answered from an index on the order fields.
+
+    """
+    if len(key) != len(order):
+        raise ValueError("cursor doesn't match keyset")
+    meta = queryset.model._meta
+    fields = [meta.get_field(name) for name in order]
+    try:
+        values = [field.get_db_prep_value(field.to_python(value),
+                                          connection=connection)
+                  for field, value in zip(fields, key)]
+    except ValidationError:
+        raise ValueError("invalid cursor value")
+    if len(fields) == 1:
+        return queryset.filter(**{'%s__gt' % order[0]: values[0]})
+
+    quote = connection.ops.quote_name
+    columns = ', '.join('%s.%s' % (quote(meta.db_table), quote(field.column))
+                        for field in fields)
+    where = '(%s) > (%s)' % (columns, ', '.join(['%s'] * len(values)))
+    return queryset.extra(where=[where], params=values)
+
+
+def encode_cursor(key):
+    """Encodes a sort key as an opaque cursor string"""
+    key = [value.isoformat() if isinstance(value, datetime) else value
+           for value in key]
+    return base64.urlsafe_b64encode(json.dumps(key))
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor string into a sort key.
+
+    :returns: A list of values, or None if cursor is empty.
+    :raises ValueError: if cursor is invalid.
+
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, UnicodeError):
+        raise ValueError("invalid cursor")
+    if not isinstance(key, list):
+        raise ValueError("invalid cursor")
+    return key
@@ -17,28 +17,29 @@
 """Serializers for the NAV REST api"""
 
 from nav.models import manage
+from nav.web.api.v1.pagination import SparseFieldsMixin
 from rest_framework import serializers
 
 
-class NetboxSerializer(serializers.ModelSerializer):
+class NetboxSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for the netbox model"""
     class Meta:
         model = manage.Netbox
 
 
-class InterfaceSerializer(serializers.ModelSerializer):
+class InterfaceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for the interface model"""
     class Meta:
         model = manage.Interface
 
 
-class CamSerializer(serializers.ModelSerializer):
+class CamSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for the cam model"""
     class Meta:
         model = manage.Cam
 
 
-class ArpSerializer(serializers.ModelSerializer):
+class ArpSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for the arp model"""
     class Meta:
         model = manage.Arp
@@ -35,6 +35,7 @@ from nav.models.fields import INFINITY
 from nav.web.api.v1 import serializers
 from .auth import APIPermission, APIAuthentication
 from .helpers import prefix_collector
+from .pagination import KeysetPaginationMixin
 
 EXPIRE_DELTA = timedelta(days=365)
 MINIMUMPREFIXLENGTH = 4
@@ -71,7 +72,8 @@ class RoomViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
     filter_fields = ('location', 'description')
 
 
-class NetboxViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
+class NetboxViewSet(KeysetPaginationMixin, NAVAPIMixin,
+                    viewsets.ReadOnlyModelViewSet):
     """Makes netboxes accessible from api"""
     queryset = manage.Netbox.objects.all()
     serializer_class = serializers.NetboxSerializer
@@ -79,7 +81,8 @@ class NetboxViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
     search_fields = ('sysname', )
 
 
-class InterfaceViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
+class InterfaceViewSet(KeysetPaginationMixin, NAVAPIMixin,
+                       viewsets.ReadOnlyModelViewSet):
     """Makes interfaces accessible from api"""
     queryset = manage.Interface.objects.all()
     serializer_class = serializers.InterfaceSerializer
@@ -88,10 +91,12 @@ class InterfaceViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
     search_fields = ('ifalias', 'ifdescr', 'ifname')
 
 
-class CamViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
+class CamViewSet(KeysetPaginationMixin, NAVAPIMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """Makes cam accessible from api"""
     serializer_class = serializers.CamSerializer
     filter_fields = ('mac', 'netbox', 'ifindex', 'port')
+    keyset_fields = ('id', 'start_time', 'end_time')
 
     def get_queryset(self):
         """Filter on custom parameters"""
@@ -103,10 +108,12 @@ class CamViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-class ArpViewSet(NAVAPIMixin, viewsets.ReadOnlyModelViewSet):
+class ArpViewSet(KeysetPaginationMixin, NAVAPIMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """Makes cam accessible from api"""
     serializer_class = serializers.ArpSerializer
     filter_fields = ('ip', 'mac', 'netbox', 'prefix')
+    keyset_fields = ('id', 'start_time', 'end_time')
 
     def get_queryset(self):
         """Filter on custom parameters"""
@@ -153,7 +160,13 @@ def get_times(request):
 
 
 class PrefixUsageList(NAVAPIMixin, ListAPIView):
-    """Makes prefix usage for all prefixes available"""
+    """Makes prefix usage for all prefixes available
+
+    Usage is only computed for the requested page of prefixes.  If the
+    `stream` parameter is set, usage for all prefixes is streamed as a JSON
+    list instead.  If the `cached` parameter is set, current usage may be
+    read from the cache maintained by the active IP collector.
+    """
     serializer_class = serializers.PrefixUsageSerializer
 
     def get(self, request, *args, **kwargs):
@@ -164,6 +177,9 @@ class PrefixUsageList(NAVAPIMixin, ListAPIView):
             return Response(
                 'start or endtime not formatted correctly. Use iso8601 format',
                 status=status.HTTP_400_BAD_REQUEST)
+        if 'stream' in request.GET:
+            return HttpResponse(self.stream(self.get_queryset()),
+                                content_type='application/json')
         return super(PrefixUsageList, self).get(request, *args, **kwargs)
 
     def get_queryset(self):
@@ -175,7 +191,18 @@ class PrefixUsageList(NAVAPIMixin, ListAPIView):
             if tmp_prefix.len() >= MINIMUMPREFIXLENGTH:
                 prefixes.append(tmp_prefix)
 
-        return prefix_collector.fetch_usages(prefixes, starttime, endtime)
+        return prefix_collector.PrefixUsages(
+            prefixes, starttime, endtime,
+            use_cache='cached' in self.request.GET)
+
+    def stream(self, usages):
+        """Yields the serialized usages as a JSON list, piece by piece"""
+        renderer = JSONRenderer()
+        yield '['
+        for index, usage in enumerate(usages):
+            data = self.get_serializer(usage).data
+            yield (',' if index else '') + renderer.render(data)
+        yield ']'
 
 
 class PrefixUsageDetail(NAVAPIMixin, APIView):
@@ -25,15 +25,20 @@ Based on datacollector.py from the old Java-applet based Netmap.
 
 """
 
+import hashlib
 import logging
 
+from django.core.cache import cache
+
 import nav
 from nav.config import read_flat_config
-from nav.metrics.data import get_metric_average
+from nav.metrics.data import get_metric_average, get_metric_data
 from nav.metrics.errors import GraphiteUnreachableError
-from nav.metrics.graphs import get_metric_meta
+from nav.metrics.graphs import get_metric_meta, extract_series_name
 from nav.metrics.templates import (metric_path_for_interface,
-                                   metric_path_for_cpu_load, metric_path_for_cpu_utilization)
+                                   metric_path_for_cpu_load,
+                                   metric_path_for_cpu_utilization,
+                                   metric_prefix_for_cpu)
 from nav.web.geomap.utils import lazy_dict, subdict, fix
 
 _logger = logging.getLogger(__name__)
@@ -45,7 +50,7 @@ except IOError:
 _domain_suffix = _nav_conf.get('DOMAIN_SUFFIX', None)
 
 
-def get_data(db_cursor, bounds, time_interval=None):
+def get_data(db_cursor, bounds, time_interval=None, metrics=None):
     """Reads data from database.
 
     Returns a pair of dictionaries (netboxes, connections).  netboxes
@@ -56,6 +61,10 @@ def get_data(db_cursor, bounds, time_interval=None):
     reading of RRD files until we know it is necessary, while still
     keeping the code for reading them here).
 
+    The load values are read through metrics, a MetricLoader.  Call its
+    load_graph method once the graph has been filtered, to fetch the
+    values that are actually needed in a few batched requests.
+
     """
 
     if not db_cursor:
@@ -68,9 +77,8 @@ def get_data(db_cursor, bounds, time_interval=None):
 
     network_query_args = bounds_list + bounds_list + [network_length_limit]
 
-    if time_interval is None:
-        time_interval = {'start': '-10min',
-                         'end': 'now'}
+    if metrics is None:
+        metrics = MetricLoader(time_interval)
 
     connections = {}
 
@@ -299,18 +307,6 @@ ORDER BY remote_sysname, local_sysname, interface_swport.speed DESC
             map(lambda p: 'local_'+p, reversable_properties),
             map(lambda p: 'remote_'+p, reversable_properties))
 
-        # Add load data to both res and reverse.  We use the laziness
-        # of lazy_dict here (see documentation of class lazy_dict in
-        # utils.py) to avoid reading the RRD files until we know that
-        # they are needed.
-        def add_load_properties(d):
-            d[['load']] = fix(get_link_load,
-                              [d['local_sysname'], d['local_interface'],
-                               time_interval])
-            d[['load_in']] = lambda: d['load'][0]
-            d[['load_out']] = lambda: d['load'][1]
-        map(add_load_properties, [res, reverse])
-
         connection_id = "%s-%s" % (res['local_sysname'], res['remote_sysname'])
         connection_rid = "%s-%s" % (res['remote_sysname'], res['local_sysname'])
         res['id'] = connection_id
@@ -329,6 +325,18 @@ ORDER BY remote_sysname, local_sysname, interface_swport.speed DESC
                     (existing_conn['forward']['capacity'] < res['capacity'])):
                     connections[existing_id] = connection
 
+    # Add load data to both ends of each connection.  We use the laziness
+    # of lazy_dict here (see documentation of class lazy_dict in utils.py)
+    # to avoid fetching metrics until we know that they are needed.
+    def add_load_properties(d):
+        metrics.add_link(d['id'], d['local_sysname'], d['local_interface'])
+        d[['load']] = fix(metrics.get_link_load, [d['id']])
+        d[['load_in']] = lambda: d['load'][0]
+        d[['load_out']] = lambda: d['load'][1]
+    for connection in connections.values():
+        map(add_load_properties, [connection['forward'],
+                                  connection['reverse']])
+
     query_netboxes = """
         SELECT DISTINCT ON (netboxid)
                netbox.netboxid, netbox.sysname, netbox.ip,
@@ -346,8 +354,8 @@ ORDER BY remote_sysname, local_sysname, interface_swport.speed DESC
     db_cursor.execute(query_netboxes)
     netboxes = [lazy_dict(row) for row in db_cursor.fetchall()]
     for netbox in netboxes:
-        netbox[['load']] = fix(get_cpu_load,
-                               [netbox['sysname'], time_interval])
+        metrics.add_netbox(netbox['netboxid'], netbox['sysname'])
+        netbox[['load']] = fix(metrics.get_cpu_load, [netbox['netboxid']])
         if netbox['sysname'].endswith(_domain_suffix):
             hostname_length = len(netbox['sysname']) - len(_domain_suffix)
             netbox['sysname'] = netbox['sysname'][0:hostname_length]
@@ -358,70 +366,225 @@ ORDER BY remote_sysname, local_sysname, interface_swport.speed DESC
 # TRAFFIC DATA
 
 MEGABIT = 1e6
+NAN = float('nan')
+DEFAULT_TIME_INTERVAL = {'start': '-10min', 'end': 'now'}
+# The number of metric targets to ask for in a single render request
+MAX_TARGETS_PER_REQUEST = 50
+# Seconds to keep fetched values in the cache shared between requests
+CACHE_TIMEOUT = 60
 
 
-def get_link_load(sysname, ifname, time_interval):
-    """Gets the link load of the interface, averaged over a time interval.
+class MetricLoader(object):
+    """Fetches link and CPU load values for geomap from Graphite.
 
-    :param sysname: The sysname of the device we're measuring from.
-    :param ifname: An interface name.
-    :param time_interval: A dict(start=..., end=...) describing the desired
-                          time interval in terms valid to Graphite web.
-    :returns: An (avg_in_Mbps, avg_out_Mbps) tuple.
+    The links and netboxes of a map are registered by their ids, but no
+    values are fetched until they are asked for.  load_graph fetches the
+    values for all the links and netboxes of a graph in a few multi-target
+    render requests, instead of one request for each value.
+
+    Fetched values are also kept in the Django cache for a short while, to
+    be reused by subsequent requests for overlapping parts of the map.
 
     """
-    in_bps = out_bps = float('nan')
-    if sysname and ifname:
-        targets = [metric_path_for_interface(sysname, ifname, counter)
-                   for counter in ('ifInOctets', 'ifOutOctets')]
-        targets = [get_metric_meta(t)['target'] for t in targets]
-        try:
-            data = get_metric_average(targets,
-                                      start=time_interval['start'],
-                                      end=time_interval['end'])
-        except GraphiteUnreachableError:
-            _logger.error("graphite unreachable on load query for %s:%s (%r)",
-                          sysname, ifname, time_interval)
-            return in_bps, out_bps
-
-        for key, value in data.iteritems():
-            if 'ifInOctets' in key:
-                in_bps = value / MEGABIT
-            elif 'ifOutOctets' in key:
-                out_bps = value / MEGABIT
-
-    return in_bps, out_bps
-
-
-def get_cpu_load(sysname, time_interval):
-    """Returns the average 5 minute CPU load of sysname.
-
-    Question is, of _which_ CPU? Let's just get the one that has the highest
-    maximum value.
-
-    :param sysname: The sysname of the device whose CPU load we're to get.
-    :param time_interval: A dict(start=..., end=...) describing the desired
-                          time interval in terms valid to Graphite web.
-    :returns: A floating number representation of the load between 0 and
-              100.0 (possibly higher in some multi-CPU settings).
+    def __init__(self, time_interval=None):
+        """
+        :param time_interval: A dict(start=..., end=...) describing the
+                              desired time interval in terms valid to
+                              Graphite web.
+
+        """
+        self.time_interval = time_interval or DEFAULT_TIME_INTERVAL
+        self._links = {}
+        self._netboxes = {}
+        self._link_loads = {}
+        self._cpu_loads = {}
+
+    def add_link(self, link_id, sysname, ifname):
+        """Registers the interface at the local end of a link"""
+        self._links[link_id] = (sysname, ifname)
+
+    def add_netbox(self, netboxid, sysname):
+        """Registers a netbox"""
+        self._netboxes[netboxid] = sysname
+
+    def get_link_load(self, link_id):
+        """Returns the link load of a registered link, as an
+        (avg_in_Mbps, avg_out_Mbps) tuple.
+
+        """
+        key = self._links[link_id]
+        if key not in self._link_loads:
+            self.load(link_ids=[link_id])
+        return self._link_loads[key]
+
+    def get_cpu_load(self, netboxid):
+        """Returns the average 5 minute CPU load of a registered netbox, as a
+        floating number between 0 and 100.0 (possibly higher in some multi-CPU
+        settings).
+
+        """
+        sysname = self._netboxes[netboxid]
+        if sysname not in self._cpu_loads:
+            self.load(netboxids=[netboxid])
+        return self._cpu_loads[sysname]
+
+    def load_graph(self, graph):
+        """Fetches the values needed for the nodes and edges of a graph from
+        build_graph().
+
+        """
+        link_ids = []
+        for edge in graph.edges.itervalues():
+            link_ids.extend((edge.id, edge.reverse_id))
+        self.load(link_ids=link_ids, netboxids=graph.nodes.keys())
+
+    def load(self, link_ids=(), netboxids=()):
+        """Fetches the values of the given registered links and netboxes,
+        unless they have already been fetched.
+
+        """
+        links = set(self._links[link_id] for link_id in link_ids
+                    if link_id in self._links)
+        links.difference_update(self._link_loads)
+        sysnames = set(self._netboxes[netboxid] for netboxid in netboxids
+                       if netboxid in self._netboxes)
+        sysnames.difference_update(self._cpu_loads)
+
+        self._link_loads.update(self._load_cached('link', links,
+                                                  self._fetch_link_loads))
+        self._cpu_loads.update(self._load_cached('cpu', sysnames,
+                                                 self._fetch_cpu_loads))
+
+    def _load_cached(self, kind, keys, fetch):
+        """Returns a dict of values for keys, from the cache or from fetch"""
+        if not keys:
+            return {}
+        cache_keys = dict((self._make_cache_key(kind, key), key)
+                          for key in keys)
+        cached = cache.get_many(cache_keys.keys())
+        result = dict((cache_keys[cache_key], value)
+                      for cache_key, value in cached.iteritems())
+
+        missing = [key for key in keys if key not in result]
+        if missing:
+            fetched, complete = fetch(missing)
+            result.update(fetched)
+            if complete:
+                cache.set_many(
+                    dict((self._make_cache_key(kind, key), value)
+                         for key, value in fetched.iteritems()),
+                    CACHE_TIMEOUT)
+        return result
+
+    def _make_cache_key(self, kind, key):
+        digest = hashlib.md5(repr((self.time_interval['start'],
+                                   self.time_interval['end'], key)))
+        return 'geomap:%s:%s' % (kind, digest.hexdigest())
+
+    def _fetch_link_loads(self, links):
+        """Fetches the link loads of a list of (sysname, ifname) tuples.
+
+        :returns: A dict of {(sysname, ifname): (in_Mbps, out_Mbps)}, and
+                  whether all requests succeeded.
+
+        """
+        loads = dict((link, [NAN, NAN]) for link in links)
+        series = {}
+        for sysname, ifname in links:
+            if not (sysname and ifname):
+                continue
+            for index, counter in enumerate(('ifInOctets', 'ifOutOctets')):
+                path = metric_path_for_interface(sysname, ifname, counter)
+                target = get_metric_meta(path)['target']
+                series[target] = (path, (sysname, ifname), index)
+
+        complete = True
+        for targets in _chunks(sorted(series), MAX_TARGETS_PER_REQUEST):
+            try:
+                data = get_metric_average(targets,
+                                          start=self.time_interval['start'],
+                                          end=self.time_interval['end'])
+            except GraphiteUnreachableError:
+                _logger.error("graphite unreachable on load query for %d "
+                              "interfaces (%r)", len(targets) // 2,
+                              self.time_interval)
+                complete = False
+                continue
+
+            by_path = dict((series[target][0], series[target][1:])
+                           for target in targets)
+            for key, value in data.iteritems():
+                link, index = by_path.get(extract_series_name(key),
+                                          (None, None))
+                if link and value is not None:
+                    loads[link][index] = value / MEGABIT
+
+        loads = dict((link, tuple(load)) for link, load in loads.iteritems())
+        return loads, complete
+
+    def _fetch_cpu_loads(self, sysnames):
+        """Fetches the CPU loads of a list of sysnames.
+
+        Question is, of _which_ CPU? Let's just get the one that has the
+        highest maximum value.
+
+        :returns: A dict of {sysname: load}, and whether all requests
+                  succeeded.
+
+        """
+        loads = {}
+        complete = True
+        for make_path in (
+            lambda sysname: metric_path_for_cpu_load(sysname, '*',
+                                                     interval=5),
+            lambda sysname: metric_path_for_cpu_utilization(sysname, '*'),
+        ):
+            missing = [sysname for sysname in sysnames
+                       if sysname not in loads]
+            prefixes = dict((metric_prefix_for_cpu(sysname), sysname)
+                            for sysname in missing)
+            paths = sorted(make_path(sysname) for sysname in missing)
+            for targets in _chunks(paths, MAX_TARGETS_PER_REQUEST):
+                try:
+                    data = get_metric_data(targets,
+                                           start=self.time_interval['start'],
+                                           end=self.time_interval['end'])
+                except Exception:
+                    _logger.exception("failed to fetch cpu loads for %d "
+                                      "netboxes", len(targets))
+                    complete = False
+                    continue
+                loads.update(_get_highest_max_averages(data, prefixes))
+
+        result = dict((sysname, loads.get(sysname, NAN))
+                      for sysname in sysnames)
+        _logger.debug("fetched cpu loads: %r", result)
+        return result, complete
+
+
+def _get_highest_max_averages(data, prefixes):
+    """Picks the CPU series with the highest maximum value of each netbox
+    from a Graphite response, like the highestMax function would.
+
+    :param prefixes: A dict mapping metric_prefix_for_cpu() of each netbox
+                     to its sysname.
+    :returns: A dict of {sysname: average value of the picked series}.
 
     """
-    data = None
-    for path in (
-        metric_path_for_cpu_load(sysname, '*', interval=5),
-        metric_path_for_cpu_utilization(sysname, '*')
-    ):
-        target = 'highestMax(%s,1)' % path
-        try:
-            data = get_metric_average(target,
-                                      start=time_interval['start'],
-                                      end=time_interval['end'],
-                                      ignore_unknown=True)
-            if data:
-                break
-        except Exception:
-            data = None
-
-    result = data.values()[0] if data else float('nan')
-    _logger.debug("get_cpu_load(%r, %r) == %r", sysname, time_interval, result)
-    return result
+    best = {}
+    for series in data:
+        values = [value for value, _timestamp in series['datapoints']
+                  if value is not None]
+        sysname = prefixes.get(series['target'].rsplit('.', 2)[0])
+        if not (values and sysname):
+            continue
+        maximum = max(values)
+        if sysname not in best or maximum > best[sysname][0]:
+            best[sysname] = (maximum, float(sum(values)) / len(values))
+    return dict((sysname, average)
+                for sysname, (_maximum, average) in best.iteritems())
+
+
+def _chunks(items, size):
+    """Splits a list into lists of at most size items"""
+    return [items[index:index + size] for index in xrange(0, len(items), size)]
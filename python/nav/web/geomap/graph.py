@@ -19,7 +19,10 @@
 
 import logging
 
-from math import sqrt
+from collections import defaultdict
+from itertools import product
+from math import floor, sqrt
+from operator import itemgetter
 from nav.web.geomap.utils import (map_dict, nansafe_max, identity, first,
                                   group, avg, filter_dict, subdict,
                                   map_dict_lazy)
@@ -212,22 +215,69 @@ def create_places(graph, bounds, viewport_size, limit):
         return sqrt(square((node1.lon - node2.lon) * lon_scale) +
                     square((node1.lat - node2.lat) * lat_scale))
 
-    places = []
-    for node in graph.nodes.values():
-        for place in places:
-            if distance(node, place['position']) < limit:
-                place['rooms'].append(node)
-                place['position'].lon = avg([n.lon for n in place['rooms']])
-                place['position'].lat = avg([n.lat for n in place['rooms']])
-                break
-        else:
-            places.append({'position': Node(None, node.lon, node.lat, None),
-                           'rooms': [node]})
+    if limit <= 0:
+        places = [{'rooms': [node]} for node in graph.nodes.values()]
+    else:
+        places = _cluster_places(graph.nodes.values(), distance,
+                                 lon_scale, lat_scale, limit)
     collapse_nodes(graph,
                    [place['rooms'] for place in places],
                    AGGREGATE_PROPERTIES_PLACE)
 
 
+def _cluster_places(nodes, distance, lon_scale, lat_scale, limit):
+    """Cluster nodes into places for create_places.
+
+    Each node is added to the first created place whose position is closer
+    than limit to it, or else becomes a new place.  Places are kept in a
+    grid of cells that are limit pixels wide, so that only places in the
+    node's own cell and its eight neighbouring cells need to be compared
+    with it.  The position of a place is maintained from running sums of
+    the positions of its rooms.
+
+    Returns a list of places, each a dictionary with the list of its rooms
+    as 'rooms'.
+
+    """
+    def cell(position):
+        """Return the grid cell containing a position"""
+        return (int(floor(position.lon * lon_scale / limit)),
+                int(floor(position.lat * lat_scale / limit)))
+
+    grid = defaultdict(list)
+    places = []
+    for node in nodes:
+        column, row = cell(node)
+        near = [place
+                for neighbour in product((column - 1, column, column + 1),
+                                         (row - 1, row, row + 1))
+                for place in grid.get(neighbour, ())
+                if distance(node, place['position']) < limit]
+        if near:
+            place = min(near, key=itemgetter('index'))
+            place['rooms'].append(node)
+            place['lon_sum'] += node.lon
+            place['lat_sum'] += node.lat
+            count = float(len(place['rooms']))
+            place['position'].lon = place['lon_sum'] / count
+            place['position'].lat = place['lat_sum'] / count
+            new_cell = cell(place['position'])
+            if new_cell != place['cell']:
+                grid[place['cell']].remove(place)
+                grid[new_cell].append(place)
+                place['cell'] = new_cell
+        else:
+            place = {'index': len(places),
+                     'position': Node(None, node.lon, node.lat, None),
+                     'rooms': [node],
+                     'lon_sum': node.lon,
+                     'lat_sum': node.lat,
+                     'cell': (column, row)}
+            grid[place['cell']].append(place)
+            places.append(place)
+    return places
+
+
 def collapse_nodes(graph, node_sets, property_aggregators):
     """Collapse sets of nodes to single nodes.
 
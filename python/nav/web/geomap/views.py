@@ -33,8 +33,9 @@ import nav.db
 from nav.django.utils import get_account
 
 from nav.web.geomap.conf import get_configuration
-from nav.web.geomap.db import get_data
+from nav.web.geomap.db import get_data, MetricLoader
 from nav.web.geomap.graph import build_graph
+from nav.web.geomap.graph import area_filter
 from nav.web.geomap.graph import simplify
 from nav.web.geomap.features import create_features
 from nav.web.geomap.output_formats import format_data
@@ -189,9 +190,16 @@ def get_formatted_data(variant, db, format_, bounds, viewport_size, limit,
 
     """
     logger.debug('get_data')
-    data = get_data(db, bounds, time_interval)
+    metrics = MetricLoader(time_interval)
+    data = get_data(db, bounds, time_interval, metrics)
     logger.debug('build_graph')
     graph = build_graph(data)
+    # Filtering is repeated by simplify, but doing it here first means that
+    # only metrics for the objects that remain on the map are fetched.
+    logger.debug('area_filter')
+    area_filter(graph, bounds)
+    logger.debug('load metrics')
+    metrics.load_graph(graph)
     logger.debug('simplify')
     simplify(graph, bounds, viewport_size, limit)
     logger.debug('create_features')
@@ -0,0 +1,285 @@
+#
+# Copyright (C) 2014 UNINETT
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A caching, request coalescing proxy for graphite-web.
+
+Render responses are cached using Django's cache framework, keyed on the
+normalized request parameters, for a time that depends on the time window
+that was requested.  Identical requests that arrive while a render is in
+progress wait for and share its result, and connections to graphite-web are
+kept alive and reused by each thread.  Large responses are streamed to the
+client instead of being cached.
+
+"""
+from collections import namedtuple
+import hashlib
+import httplib
+import logging
+import re
+import socket
+import threading
+import time
+from urllib import urlencode
+from urlparse import urljoin, urlparse
+
+from django.core.cache import cache
+
+_logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'nav.graphite.'
+DEFAULT_TIMEOUT = 60
+
+# Cache times, in seconds
+MIN_TTL = 10
+MAX_TTL = 300
+DEFAULT_TTL = 60
+HISTORIC_TTL = 3600
+
+MAX_CACHED_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# Cache busting parameters added by browsers/javascript libraries
+IGNORED_PARAMETERS = ('_', '_salt')
+
+RELATIVE_TIME = re.compile(r'^-(?P<count>\d+)(?P<unit>[a-z]+)$')
+UNITS = (
+    ('s', 1),
+    ('min', 60),
+    ('h', 3600),
+    ('d', 86400),
+    ('w', 7 * 86400),
+    ('mon', 30 * 86400),
+    ('y', 365 * 86400),
+)
+
+# pylint: disable=C0103
+ProxyResponse = namedtuple("ProxyResponse", "status content_type body chunks")
+
+
+def normalize_query(query):
+    """Normalizes a list of request parameters.
+
+    :param query: A list of (name, value) pairs.
+    :returns: A sorted list of (name, value) pairs, with cache busting
+              parameters removed.
+
+    """
+    return sorted((name, value) for name, value in query
+                  if name not in IGNORED_PARAMETERS)
+
+
+def get_cache_key(uri, params):
+    """Returns a cache key for a request for uri with normalized params"""
+    digest = hashlib.sha1(uri.strip('/') + '?' + urlencode(params))
+    return CACHE_PREFIX + digest.hexdigest()
+
+
+def get_ttl(params, now=None):
+    """Returns the number of seconds the response to a render request with
+    the given normalized parameters can be cached.
+
+    Responses for windows that end now are cached for a fraction of the
+    window length, between MIN_TTL and MAX_TTL.  Windows that end in the past
+    will not change much, and are cached for HISTORIC_TTL.  If the window
+    can't be parsed, DEFAULT_TTL is used.
+
+    """
+    now = now or time.time()
+    params = dict(params)
+    start = parse_time(params.get('from', '-1d'), now)
+    end = parse_time(params.get('until', 'now'), now)
+    if start is None or end is None:
+        return DEFAULT_TTL
+    if end < now - MAX_TTL:
+        return HISTORIC_TTL
+    window = max(end - start, 0)
+    return int(min(max(window / 100, MIN_TTL), MAX_TTL))
+
+
+def parse_time(value, now):
+    """Parses a subset of Graphite's time specifications into a timestamp.
+
+    :returns: A UNIX timestamp, or None if value could not be parsed.
+
+    """
+    value = value.strip().lower()
+    if value in ('', 'now'):
+        return now
+    if value.isdigit():
+        return int(value)
+    match = RELATIVE_TIME.match(value)
+    if match:
+        unit = match.group('unit')
+        for prefix, seconds in reversed(UNITS):
+            if unit.startswith(prefix):
+                return now - int(match.group('count')) * seconds
+
+
+class GraphiteProxy(object):
+    """Proxies requests to a graphite-web instance.
+
+    :param base: The base URL of graphite-web.
+    :param timeout: Socket timeout for requests to graphite-web.
+
+    """
+    def __init__(self, base, timeout=DEFAULT_TIMEOUT):
+        self.base = base
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def request(self, method, uri, query):
+        """Proxies a request to graphite-web.
+
+        :param method: The HTTP method, GET or POST.
+        :param uri: The URI to request, relative to graphite-web's base URL.
+        :param query: A list of (name, value) request parameters.
+        :returns: A ProxyResponse. Either its body is a string, or the
+                  response is streamed, and its chunks attribute is an
+                  iterator over the body.
+
+        """
+        params = normalize_query(query)
+        cacheable = uri.lstrip('/').startswith('render')
+        key = get_cache_key(uri, params)
+
+        if cacheable:
+            cached = cache.get(key)
+            if cached is not None:
+                _logger.debug("cache hit for %s", uri)
+                content_type, body = cached
+                return ProxyResponse(httplib.OK, content_type, body, None)
+
+        response = self._coalesce(key, method, uri, params)
+        if (cacheable and response.status == httplib.OK
+                and response.body is not None):
+            cache.set(key, (response.content_type, response.body),
+                      get_ttl(params))
+        return response
+
+    def _coalesce(self, key, method, uri, params):
+        """Runs a request, unless an identical request is already in flight,
+        in which case its result is awaited and shared.
+
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+
+        if not leader:
+            call.done.wait(self.timeout)
+            result = call.result
+            if result is not None and result.body is not None:
+                _logger.debug("shared in-flight response for %s", uri)
+                return result
+            # streamed responses can't be shared
+            return self._fetch(method, uri, params)
+
+        try:
+            call.result = self._fetch(method, uri, params)
+            return call.result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def _fetch(self, method, uri, params):
+        url = urlparse(urljoin(self.base, uri))
+        path = url.path or '/'
+        data = urlencode(params)
+        headers = {}
+        if method == 'POST':
+            body = data
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        else:
+            body = None
+            if data:
+                path += '?' + data
+
+        _logger.debug("proxying %s request to %s", method, path)
+        response = self._send(url, method, path, body, headers)
+        content_type = response.getheader('Content-Type', 'text/html')
+        length = response.getheader('Content-Length')
+        if length is not None and int(length) <= MAX_CACHED_SIZE:
+            body = response.read()
+            return ProxyResponse(response.status, content_type, body, None)
+
+        # The connection is busy until the whole body has been streamed, and
+        # is closed afterwards
+        conn = self._local.connection
+        self._local.connection = None
+        chunks = _stream(response, conn)
+        return ProxyResponse(response.status, content_type, None, chunks)
+
+    def _send(self, url, method, path, body, headers):
+        """Sends a request over this thread's connection to graphite-web,
+        reconnecting once if a kept-alive connection has been closed.
+
+        """
+        reused = self._get_connection(url) is not None
+        for attempt in (1, 2):
+            conn = self._get_connection(url) or self._connect(url)
+            try:
+                conn.request(method, path, body, headers)
+                return conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                self._local.connection = None
+                if attempt > 1 or not reused:
+                    raise
+                _logger.debug("kept-alive connection to graphite-web was "
+                              "closed, reconnecting")
+
+    def _get_connection(self, url):
+        conn = getattr(self._local, 'connection', None)
+        if conn is not None and (conn.host, conn.port) != _host_port(url):
+            conn.close()
+            conn = self._local.connection = None
+        return conn
+
+    def _connect(self, url):
+        factory = (httplib.HTTPSConnection if url.scheme == 'https'
+                   else httplib.HTTPConnection)
+        host, port = _host_port(url)
+        conn = factory(host, port, timeout=self.timeout)
+        self._local.connection = conn
+        return conn
+
+
+class _Call(object):
+    """An in-flight request"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def _host_port(url):
+    if url.scheme == 'https':
+        return url.hostname, url.port or httplib.HTTPS_PORT
+    return url.hostname, url.port or httplib.HTTP_PORT
+
+
+def _stream(response, conn):
+    try:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        conn.close()
@@ -13,15 +13,17 @@
 # details.  You should have received a copy of the GNU General Public License
 # along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
-import urllib2
-from urlparse import urljoin
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.encoding import smart_str
 from nav.metrics import CONFIG
+from nav.web.graphite.proxy import GraphiteProxy
 
 import logging
 LOGGER = logging.getLogger(__name__)
 
+_proxy = None
+
 
 def index(request, uri):
     """
@@ -32,30 +34,35 @@ def index(request, uri):
         response['X-Where-Am-I'] = request.get_full_path()
         return response
 
-    base = CONFIG.get('graphiteweb', 'base')
-
     if request.method == 'GET':
         query = _inject_default_arguments(request.GET)
-        url = urljoin(base, uri + ('?' + query) if query else '')
-        req = urllib2.Request(url)
     elif request.method == 'POST':
-        data = _inject_default_arguments(request.POST)
-        url = urljoin(base, uri)
-        req = urllib2.Request(url, data)
+        query = _inject_default_arguments(request.POST)
     else:
         return HttpResponseNotAllowed(['GET', 'POST', 'HEAD'])
 
-    LOGGER.debug("proxying request to %r", url)
-    response = urllib2.urlopen(req)
-    headers = response.info()
-    content_type = headers.getheader('Content-Type', 'text/html')
-    return HttpResponse(response.read(), content_type=content_type)
+    result = get_proxy().request(request.method, uri, query)
+    content = result.body if result.body is not None else result.chunks
+    return HttpResponse(content, content_type=result.content_type,
+                        status=result.status)
+
+
+def get_proxy():
+    """Returns the GraphiteProxy for the graphite-web configured in
+    graphite.conf
+    """
+    global _proxy
+    if _proxy is None:
+        _proxy = GraphiteProxy(CONFIG.get('graphiteweb', 'base'))
+    return _proxy
 
 
 def _inject_default_arguments(query):
     """
     Injects default arguments to a render request, unless they are already
     explicitly supplied by the client.
+
+    :returns: A list of (name, value) parameters.
     """
     format_ = CONFIG.get('graphiteweb', 'format')
     query = query.copy()
@@ -65,4 +72,5 @@ def _inject_default_arguments(query):
     if not 'tz' in query and settings.TIME_ZONE:
         query['tz'] = settings.TIME_ZONE
 
-    return query.urlencode()
+    return [(smart_str(key), smart_str(value))
+            for key in query for value in query.getlist(key)]
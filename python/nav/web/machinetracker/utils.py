@@ -16,39 +16,73 @@
 """Common utility functions for Machine Tracker"""
 
 from datetime import datetime
-from socket import gethostbyaddr, herror
 from IPy import IP
 
 from nav import asyncdns
 from nav.models.manage import Prefix
 from nav.ipdevpoll.db import commit_on_success
+from nav.util import TimedLRUCache
 
 from django.utils.datastructures import SortedDict
 from django.db import DatabaseError
 
-_cached_hostname = {}
+# Resolved names are cached for all requests, failed lookups for a shorter
+# time.  Lookups that take longer than the time budget of a request are left
+# unresolved, and are not cached.
+DNS_CACHE_SIZE = 10000
+DNS_CACHE_TTL = 3600
+DNS_NEGATIVE_TTL = 300
+DNS_TIME_BUDGET = 10
+
+_dns_cache = TimedLRUCache(max_size=DNS_CACHE_SIZE, ttl=DNS_CACHE_TTL)
 
 
 def hostname(ip):
     """
-    Performs a DNS reverse lookup for an IP address and caches the result in
-    a global variable, which is really, really stupid.
+    Performs a DNS reverse lookup for an IP address, using the shared DNS
+    cache.
 
     :param ip: And IP address string.
     :returns: A hostname string or a False value if the lookup failed.
 
     """
-    addr = unicode(ip)
-    if addr in _cached_hostname:
-        return _cached_hostname[addr]
+    return reverse_lookup([ip])[unicode(ip)] or False
 
-    try:
-        dns = gethostbyaddr(addr)
-    except herror:
-        return False
 
-    _cached_hostname[addr] = dns[0]
-    return dns[0]
+def reverse_lookup(addresses, timeout=DNS_TIME_BUDGET):
+    """Resolves the names of many IP addresses concurrently, using the shared
+    DNS cache.
+
+    :param addresses: A list of IP address strings or IP objects.
+    :param timeout: The maximum number of seconds to spend waiting for
+                    lookups.
+    :returns: A dict mapping each address string to a hostname, or to an
+              empty string if there was no name or the lookup failed or took
+              too long.
+
+    """
+    names = {}
+    missing = []
+    for addr in set(unicode(addr) for addr in addresses):
+        found, name = _dns_cache.get(addr)
+        if found:
+            names[addr] = name
+        else:
+            missing.append(addr)
+
+    if missing:
+        lookups = asyncdns.reverse_lookup(missing, timeout=timeout)
+        for addr in missing:
+            result = lookups.get(addr)
+            if isinstance(result, asyncdns.DNSQueryTimeoutError):
+                names[addr] = ""
+            elif isinstance(result, Exception) or not result:
+                names[addr] = ""
+                _dns_cache.put(addr, "", ttl=DNS_NEGATIVE_TTL)
+            else:
+                names[addr] = result[0]
+                _dns_cache.put(addr, result[0])
+    return names
 
 
 @commit_on_success
@@ -152,19 +186,14 @@ def track_mac(keys, resultset, dns):
         dns         - should we lookup the hostname?
     """
     if dns:
-        ips_to_lookup = [row.ip for row in resultset]
-        dns_lookups = asyncdns.reverse_lookup(ips_to_lookup)
+        dns_lookups = reverse_lookup([row.ip for row in resultset])
 
     tracker = SortedDict()
     for row in resultset:
         if row.end_time > datetime.now():
             row.still_active = "Still active"
         if dns:
-            ip = row.ip
-            if dns_lookups[ip] and not isinstance(dns_lookups[ip], Exception):
-                row.dns_lookup = dns_lookups[ip].pop()
-            else:
-                row.dns_lookup = ""
+            row.dns_lookup = dns_lookups[unicode(row.ip)]
         if not hasattr(row, 'module'):
             row.module = ''
         if not hasattr(row, 'port'):
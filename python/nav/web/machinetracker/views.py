@@ -25,11 +25,10 @@ from django.utils.datastructures import SortedDict
 
 from nav.models.manage import Arp, Cam, Netbios
 
-from nav import asyncdns
-
 from nav.web.machinetracker import forms
 from nav.web.machinetracker.utils import ip_dict
-from nav.web.machinetracker.utils import process_ip_row, track_mac
+from nav.web.machinetracker.utils import (process_ip_row, track_mac,
+                                          reverse_lookup)
 from nav.web.machinetracker.utils import (min_max_mac, ProcessInput,
                                           normalize_ip_to_string,
                                           get_last_job_log_from_netboxes)
@@ -164,8 +163,7 @@ def create_tracker(active, dns, inactive, ip_range, ip_result):
     """Creates a result tracker based on form data"""
     dns_lookups = None
     if dns:
-        ips_to_lookup = [str(ip) for ip in ip_range]
-        dns_lookups = asyncdns.reverse_lookup(ips_to_lookup)
+        dns_lookups = reverse_lookup(ip_range)
 
     tracker = SortedDict()
     for ip_key in ip_range:
@@ -183,11 +181,7 @@ def create_active_row(tracker, dns, dns_lookups, ip_key, ip_result):
     for row in rows:
         row = process_ip_row(row, dns=False)
         if dns:
-            if (isinstance(dns_lookups[ip], Exception)
-                    or not dns_lookups[ip]):
-                row.dns_lookup = ""
-            else:
-                row.dns_lookup = dns_lookups[ip][0]
+            row.dns_lookup = dns_lookups[ip]
         row.ip_int_value = normalize_ip_to_string(row.ip)
         if (row.ip, row.mac) not in tracker:
             tracker[(row.ip, row.mac)] = []
@@ -199,11 +193,7 @@ def create_inactive_row(tracker, dns, dns_lookups, ip_key):
     ip = unicode(ip_key)
     row = {'ip': ip, 'ip_int_value': normalize_ip_to_string(ip)}
     if dns:
-        if (dns_lookups[ip] and not
-                isinstance(dns_lookups[ip], Exception)):
-            row['dns_lookup'] = dns_lookups[ip][0]
-        else:
-            row['dns_lookup'] = ""
+        row['dns_lookup'] = dns_lookups[ip]
     tracker[(ip, "")] = [row]
 
 
@@ -14,8 +14,10 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """Netmap view functions for Django"""
+from collections import defaultdict
 import datetime
 import logging
+import operator
 import os
 from django.conf import settings
 from django.core import serializers
@@ -27,15 +29,18 @@ from django.shortcuts import get_object_or_404, render_to_response
 
 from django.template import RequestContext
 from django.http import (HttpResponse, HttpResponseForbidden,
-                         HttpResponseBadRequest, HttpResponseRedirect)
+                         HttpResponseBadRequest, HttpResponseRedirect,
+                         HttpResponseNotModified)
 from django.utils import simplejson
 
 import nav.buildconf
 from nav.django.utils import get_account, get_request_body
-from nav.models.manage import Netbox, Category
+from nav.models.manage import Netbox, Category, Interface
 from nav.models.profiles import (NetmapView, NetmapViewNodePosition,
                                  NetmapViewCategories, NetmapViewDefaultView,
                                  Account)
+from nav.netmap.cache import get_topology, make_etag
+from nav.netmap.filters import filter_topology, find_node, ELINK_CATEGORY
 from nav.netmap.metadata import (node_to_json_layer2, edge_to_json_layer2,
                                  node_to_json_layer3, edge_to_json_layer3,
                                  vlan_to_json, get_vlan_lookup_json)
@@ -43,8 +48,10 @@ from nav.netmap.metadata import (node_to_json_layer2, edge_to_json_layer2,
 from nav.netmap.topology import (build_netmap_layer3_graph,
                                  build_netmap_layer2_graph,
                                  _get_vlans_map_layer2, _get_vlans_map_layer3)
+from nav.netmap.traffic import get_traffic_data
 from nav.topology import vlan
-from nav.web.netmap.common import layer2_graph, get_traffic_rgb
+from nav.web.netmap.common import (layer2_graph, get_traffic_rgb,
+                                   get_status_image_link)
 from nav.web.netmap.forms import NetmapDefaultViewForm
 
 _LOGGER = logging.getLogger('nav.web.netmap')
@@ -476,31 +483,7 @@ def api_graph_layer_3(request, map_id=None):
     Layer2 network topology representation in d3js force-direct graph layout
     http://mbostock.github.com/d3/ex/force.html
     """
-    load_traffic = 'traffic' in request.GET
-
-    if map_id:
-        view = get_object_or_404(NetmapView, pk=map_id)
-        session_user = get_account(request)
-
-        if view.is_public or (session_user == view.owner):
-            json = _json_layer3(load_traffic, view)
-            response = HttpResponse(simplejson.dumps(json))
-            response['Content-Type'] = 'application/json; charset=utf-8'
-            response['Cache-Control'] = 'no-cache'
-            response['Pragma'] = 'no-cache'
-            response['Expires'] = "Thu, 01 Jan 1970 00:00:00 GMT"
-            response['x-nav-viewid'] = map_id
-            return response
-        else:
-            return HttpResponseForbidden()
-
-    json = _json_layer3(load_traffic)
-    response = HttpResponse(simplejson.dumps(json))
-    response['Content-Type'] = 'application/json; charset=utf-8'
-    response['Cache-Control'] = 'no-cache'
-    response['Pragma'] = 'no-cache'
-    response['Expires'] = "Thu, 01 Jan 1970 00:00:00 GMT"
-    return response
+    return _graph_response(request, 3, map_id)
 
 
 def api_graph_layer_2(request, map_id=None):
@@ -508,34 +491,130 @@ def api_graph_layer_2(request, map_id=None):
     Layer2 network topology representation in d3js force-direct graph layout
     http://mbostock.github.com/d3/ex/force.html
     """
-    load_traffic = 'traffic' in request.GET
+    return _graph_response(request, 2, map_id)
 
+
+def _graph_response(request, layer, map_id=None):
+    """Responds with the cached base topology of a layer, overlaid with the
+    node positions of a view, the current netbox status and, if requested,
+    traffic load.
+
+    The topology can be pruned by these query parameters:
+
+    * categories: comma separated category ids of the nodes to include,
+      where ELINK includes elink nodes.
+    * viewfilter: include only the categories saved in the view, unless
+      categories is given.
+    * locations: comma separated location ids of the nodes to include.
+    * focus: the id or sysname of a node, to include only the nodes within
+      depth hops of it.
+    * depth: the number of hops around the focus node to include, 1 by
+      default.
+
+    Responses without traffic carry an ETag, so that clients can skip
+    unchanged payloads using conditional requests.
+
+    """
+    load_traffic = 'traffic' in request.GET
+    view = None
     if map_id:
         view = get_object_or_404(NetmapView, pk=map_id)
         session_user = get_account(request)
+        if not (view.is_public or (session_user == view.owner)):
+            return HttpResponseForbidden()
 
-        if view.is_public or (session_user == view.owner):
-            json = _json_layer2(load_traffic, view)
-            response = HttpResponse(simplejson.dumps(json))
-            response['Content-Type'] = 'application/json; charset=utf-8'
-            response['Cache-Control'] = 'no-cache'
-            response['Pragma'] = 'no-cache'
-            response['Expires'] = "Thu, 01 Jan 1970 00:00:00 GMT"
-            response['x-nav-viewid'] = map_id
+    try:
+        graph_filter = _get_graph_filter(request, view)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+
+    topology = get_topology(layer, _TOPOLOGY_BUILDERS[layer])
+    positions = _get_node_positions(view)
+    status = _get_netbox_status()
+
+    etag = None
+    if not load_traffic:
+        etag = make_etag(topology['digest'], layer, map_id, positions,
+                         sorted(status.items()), sorted(graph_filter.items()))
+        if _etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
             return response
-        else:
-            return HttpResponseForbidden()
 
-    json = _json_layer2(load_traffic)
+    if graph_filter:
+        focus = graph_filter.get('focus')
+        if focus is not None:
+            graph_filter['focus'] = find_node(topology['json']['nodes'], focus)
+            if graph_filter['focus'] is None:
+                return HttpResponseBadRequest("Unknown focus node")
+        topology = filter_topology(topology, **graph_filter)
+    json = topology['json']
+    _overlay_node_positions(json['nodes'], positions)
+    _overlay_netbox_status(json['nodes'], status)
+    if load_traffic:
+        _overlay_traffic(json['links'], topology['port_pairs'])
+
     response = HttpResponse(simplejson.dumps(json))
     response['Content-Type'] = 'application/json; charset=utf-8'
     response['Cache-Control'] = 'no-cache'
     response['Pragma'] = 'no-cache'
     response['Expires'] = "Thu, 01 Jan 1970 00:00:00 GMT"
+    if etag:
+        response['ETag'] = etag
+    if map_id:
+        response['x-nav-viewid'] = map_id
     return response
 
 
-def _json_layer2(load_traffic=False, view=None):
+def _get_graph_filter(request, view=None):
+    """Returns the keyword arguments to filter_topology() given by the query
+    parameters of request.
+
+    :raises ValueError: if a parameter value is invalid.
+
+    """
+    graph_filter = {}
+    params = request.GET
+    if params.get('categories'):
+        graph_filter['categories'] = _split_param(params['categories'])
+    elif 'viewfilter' in params and view:
+        categories = set(view.categories_set.values_list('category',
+                                                          flat=True))
+        if view.display_elinks:
+            categories.add(ELINK_CATEGORY)
+        graph_filter['categories'] = tuple(sorted(categories))
+    if params.get('locations'):
+        graph_filter['locations'] = _split_param(params['locations'])
+    if params.get('focus'):
+        graph_filter['focus'] = params['focus']
+        try:
+            graph_filter['depth'] = int(params.get('depth', 1))
+        except ValueError:
+            raise ValueError("depth must be an integer")
+        if graph_filter['depth'] < 0:
+            raise ValueError("depth must not be negative")
+    return graph_filter
+
+
+def _split_param(value):
+    return tuple(sorted(set(item.strip() for item in value.split(',')
+                            if item.strip())))
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def _build_layer2():
+    """Builds the JSON-ready base layer 2 topology, without view or traffic
+    data.
+
+    :returns: A dict with the topology JSON, and the port pairs to load
+              traffic for, as a list of tuples of a path to an edge in the
+              links list and the interface ids at either end.
+
+    """
     _LOGGER.debug("build_netmap_layer2_graph() start")
     topology_without_metadata = vlan.build_layer2_graph(
         (
@@ -549,18 +628,34 @@ def _json_layer2(load_traffic=False, view=None):
     _LOGGER.debug("build_netmap_layer2_graph() vlan mappings done")
 
     graph = build_netmap_layer2_graph(topology_without_metadata,
-                                      vlan_by_interface, vlan_by_netbox,
-                                      load_traffic, view)
+                                      vlan_by_interface, vlan_by_netbox)
+
+    links = []
+    port_pairs = []
+    for node_a, node_b, nx_metadata in graph.edges_iter(data=True):
+        # metadata was appended while iterating the same set of port pairs
+        for index, pair in enumerate(nx_metadata['port_pairs']):
+            port_pairs.append(((len(links), 'edges', index),
+                               _get_interface_ids(pair)))
+        links.append(edge_to_json_layer2((node_a, node_b), nx_metadata))
 
     return {
-        'vlans': get_vlan_lookup_json(vlan_by_interface),
-        'nodes': _get_nodes(node_to_json_layer2, graph),
-        'links': [edge_to_json_layer2((node_a, node_b), nx_metadata) for
-                  node_a, node_b, nx_metadata in graph.edges_iter(data=True)]
+        'json': {
+            'vlans': get_vlan_lookup_json(vlan_by_interface),
+            'nodes': _get_nodes(node_to_json_layer2, graph),
+            'links': links,
+        },
+        'port_pairs': port_pairs,
     }
 
 
-def _json_layer3(load_traffic=False, view=None):
+def _build_layer3():
+    """Builds the JSON-ready base layer 3 topology, without view or traffic
+    data.
+
+    :returns: A dict like the one returned by _build_layer2()
+
+    """
     _LOGGER.debug("build_netmap_layer3_graph() start")
     topology_without_metadata = vlan.build_layer3_graph(
         ('prefix__vlan__net_type', 'gwportprefix__prefix__vlan__net_type',))
@@ -569,15 +664,89 @@ def _json_layer3(load_traffic=False, view=None):
     vlans_map = _get_vlans_map_layer3(topology_without_metadata)
     _LOGGER.debug("build_netmap_layer2_graph() vlan mappings done")
 
-    graph = build_netmap_layer3_graph(topology_without_metadata, load_traffic,
-                                      view)
+    graph = build_netmap_layer3_graph(topology_without_metadata)
+
+    links = []
+    port_pairs = []
+    for node_a, node_b, nx_metadata in graph.edges_iter(data=True):
+        # metadata was appended per vlan while iterating the same set of
+        # gwportprefix pairs
+        counts = defaultdict(int)
+        for gwpp_a, gwpp_b in nx_metadata['gwportprefix_pairs']:
+            vlan_id = gwpp_a.prefix.vlan.id
+            port_pairs.append(
+                ((len(links), 'edges', vlan_id, counts[vlan_id]),
+                 _get_interface_ids((gwpp_a.interface, gwpp_b.interface))))
+            counts[vlan_id] += 1
+        links.append(edge_to_json_layer3((node_a, node_b), nx_metadata))
+
     return {
-        'vlans': [vlan_to_json(prefix.vlan) for prefix in vlans_map],
-        'nodes': _get_nodes(node_to_json_layer3, graph),
-        'links': [edge_to_json_layer3((node_a, node_b), nx_metadata) for
-                  node_a, node_b, nx_metadata in graph.edges_iter(data=True)]
+        'json': {
+            'vlans': [vlan_to_json(prefix.vlan) for prefix in vlans_map],
+            'nodes': _get_nodes(node_to_json_layer3, graph),
+            'links': links,
+        },
+        'port_pairs': port_pairs,
     }
 
+_TOPOLOGY_BUILDERS = {
+    2: _build_layer2,
+    3: _build_layer3,
+}
+
+
+def _get_interface_ids(port_pair):
+    return tuple(ifc.id if isinstance(ifc, Interface) else None
+                 for ifc in port_pair)
+
+
+def _get_node_positions(view):
+    """Returns a sorted list of (netbox id, x, y) tuples for the nodes
+    positioned in view.
+
+    """
+    if not view:
+        return []
+    return sorted(view.node_position_set.values_list('netbox', 'x', 'y'))
+
+
+def _get_netbox_status():
+    """Returns a dict of the up status of every netbox that isn't up"""
+    return dict(Netbox.objects.exclude(up=Netbox.UP_UP).values_list(
+        'id', 'up'))
+
+
+def _overlay_node_positions(nodes, positions):
+    for netbox_id, x, y in positions:
+        node = nodes.get(unicode(netbox_id))
+        if node and not node['is_elink_node']:
+            node['position'] = {'x': x, 'y': y}
+
+
+def _overlay_netbox_status(nodes, status):
+    for node_id, node in nodes.iteritems():
+        if not node['is_elink_node']:
+            up = status.get(int(node_id), Netbox.UP_UP)
+            node['up'] = str(up)
+            node['up_image'] = get_status_image_link(up)
+
+
+def _overlay_traffic(links, port_pairs):
+    """Replaces the empty traffic data of the edges in links with the current
+    traffic load of their port pairs.
+
+    """
+    interface_ids = set(ifc_id for _, pair in port_pairs for ifc_id in pair
+                        if ifc_id is not None)
+    interfaces = Interface.objects.select_related('netbox').in_bulk(
+        interface_ids)
+    for path, (id_a, id_b) in port_pairs:
+        edge = reduce(operator.getitem, path, links)
+        traffic = get_traffic_data((interfaces.get(id_a),
+                                    interfaces.get(id_b)))
+        edge['traffic'] = traffic.to_json()
+
+
 def _get_nodes(node_to_json_function, graph):
     nodes = {}
     for node, nx_metadata in graph.nodes_iter(data=True):
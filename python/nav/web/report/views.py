@@ -19,11 +19,16 @@
 
 from IPy import IP
 
+from collections import OrderedDict
 from operator import itemgetter
 from time import localtime, strftime
+from cStringIO import StringIO
 import csv
+import json
+import logging
 import os
 import re
+import psycopg2
 from nav.django.utils import get_account
 
 # this is just here to make sure Django finds NAV's settings file
@@ -35,10 +40,12 @@ from django.http import HttpResponse, Http404, HttpResponseRedirect
 from django.db import connection
 
 from nav.report.IPtree import getMaxLeaf, buildTree
+from nav.report.dbresult import StreamedResult
 from nav.report.generator import Generator, ReportList
 from nav.report.matrixIPv4 import MatrixIPv4
 from nav.report.matrixIPv6 import MatrixIPv6
 from nav.report.metaIP import MetaIP
+from nav.report.report import ExportFormatter
 import nav.path
 
 
@@ -47,6 +54,11 @@ CONFIG_FILE_LOCAL = os.path.join(nav.path.sysconfdir,
                                  "report/report.local.conf")
 FRONT_FILE = os.path.join(nav.path.sysconfdir, "report/front.html")
 
+# Number of rows written to an export response at a time
+EXPORT_BATCH_SIZE = 1000
+
+_logger = logging.getLogger(__name__)
+
 
 def index(request):
     """Report front page"""
@@ -74,6 +86,11 @@ def get_report(request, report_name):
         return HttpResponseRedirect(
             "{0}?{1}".format(request.META['PATH_INFO'], query.urlencode()))
 
+    if export_delimiter or 'exportjson' in query:
+        response = stream_export(report_name, query, export_delimiter)
+        if response:
+            return response
+
     return make_report(request, report_name, export_delimiter, query)
 
 
@@ -238,6 +255,8 @@ def make_report(request, report_name, export_delimiter, query_dict):
         del query_dict_no_meta['export']
     if 'exportcsv' in query_dict_no_meta:
         del query_dict_no_meta['exportcsv']
+    if 'exportjson' in query_dict_no_meta:
+        del query_dict_no_meta['exportjson']
 
     helper_remove = dict((key, query_dict_no_meta[key])
                          for key in query_dict_no_meta)
@@ -388,6 +407,86 @@ def generate_export(_request, report, report_name, export_delimiter):
     return response
 
 
+def stream_export(report_name, query, export_delimiter=None):
+    """Streams the entire result of a report as CSV, or as JSON if no CSV
+    delimiter is given.
+
+    Rows are read from a server side cursor and written to the response in
+    batches, without building a report table first.
+
+    :returns: A streaming HttpResponse, or None if the report doesn't exist
+              or its query fails, in which case the report page should be
+              shown instead.
+
+    """
+    config = Generator().make_export_config(report_name, CONFIG_FILE_PACKAGE,
+                                            CONFIG_FILE_LOCAL, query)
+    if not config:
+        return None
+    try:
+        result = StreamedResult(config)
+    except psycopg2.Error as error:
+        _logger.warning("could not export report %s: %s", report_name, error)
+        return None
+
+    formatter = ExportFormatter(config)
+    if export_delimiter:
+        content = stream_csv(result, formatter, export_delimiter)
+        response = HttpResponse(content, mimetype="text/x-csv; charset=utf-8")
+        response["Content-Type"] = "application/force-download"
+        extension = "csv"
+    else:
+        content = stream_json(result, formatter)
+        response = HttpResponse(content,
+                                mimetype="application/json; charset=utf-8")
+        extension = "json"
+
+    response["Content-Disposition"] = (
+        "attachment; filename=report-%s-%s.%s" %
+        (report_name, strftime("%Y%m%d", localtime()), extension)
+        )
+    return response
+
+
+def stream_csv(rows, formatter, delimiter, batch_size=EXPORT_BATCH_SIZE):
+    """Yields CSV formatted chunks of batch_size rows"""
+    def _encode(value):
+        return value.encode('utf-8') if value is not None else value
+
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter=str(delimiter))
+    writer.writerow([_encode(header) for header in formatter.headers])
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_encode(value)
+                         for value in formatter.format_row(row)])
+        if count % batch_size == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def stream_json(rows, formatter, batch_size=EXPORT_BATCH_SIZE):
+    """Yields chunks of a JSON list of row objects, batch_size rows at a
+    time.
+
+    """
+    fields = formatter.fields
+    chunk = []
+    separator = '['
+    for row in rows:
+        chunk.append(separator)
+        chunk.append(json.dumps(OrderedDict(
+            zip(fields, formatter.format_values(row)))))
+        separator = ','
+        if len(chunk) >= 2 * batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']' if separator == ',' else '[]')
+    yield ''.join(chunk)
+
+
 class UnknownNetworkTypeException(Exception):
     """Unknown network type"""
     pass
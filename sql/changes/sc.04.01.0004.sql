@@ -0,0 +1,48 @@
+-- Keep a version counter that is bumped whenever alert profile data changes,
+-- so that alertengine can tell when its cached subscription snapshot is stale.
+CREATE SEQUENCE profiles.alertprofiles_version_seq;
+
+CREATE OR REPLACE FUNCTION profiles.bump_alertprofiles_version()
+RETURNS TRIGGER AS $$
+  BEGIN
+    PERFORM nextval('profiles.alertprofiles_version_seq');
+    RETURN NULL;
+  END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.account FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.accountgroup_accounts FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.alertaddress FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.alertprofile FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.alertpreference FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.timeperiod FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.alertsubscription FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.filtergroup FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.filtergroupcontent FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.filtergroup_group_permission FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.filter FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.expression FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
@@ -0,0 +1,11 @@
+-- Index the metric name forms of netbox sysnames, interface names and sensor
+-- names, as used when mapping Graphite metric names back to NAV objects.
+-- The expression must match the one used in nav.metrics.lookup.
+CREATE INDEX netbox_metric_sysname
+  ON netbox (translate(sysname::TEXT, './ ()', '_____'));
+
+CREATE INDEX interface_metric_ifname
+  ON interface (translate(ifname::TEXT, './ ()', '_____'));
+
+CREATE INDEX sensor_metric_internal_name
+  ON sensor (translate(internal_name::TEXT, './ ()', '_____'));
@@ -0,0 +1,7 @@
+-- Cache of the current number of active addresses per prefix, refreshed by
+-- the active IP collector and optionally used by the prefix usage API.
+CREATE TABLE prefix_usage (
+  netaddr CIDR PRIMARY KEY,
+  active_addresses INTEGER NOT NULL,
+  updated TIMESTAMP NOT NULL DEFAULT NOW()
+);
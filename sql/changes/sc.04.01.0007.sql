@@ -0,0 +1,5 @@
+-- Indexes for keyset pagination of cam and arp records by time in the API
+CREATE INDEX cam_start_time_camid_btree ON cam USING btree (start_time, camid);
+CREATE INDEX cam_end_time_camid_btree ON cam USING btree (end_time, camid);
+CREATE INDEX arp_start_time_arpid_btree ON arp USING btree (start_time, arpid);
+CREATE INDEX arp_end_time_arpid_btree ON arp USING btree (end_time, arpid);
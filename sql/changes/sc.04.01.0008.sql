@@ -0,0 +1,5 @@
+-- Cache the number of active MAC addresses per prefix, so that the active ip
+-- collector only needs to count the prefixes that have changed between runs
+ALTER TABLE prefix_usage ADD COLUMN active_macs INTEGER NOT NULL DEFAULT 0;
+-- Force the next collection to count all prefixes
+DELETE FROM prefix_usage;
@@ -0,0 +1,4 @@
+-- Keep a version counter that navtopology and ipdevpoll bump whenever they
+-- change the network topology, so that the web server can tell when its
+-- cached netmap topologies are stale.
+CREATE SEQUENCE manage.netmap_topology_version_seq;
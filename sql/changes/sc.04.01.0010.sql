@@ -0,0 +1,5 @@
+-- Filter expressions are evaluated through their match fields, so changes to
+-- those must also bump the alert profile version counter.
+CREATE TRIGGER trig_alertprofiles_version AFTER INSERT OR UPDATE OR DELETE
+    ON profiles.matchfield FOR EACH STATEMENT
+    EXECUTE PROCEDURE profiles.bump_alertprofiles_version();
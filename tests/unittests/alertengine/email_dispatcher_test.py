@@ -0,0 +1,112 @@
+import socket
+import unittest
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from mock import Mock, patch
+
+from nav.alertengine.dispatchers import (DispatcherException,
+                                         FatalDispatcherException)
+from nav.alertengine.dispatchers import email_dispatcher
+
+
+def make_address(address_id, address='user@example.org'):
+    return Mock(id=address_id, address=address, DEBUG_MODE=False)
+
+
+def make_alert(alert_id):
+    return Mock(id=alert_id)
+
+
+class EmailDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.sent = []
+        self.connection_patch = patch.object(
+            email_dispatcher, 'get_connection',
+            side_effect=self._make_connection)
+        self.connection_patch.start()
+        self.message_patch = patch.object(
+            email_dispatcher.email, 'get_message',
+            side_effect=lambda alert, lang, kind: 'Subject: alert %d\nbody' %
+            alert.id)
+        self.message_patch.start()
+
+    def tearDown(self):
+        self.connection_patch.stop()
+        self.message_patch.stop()
+
+    def _make_connection(self, **kwargs):
+        connection = Mock()
+        connection.send_messages.side_effect = self.sent.extend
+        self.connections.append(connection)
+        return connection
+
+    def test_should_reuse_connection_between_sends(self):
+        dispatcher = email_dispatcher.email()
+        dispatcher.send(make_address(1), make_alert(1))
+        dispatcher.send(make_address(1), make_alert(2))
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(len(self.sent), 2)
+        dispatcher.close()
+        self.assertTrue(self.connections[0].close.called)
+
+    def test_should_reconnect_when_connection_was_dropped(self):
+        dispatcher = email_dispatcher.email()
+        dispatcher.send(make_address(1), make_alert(1))
+        self.connections[0].send_messages.side_effect = (
+            SMTPServerDisconnected())
+        dispatcher.send(make_address(1), make_alert(2))
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_should_not_retry_on_new_connection(self):
+        dispatcher = email_dispatcher.email()
+        with patch.object(email_dispatcher, 'get_connection') as get:
+            get.return_value.open.side_effect = socket.error()
+            self.assertRaises(socket.error, dispatcher.send,
+                              make_address(1), make_alert(1))
+            self.assertEqual(get.call_count, 1)
+
+    def test_should_deliver_many_and_report_outcome_on_send(self):
+        dispatcher = email_dispatcher.email({'workers': '3'})
+        addresses = [make_address(i, 'user%d@example.org' % i)
+                     for i in range(5)]
+        alert = make_alert(1)
+        dispatcher.deliver_many([(a, alert, 'en') for a in addresses])
+        self.assertEqual(len(self.sent), 5)
+        self.assertEqual(dispatcher.stats.count, 5)
+
+        for address in addresses:
+            dispatcher.send(address, alert)
+        self.assertEqual(len(self.sent), 5)
+
+    def test_should_raise_delivery_errors_on_send(self):
+        dispatcher = email_dispatcher.email({'workers': '1'})
+        refused = SMTPRecipientsRefused({'user@example.org': (550, 'no')})
+        with patch.object(dispatcher, '_deliver', side_effect=refused):
+            dispatcher.deliver_many([(make_address(1), make_alert(1), 'en')])
+        self.assertRaises(FatalDispatcherException, dispatcher.send,
+                          make_address(1), make_alert(1))
+
+    def test_temporary_errors_should_raise_dispatcher_exception(self):
+        dispatcher = email_dispatcher.email()
+        with patch.object(dispatcher, '_deliver',
+                          side_effect=SMTPServerDisconnected()):
+            self.assertRaises(DispatcherException, dispatcher.send,
+                              make_address(1), make_alert(1))
+
+    def test_should_batch_alerts_per_address(self):
+        dispatcher = email_dispatcher.email({'batch': 'yes'})
+        address = make_address(1)
+        dispatcher.deliver_many([(address, make_alert(i), 'en')
+                                 for i in range(3)])
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0].subject, '3 NAV alerts')
+        for i in range(3):
+            dispatcher.send(address, make_alert(i))
+        self.assertEqual(len(self.sent), 1)
+
+    def test_close_should_reset_stats(self):
+        dispatcher = email_dispatcher.email()
+        dispatcher.send(make_address(1), make_alert(1))
+        dispatcher.close()
+        self.assertEqual(dispatcher.stats.count, 0)
@@ -0,0 +1,61 @@
+from unittest import TestCase
+from datetime import datetime, time
+from mock import patch
+
+from nav.alertengine.base import (SubscriptionSnapshot,
+                                  get_next_timeperiod_boundary)
+
+
+class TimePeriodBoundaryTest(TestCase):
+    def test_next_boundary_should_be_next_start_time_today(self):
+        now = datetime(2014, 3, 5, 9, 30)
+        starts = [time(8, 0), time(17, 0), time(12, 0)]
+        self.assertEqual(get_next_timeperiod_boundary(now, starts),
+                         datetime(2014, 3, 5, 12, 0))
+
+    def test_next_boundary_should_be_midnight_after_last_start_time(self):
+        now = datetime(2014, 3, 5, 18, 0)
+        starts = [time(8, 0), time(17, 0)]
+        self.assertEqual(get_next_timeperiod_boundary(now, starts),
+                         datetime(2014, 3, 6, 0, 0))
+
+    def test_next_boundary_should_be_midnight_with_no_time_periods(self):
+        now = datetime(2014, 3, 5, 18, 0)
+        self.assertEqual(get_next_timeperiod_boundary(now, []),
+                         datetime(2014, 3, 6, 0, 0))
+
+
+class SubscriptionSnapshotTest(TestCase):
+    def setUp(self):
+        self.now = datetime(2014, 3, 5, 9, 30)
+        self.snapshot = SubscriptionSnapshot()
+        self.snapshot.version = (10, True)
+        self.snapshot.valid_until = datetime(2014, 3, 5, 12, 0)
+
+    def test_snapshot_should_not_be_stale_when_nothing_changed(self):
+        self.assertFalse(self.snapshot.is_stale((10, True), self.now))
+
+    def test_snapshot_should_be_stale_on_version_change(self):
+        self.assertTrue(self.snapshot.is_stale((11, True), self.now))
+
+    def test_snapshot_should_be_stale_after_timeperiod_boundary(self):
+        later = datetime(2014, 3, 5, 12, 0)
+        self.assertTrue(self.snapshot.is_stale((10, True), later))
+
+    def test_invalidated_snapshot_should_be_stale(self):
+        self.snapshot.invalidate()
+        self.assertTrue(self.snapshot.is_stale((10, True), self.now))
+
+    def test_get_accounts_should_not_refresh_fresh_snapshot(self):
+        with patch.object(SubscriptionSnapshot, 'get_current_version',
+                          return_value=(10, True)):
+            with patch.object(self.snapshot, 'refresh') as refresh:
+                self.snapshot.get_accounts(self.now)
+                self.assertFalse(refresh.called)
+
+    def test_get_accounts_should_refresh_stale_snapshot(self):
+        with patch.object(SubscriptionSnapshot, 'get_current_version',
+                          return_value=(11, True)):
+            with patch.object(self.snapshot, 'refresh') as refresh:
+                self.snapshot.get_accounts(self.now)
+                refresh.assert_called_once_with((11, True), self.now)
@@ -1,8 +1,14 @@
 from unittest import TestCase
 import datetime
+import os
+import shutil
+import tempfile
+from pprint import pformat
+from mock import patch
 from nav.models.event import EventQueue as Event, Subsystem, EventType
 from nav.models.manage import Netbox, Device
-from nav.eventengine.alerts import AlertGenerator
+from nav.eventengine.alerts import (AlertGenerator, TemplateRegistry,
+                                    TemplateDetails, ContextDump)
 
 class MockedAlertGenerator(AlertGenerator):
     def get_alert_type(self):
@@ -61,3 +67,84 @@ class AlertHistoryFromEventTests(AlertFromEventBase):
         self.event.state = self.event.STATE_END
         alert = MockedAlertGenerator(self.event)
         self.assertTrue(alert.make_alert_history() is None)
+
+
+class TemplateRegistryTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'boxState'))
+        for name in ('boxDown-email.txt', 'boxDown-sms.no.txt',
+                     'boxUp-email.txt', 'README'):
+            self._touch(os.path.join('boxState', name))
+        self.registry = TemplateRegistry(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _touch(self, name):
+        open(os.path.join(self.directory, name), 'w').close()
+
+    def test_should_find_templates_for_alert_type(self):
+        templates = self.registry.get_list_of_templates_for('boxState',
+                                                            'boxDown')
+        self.assertEqual(templates, [
+            TemplateDetails('boxState/boxDown-email.txt', 'email', 'en'),
+            TemplateDetails('boxState/boxDown-sms.no.txt', 'sms', 'no'),
+        ])
+
+    def test_should_find_nothing_for_unknown_event_type(self):
+        self.assertEqual(
+            self.registry.get_list_of_templates_for('linkState', 'linkDown'),
+            [])
+
+    def test_should_not_rescan_unchanged_directory(self):
+        self.registry.get_list_of_templates_for('boxState', 'boxDown')
+        with patch('os.listdir') as listdir:
+            self.registry.get_list_of_templates_for('boxState', 'boxUp')
+            self.assertFalse(listdir.called)
+
+    def test_should_rescan_directory_when_mtime_changes(self):
+        self.registry.get_list_of_templates_for('boxState', 'boxDown')
+        self._touch(os.path.join('boxState', 'boxShadow-email.txt'))
+        directory = os.path.join(self.directory, 'boxState')
+        mtime = os.stat(directory).st_mtime + 10
+        os.utime(directory, (mtime, mtime))
+
+        templates = self.registry.get_list_of_templates_for('boxState',
+                                                            'boxShadow')
+        self.assertEqual(len(templates), 1)
+
+    def test_should_compile_template_only_once(self):
+        details = TemplateDetails('boxState/boxUp-email.txt', 'email', 'en')
+        with patch('nav.eventengine.alerts.loader.get_template') as get:
+            self.registry.get_template(details)
+            self.registry.get_template(details)
+            self.assertEqual(get.call_count, 1)
+
+    def test_should_recompile_template_when_mtime_changes(self):
+        details = TemplateDetails('boxState/boxUp-email.txt', 'email', 'en')
+        filename = os.path.join(self.directory, details.name)
+        with patch('nav.eventengine.alerts.loader.get_template') as get:
+            self.registry.get_template(details)
+            mtime = os.stat(filename).st_mtime + 10
+            os.utime(filename, (mtime, mtime))
+            self.registry.get_template(details)
+            self.assertEqual(get.call_count, 2)
+
+
+class ContextDumpTests(TestCase):
+    def test_should_not_format_context_unless_used(self):
+        with patch('nav.eventengine.alerts.pformat') as pformat:
+            ContextDump(dict(foo='bar'))
+            self.assertFalse(pformat.called)
+
+    def test_should_include_context_variables(self):
+        context = dict(foo='bar')
+        context['context_dump'] = ContextDump(context)
+        self.assertTrue("'foo': 'bar'" in unicode(context['context_dump']))
+
+    def test_should_not_include_itself(self):
+        context = dict(foo='bar')
+        context['context_dump'] = ContextDump(context)
+        self.assertEqual(unicode(context['context_dump']),
+                         pformat(dict(foo='bar')))
@@ -0,0 +1,29 @@
+import unittest
+from twisted.internet import defer
+
+from nav import asyncdns
+
+
+class PendingResolver(asyncdns.Resolver):
+    """A resolver whose lookups of names starting with 'slow' never finish"""
+    def lookup(self, name):
+        if name.startswith('slow'):
+            return [defer.Deferred()]
+        return [defer.succeed(['%s.example.org' % name])]
+
+    @staticmethod
+    def _extract_records(result, name):
+        return name, result
+
+
+class ResolverTimeoutTest(unittest.TestCase):
+    def test_should_give_up_pending_lookups_after_timeout(self):
+        result = PendingResolver().resolve(['fast', 'slow'], timeout=0.1)
+        self.assertEqual(result['fast'], ['fast.example.org'])
+        self.assertTrue(isinstance(result['slow'],
+                                   asyncdns.DNSQueryTimeoutError))
+
+    def test_should_return_when_all_lookups_are_done(self):
+        result = PendingResolver().resolve(['a', 'b'])
+        self.assertEqual(result, {'a': ['a.example.org'],
+                                  'b': ['b.example.org']})
@@ -0,0 +1,142 @@
+import unittest
+from mock import Mock
+
+from nav.event import (Event, EventBatch, EventAlreadyPostedError,
+                       EventIncompleteError)
+from nav.models.event import EventQueue
+import nav.models.manage  # pylint: disable=W0611
+
+
+def make_connection(first_id=10):
+    """Returns a mock connection whose cursor allocates ids from first_id"""
+    cursor = Mock()
+    cursor.mogrify.side_effect = lambda fmt, values: repr(values[0])
+    cursor.fetchall.side_effect = lambda: [
+        (first_id + i,) for i in range(cursor.execute.call_args[0][1][0])]
+    connection = Mock()
+    connection.cursor.return_value = cursor
+    return connection
+
+
+def make_event(**kwargs):
+    attrs = dict(source='pping', target='eventEngine', eventtypeid='boxState',
+                 netboxid=1)
+    attrs.update(kwargs)
+    return Event(**attrs)
+
+
+class EventBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = make_connection()
+        self.cursor = self.connection.cursor.return_value
+
+    def get_statements(self):
+        return [call[0][0] for call in self.cursor.execute.call_args_list]
+
+    def test_empty_batch_should_not_touch_database(self):
+        self.assertEqual(EventBatch(self.connection).post(), 0)
+        self.assertFalse(self.connection.cursor.called)
+
+    def test_should_allocate_all_ids_in_one_query(self):
+        batch = EventBatch(self.connection)
+        events = [make_event(netboxid=i) for i in range(1, 4)]
+        for event in events:
+            batch.add(event)
+        self.assertEqual(batch.post(), 3)
+
+        self.assertTrue('generate_series' in self.get_statements()[0])
+        self.assertEqual([e.eventqid for e in events], [10, 11, 12])
+
+    def test_should_insert_events_in_one_statement(self):
+        batch = EventBatch(self.connection)
+        batch.add(make_event(netboxid=1))
+        batch.add(make_event(netboxid=2))
+        batch.post()
+
+        statements = self.get_statements()
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[1].startswith("INSERT INTO eventq "))
+        self.assertEqual(statements[1].count("'pping'"), 2)
+        self.connection.commit.assert_called_once_with()
+
+    def test_should_use_default_for_unset_columns(self):
+        batch = EventBatch(self.connection)
+        batch.add(make_event())
+        batch.post()
+
+        insert = self.get_statements()[1]
+        values = insert.split(" VALUES ")[1]
+        self.assertEqual(values.count("DEFAULT"), 6)
+
+    def test_should_insert_variables_in_one_statement(self):
+        batch = EventBatch(self.connection)
+        for netboxid in (1, 2):
+            event = make_event(netboxid=netboxid)
+            event['foo'] = 'bar'
+            event['baz'] = 'qux'
+            batch.add(event)
+        batch.post()
+
+        statements = self.get_statements()
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(statements[2].startswith("INSERT INTO eventqvar "))
+        self.assertEqual(statements[2].count("'bar'"), 2)
+
+    def test_should_not_commit_when_told_not_to(self):
+        batch = EventBatch(self.connection, commit=False)
+        batch.add(make_event())
+        batch.post()
+        self.assertFalse(self.connection.commit.called)
+
+    def test_should_refuse_posted_event(self):
+        event = make_event()
+        event.eventqid = 42
+        self.assertRaises(EventAlreadyPostedError,
+                          EventBatch(self.connection).add, event)
+
+    def test_should_refuse_incomplete_event(self):
+        batch = EventBatch(self.connection)
+        batch.add(Event(source='pping'))
+        self.assertRaises(EventIncompleteError, batch.post)
+
+    def test_event_post_within_context_should_be_batched(self):
+        events = [make_event(netboxid=i) for i in range(1, 4)]
+        with EventBatch(self.connection) as batch:
+            for event in events:
+                event.post()
+            self.assertEqual(len(batch), 3)
+            self.assertFalse(self.cursor.execute.called)
+
+        self.assertEqual(len(self.get_statements()), 2)
+        self.assertEqual(EventBatch.current(), None)
+
+    def test_batch_should_not_be_posted_on_error(self):
+        def _fail():
+            with EventBatch(self.connection):
+                make_event().post()
+                raise ValueError("oops")
+
+        self.assertRaises(ValueError, _fail)
+        self.assertFalse(self.cursor.execute.called)
+
+    def test_post_individually_should_skip_failing_events(self):
+        batch = EventBatch(self.connection)
+        batch.add(make_event(netboxid=1))
+        batch.add(Event(source='pping'))
+        batch.add(make_event(netboxid=3))
+
+        self.assertEqual(batch.post_individually(), 2)
+        self.assertEqual(len(batch), 0)
+
+    def test_should_accept_eventqueue_models(self):
+        event = EventQueue(source_id='thresholdMon', target_id='eventEngine',
+                           event_type_id='thresholdState', netbox_id=1)
+        event.varmap = {'metric': 'foo.bar'}
+        batch = EventBatch(self.connection)
+        batch.add(event)
+        batch.post()
+
+        statements = self.get_statements()
+        self.assertTrue("'thresholdMon'" in statements[1])
+        self.assertTrue("'foo.bar'" in statements[2])
+        self.assertEqual(event.pk, 10)
@@ -0,0 +1,78 @@
+"""Tests for the netbios tracker"""
+
+import unittest
+from Queue import Queue
+from subprocess import Popen
+from mock import patch
+
+from nav.netbiostracker import tracker
+from nav.netbiostracker.tracker import NetbiosResult
+
+
+class TestScan(unittest.TestCase):
+    def test_split_should_divide_addresses_evenly(self):
+        addresses = [str(x) for x in range(10)]
+        shards = tracker.split(addresses, 4)
+        self.assertEqual([len(shard) for shard in shards], [3, 3, 3, 1])
+        self.assertEqual(sum(shards, []), addresses)
+
+    def test_split_should_not_make_empty_shards(self):
+        self.assertEqual(tracker.split(['a', 'b'], 4), [['a'], ['b']])
+        self.assertEqual(tracker.split([], 4), [])
+
+    def test_output_should_be_read_until_all_scanners_are_done(self):
+        lines = Queue()
+        for item in ['a\n', None, '', 'b\n', None, None]:
+            lines.put(item)
+        self.assertEqual(list(tracker._read_output(lines, 2)),
+                         ['a\n', 'b\n'])
+
+    def test_scanner_errors_should_be_raised(self):
+        lines = Queue()
+        for item in ['a\n', None, 'failed']:
+            lines.put(item)
+        self.assertRaises(Exception, list, tracker._read_output(lines, 1))
+
+    @patch.object(tracker, '_logger')
+    @patch.object(tracker, 'Popen')
+    def test_scanner_stderr_should_only_be_logged(self, popen, logger):
+        script = 'yes warning | head -c 200000 >&2; echo result'
+        popen.side_effect = lambda _args, **kwargs: Popen(['sh', '-c', script],
+                                                          **kwargs)
+        lines = Queue()
+        tracker._run_scanner(['10.0.0.1'], lines)
+        self.assertEqual([lines.get(), lines.get(), lines.get()],
+                         ['result\n', None, None])
+        self.assertTrue(logger.warning.called)
+
+    @patch.object(tracker, 'Popen')
+    def test_scanner_exit_status_should_be_an_error(self, popen):
+        popen.side_effect = lambda _args, **kwargs: Popen(['sh', '-c',
+                                                           'exit 2'],
+                                                          **kwargs)
+        lines = Queue()
+        tracker._run_scanner(['10.0.0.1'], lines)
+        self.assertEqual(lines.get(), None)
+        self.assertTrue(lines.get())
+
+    def test_parse_should_accept_lines(self):
+        lines = iter(['10.0.0.1!PC1!!USER!00-11-22-33-44-55\n'])
+        self.assertEqual(tracker.parse(lines, 'cp850'), [
+            NetbiosResult('10.0.0.1', 'PC1', '', 'USER', '00:11:22:33:44:55')
+        ])
+
+
+class TestUpdateDatabase(unittest.TestCase):
+    @patch.object(tracker, 'create_entries')
+    @patch.object(tracker, 'set_end_time')
+    @patch.object(tracker, 'fetch_database_entries')
+    def test_should_only_write_differences(self, fetch, set_end_time,
+                                           create_entries):
+        kept = NetbiosResult('10.0.0.1', 'PC1', '', '', '00:11:22:33:44:55')
+        gone = NetbiosResult('10.0.0.2', 'PC2', '', '', '00:11:22:33:44:56')
+        new = NetbiosResult('10.0.0.3', 'PC3', '', '', '00:11:22:33:44:57')
+        fetch.return_value = {tuple(kept): 1, tuple(gone): 2}
+        tracker.update_database([kept, new])
+
+        set_end_time.assert_called_once_with([2])
+        create_entries.assert_called_once_with(set([new]))
@@ -4,6 +4,9 @@
 
 import unittest
 from datetime import datetime
+from mock import patch
+from nav.activeipcollector import manager
+from nav.activeipcollector.collector import count_active
 from nav.activeipcollector.manager import find_range, get_timestamp
 
 
@@ -18,3 +21,54 @@ class TestPrefixIpCollector(unittest.TestCase):
         ts = datetime(2012, 10, 04, 14, 30)
         self.assertEqual(get_timestamp(ts), 1349353800)
 
+
+    @patch.object(manager, 'send_metrics')
+    def test_store_should_send_all_metrics_at_once(self, send_metrics):
+        when = datetime(2012, 10, 04, 14, 30)
+        manager.store([('10.0.0.0/24', when, 5, 4),
+                       ('10.0.1.0/24', when, 0, 0)])
+        self.assertEqual(send_metrics.call_count, 1)
+        self.assertEqual(len(send_metrics.call_args[0][0]), 6)
+
+    @patch('time.sleep')
+    @patch.object(manager, 'METRICS_PER_BATCH', 4)
+    @patch.object(manager, 'send_metrics')
+    def test_store_should_pace_large_batches(self, send_metrics, sleep):
+        when = datetime(2012, 10, 04, 14, 30)
+        manager.store([('10.0.%d.0/24' % i, when, 5, 4) for i in range(3)])
+        self.assertEqual([len(call[0][0])
+                          for call in send_metrics.call_args_list],
+                         [4, 4, 1])
+        self.assertEqual(sleep.call_count, 2)
+
+
+class TestCountActive(unittest.TestCase):
+    def setUp(self):
+        self.times = [datetime(2014, 5, 1, hour) for hour in range(4)]
+
+    def test_should_count_records_active_at_each_time(self):
+        records = [
+            ('10.0.0.1', 'aa', datetime(2014, 5, 1, 0, 30), None),
+            ('10.0.0.2', 'bb', datetime(2014, 4, 1),
+             datetime(2014, 5, 1, 1, 30)),
+        ]
+        self.assertEqual([counts[1:] for counts
+                          in count_active(records, self.times)],
+                         [(1, 1), (2, 2), (1, 1), (1, 1)])
+
+    def test_should_count_addresses_distinctly(self):
+        records = [
+            ('10.0.0.1', 'aa', datetime(2014, 4, 1), None),
+            ('10.0.0.1', 'aa', datetime(2014, 4, 2),
+             datetime(2014, 5, 1, 1, 30)),
+            ('10.0.0.2', 'aa', datetime(2014, 4, 3), None),
+        ]
+        self.assertEqual([counts[1:] for counts
+                          in count_active(records, self.times)],
+                         [(2, 1), (2, 1), (2, 1), (2, 1)])
+
+    def test_record_ending_at_time_should_be_active(self):
+        records = [('10.0.0.1', 'aa', datetime(2014, 4, 1), self.times[1])]
+        self.assertEqual([counts[1] for counts
+                          in count_active(records, self.times)],
+                         [1, 1, 0, 0])
@@ -0,0 +1,134 @@
+from datetime import timedelta
+import unittest
+from urllib2 import HTTPError, URLError
+from mock import patch
+
+from nav.metrics.errors import GraphiteUnreachableError
+from nav.metrics.thresholds import ThresholdEvaluator
+from nav import thresholdmon
+
+IN_OCTETS = 'nav.devices.*.ports.*.ifInOctets'
+CPU = 'nav.devices.*.cpu.*.loadavg5min'
+
+
+class MakeFetchRequestsTest(unittest.TestCase):
+    def test_should_group_by_period(self):
+        evaluators = [
+            ThresholdEvaluator(CPU, raw=True),
+            ThresholdEvaluator(IN_OCTETS, raw=True),
+            ThresholdEvaluator(CPU, period=timedelta(minutes=5), raw=True),
+        ]
+        requests = thresholdmon.make_fetch_requests(evaluators)
+        self.assertEqual(len(requests), 2)
+        starts = sorted(start for start, _targets in requests)
+        self.assertEqual(starts, ['-10min', '-5min'])
+
+    def test_should_share_identical_targets(self):
+        evaluators = [ThresholdEvaluator(CPU, raw=True) for _ in range(3)]
+        requests = thresholdmon.make_fetch_requests(evaluators)
+        self.assertEqual(len(requests), 1)
+        _start, targets = requests[0]
+        self.assertEqual(targets.keys(), [CPU])
+        self.assertEqual(len(targets[CPU]), 3)
+
+    def test_should_limit_targets_per_request(self):
+        evaluators = [ThresholdEvaluator('nav.foo.bar%d' % i, raw=True)
+                      for i in range(5)]
+        requests = thresholdmon.make_fetch_requests(evaluators, max_targets=2)
+        self.assertEqual([len(targets) for _start, targets in requests],
+                         [2, 2, 1])
+
+    def test_should_separate_overlapping_targets(self):
+        evaluators = [
+            ThresholdEvaluator('a.*.b', raw=True),
+            ThresholdEvaluator('scale(a.*.b, 8)', raw=True),
+            ThresholdEvaluator('a.x.{b,c}', raw=True),
+            ThresholdEvaluator('a.x.d', raw=True),
+        ]
+        requests = thresholdmon.make_fetch_requests(evaluators)
+        self.assertEqual(
+            sorted(sorted(targets) for _start, targets in requests),
+            [['a.*.b', 'a.x.d'], ['a.x.{b,c}'], ['scale(a.*.b, 8)']])
+
+
+class SplitByTargetTest(unittest.TestCase):
+    def test_should_split_by_series_pattern(self):
+        averages = {
+            'nav.devices.a.cpu.c1.loadavg5min': 1.0,
+            'nav.devices.b.ports.p1.ifInOctets': 2.0,
+        }
+        result = thresholdmon.split_by_target([CPU, IN_OCTETS], averages)
+        self.assertEqual(result[CPU],
+                         {'nav.devices.a.cpu.c1.loadavg5min': 1.0})
+        self.assertEqual(result[IN_OCTETS],
+                         {'nav.devices.b.ports.p1.ifInOctets': 2.0})
+
+    def test_should_prefer_target_with_same_functions(self):
+        scaled = 'scale(%s,8)' % IN_OCTETS
+        averages = {
+            'nav.devices.b.ports.p1.ifInOctets': 2.0,
+            'scale(nav.devices.b.ports.p1.ifInOctets,8)': 16.0,
+        }
+        result = thresholdmon.split_by_target([IN_OCTETS, scaled], averages)
+        self.assertEqual(result[IN_OCTETS].values(), [2.0])
+        self.assertEqual(result[scaled].values(), [16.0])
+
+    def test_should_not_match_partial_series_names(self):
+        averages = {'nav.devices.a.cpu.c1.loadavg5minutes': 1.0}
+        result = thresholdmon.split_by_target([CPU], averages)
+        self.assertEqual(result[CPU], {})
+
+
+class FetchValuesTest(unittest.TestCase):
+    @patch('nav.thresholdmon.get_metric_average')
+    def test_should_set_values_of_all_evaluators(self, get_metric_average):
+        get_metric_average.return_value = {
+            'nav.devices.a.cpu.c1.loadavg5min': 1.0,
+            'nav.devices.b.ports.p1.ifInOctets': 2.0,
+        }
+        cpu = ThresholdEvaluator(CPU, raw=True)
+        octets = ThresholdEvaluator(IN_OCTETS, raw=True)
+
+        fetched = thresholdmon.fetch_values([cpu, octets])
+        self.assertEqual(get_metric_average.call_count, 1)
+        self.assertEqual(set(fetched), set([cpu, octets]))
+        self.assertEqual(cpu.result.keys(),
+                         ['nav.devices.a.cpu.c1.loadavg5min'])
+        self.assertEqual(octets.result.keys(),
+                         ['nav.devices.b.ports.p1.ifInOctets'])
+
+    @patch('nav.thresholdmon.get_metric_average')
+    def test_failed_requests_should_be_omitted(self, get_metric_average):
+        get_metric_average.side_effect = IOError("graphite is down")
+        cpu = ThresholdEvaluator(CPU, raw=True)
+
+        self.assertEqual(thresholdmon.fetch_values([cpu]), {})
+        self.assertEqual(cpu.result, {})
+
+    @patch('nav.thresholdmon.get_metric_average')
+    def test_broken_target_should_not_omit_others(self, get_metric_average):
+        def _get_metric_average(targets, **_kwargs):
+            if 'nav.foo.bar2' in targets:
+                raise GraphiteUnreachableError(
+                    "graphite is unreachable",
+                    HTTPError('/render/', 400, 'Bad Request', {}, None))
+            return dict((target, 1.0) for target in targets)
+        get_metric_average.side_effect = _get_metric_average
+        evaluators = [ThresholdEvaluator('nav.foo.bar%d' % i, raw=True)
+                      for i in range(5)]
+
+        fetched = thresholdmon.fetch_values(evaluators)
+        self.assertEqual(set(fetched), set(evaluators) - set(evaluators[2:3]))
+        self.assertEqual(evaluators[2].result, {})
+
+    @patch('nav.thresholdmon.get_metric_average')
+    def test_unreachable_graphite_should_not_be_retried(self,
+                                                        get_metric_average):
+        get_metric_average.side_effect = GraphiteUnreachableError(
+            "graphite is unreachable", URLError('connection refused'))
+        evaluators = [ThresholdEvaluator('nav.foo.bar%d' % i, raw=True)
+                      for i in range(5)]
+
+        fetched = thresholdmon.fetch_values(evaluators, max_targets=2)
+        self.assertEqual(fetched, {})
+        self.assertEqual(get_metric_average.call_count, 3)
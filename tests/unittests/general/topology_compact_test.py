@@ -0,0 +1,126 @@
+"""Tests for the compact VLAN topology analysis"""
+
+import unittest
+from mock import Mock
+import networkx as nx
+
+from nav.topology.compact import (CompactLayer2Graph, IfcInfo, RoutedVlan,
+                                  CompactVlanTopologyAnalyzer,
+                                  analyze_routed_vlans, make_vlan_bitset)
+from nav.topology.vlan import RoutedVlanTopologyAnalyzer
+
+VLAN = 10
+
+# netbox 1 is a router, with switches 2-5 chained below it
+LINKS = [
+    # (ifc id, netbox, to ifc id, to netbox, vlan)
+    (11, 1, 21, 2, VLAN),
+    (21, 2, 11, 1, VLAN),
+    (22, 2, 31, 3, VLAN),
+    (31, 3, 22, 2, VLAN),
+    (32, 3, 41, 4, VLAN),
+    (41, 4, 32, 3, VLAN),
+    (43, 4, 51, 5, 20),
+    (51, 5, 43, 4, 20),
+]
+
+
+def make_compact_graph(links=LINKS):
+    return CompactLayer2Graph(
+        ((netbox, to_netbox, ifc, IfcInfo(to_ifc, False, vlan, None))
+         for ifc, netbox, to_ifc, to_netbox, vlan in links),
+        {})
+
+
+def make_object_graph(links=LINKS):
+    netboxes = dict((netbox, Mock(id=netbox, sysname=str(netbox)))
+                    for _ifc, netbox, _to_ifc, _to_netbox, _vlan in links)
+    interfaces = dict((ifc, Mock(id=ifc, netbox=netboxes[netbox], trunk=False,
+                                 vlan=vlan, ifname=str(ifc)))
+                      for ifc, netbox, _to_ifc, _to_netbox, vlan in links)
+    graph = nx.MultiDiGraph()
+    for ifc, netbox, to_ifc, to_netbox, _vlan in links:
+        interfaces[ifc].to_interface = interfaces[to_ifc]
+        graph.add_edge(netboxes[netbox], netboxes[to_netbox],
+                       key=interfaces[ifc])
+    return graph, interfaces
+
+
+class TestCompactLayer2Graph(unittest.TestCase):
+    def setUp(self):
+        self.graph = make_compact_graph()
+
+    def test_edges_should_be_grouped_by_source(self):
+        self.assertEqual(list(self.graph.offsets), [0, 1, 3, 5, 7, 8])
+        self.assertEqual(
+            sorted(self.graph.edge_ifc[edge]
+                   for edge in self.graph.edges_from(2)),
+            [21, 22])
+
+    def test_should_find_edges_between_netboxes(self):
+        edges = self.graph.find_edges(3, 4)
+        self.assertEqual([self.graph.edge_ifc[edge] for edge in edges], [32])
+        self.assertEqual(self.graph.find_edges(1, 5), [])
+
+    def test_trunk_should_have_allowed_vlans(self):
+        allowed = make_vlan_bitset([10, 4000])
+        graph = CompactLayer2Graph(
+            [(1, 2, 11, IfcInfo(21, True, None, allowed)),
+             (2, 1, 21, IfcInfo(11, False, None, allowed))])
+        self.assertTrue(graph.has_vlan(0, 4000))
+        self.assertFalse(graph.has_vlan(0, 20))
+        self.assertFalse(graph.has_vlan(1, 10))
+        self.assertEqual(len(graph.allowed_vlans), 1)
+
+    def test_shortest_path_should_avoid_excluded_nodes(self):
+        links = [(1, 2, 0, None), (2, 3, 0, None), (1, 4, 0, None),
+                 (4, 5, 0, None), (5, 3, 0, None)]
+        graph = CompactLayer2Graph(links)
+        self.assertEqual(graph.shortest_path(3, 1), [3, 2, 1])
+        self.assertEqual(graph.shortest_path(3, 1, exclude=[2]),
+                         [3, 5, 4, 1])
+        self.assertTrue(graph.shortest_path(3, 1, exclude=[2, 4]) is None)
+
+
+class TestCompactVlanTopologyAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.routed_vlan = RoutedVlan(VLAN, 1, 11, 2)
+
+    def test_should_give_same_result_as_object_analyzer(self):
+        graph, interfaces = make_object_graph()
+        router_port = interfaces[11]
+        address = Mock(interface=router_port)
+        address.prefix.vlan.vlan = VLAN
+        router_port.to_netbox = router_port.to_interface.netbox
+        expected = RoutedVlanTopologyAnalyzer(address, graph).analyze()
+
+        result = CompactVlanTopologyAnalyzer(self.routed_vlan,
+                                             make_compact_graph()).analyze()
+        self.assertEqual(result, dict((ifc.id, direction)
+                                      for ifc, direction in expected.items()))
+
+    def test_should_mark_blocked_ports(self):
+        result = CompactVlanTopologyAnalyzer(
+            self.routed_vlan, make_compact_graph(), {41: [VLAN]}).analyze()
+        self.assertEqual(result[32], 'blocked')
+        self.assertEqual(result[41], 'blocked')
+
+    def test_trunk_should_be_active_if_destination_has_access_ports(self):
+        graph = CompactLayer2Graph(
+            [(1, 2, 11, IfcInfo(21, True, None, make_vlan_bitset([VLAN]))),
+             (2, 1, 21, IfcInfo(11, True, None, make_vlan_bitset([VLAN])))],
+            {2: {VLAN: [24]}})
+        result = CompactVlanTopologyAnalyzer(self.routed_vlan,
+                                             graph).analyze()
+        self.assertEqual(result[11], 'down')
+
+    def test_parallel_analysis_should_return_all_vlans(self):
+        routed_vlans = [self.routed_vlan, RoutedVlan(20, 1, 11, 2)]
+        results = list(analyze_routed_vlans(make_compact_graph(), {},
+                                            routed_vlans, 2))
+        self.assertEqual([routed_vlan for routed_vlan, _ in results],
+                         routed_vlans)
+        self.assertEqual(
+            results[0][1],
+            CompactVlanTopologyAnalyzer(self.routed_vlan,
+                                        make_compact_graph()).analyze())
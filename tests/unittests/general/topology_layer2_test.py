@@ -0,0 +1,34 @@
+"""Tests for the layer 2 topology writer"""
+
+import unittest
+from mock import patch
+
+from nav.topology import layer2
+from nav.topology.analyze import Port
+
+
+class TestLayer2TopologyWriter(unittest.TestCase):
+    def test_link_target_should_be_port_or_netbox(self):
+        self.assertEqual(layer2._get_link_target(Port((2, 20))), (2, 20))
+        self.assertEqual(layer2._get_link_target(3), (3, None))
+
+    def test_should_only_change_updatable_and_different_links(self):
+        wanted = {10: (2, 20), 11: (3, None), 12: (4, 40)}
+        current = {10: (2, 20), 11: (3, 30), 13: (5, None)}
+        self.assertEqual(layer2._find_changes(wanted, current),
+                         [(11, 3, None)])
+
+    @patch.object(layer2, 'connection')
+    def test_changes_should_be_written_in_one_statement(self, connection):
+        cursor = connection.cursor.return_value
+        layer2._update_interfaces([(11, 3, None), (12, 4, 40)])
+        self.assertEqual(cursor.execute.call_count, 1)
+        sql, params = cursor.execute.call_args[0]
+        self.assertTrue('FROM (VALUES (%s, %s::integer, %s::integer), '
+                        '(%s, %s::integer, %s::integer))' in sql)
+        self.assertEqual(params, [11, 3, None, 12, 4, 40])
+
+    @patch.object(layer2, 'connection')
+    def test_no_changes_should_not_be_written(self, connection):
+        layer2._update_interfaces([])
+        self.assertFalse(connection.cursor.called)
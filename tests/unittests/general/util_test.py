@@ -13,6 +13,7 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 import unittest
+from mock import patch
 
 from nav import util
 from nav.util import IPRange
@@ -140,3 +141,22 @@ class IPRangeStringTests(unittest.TestCase):
 
     def test_multi_mask_should_raise(self):
         self.assertRaises(ValueError, IPRange.from_string, '10.0.0.0/8/24')
+
+
+class TimedLRUCacheTests(unittest.TestCase):
+    def test_should_use_per_entry_ttl(self):
+        cache = util.TimedLRUCache(ttl=300)
+        with patch('time.time', return_value=1000):
+            cache.put('a', 1)
+            cache.put('b', 2, ttl=10)
+        with patch('time.time', return_value=1100):
+            self.assertEqual(cache.get('a'), (True, 1))
+            self.assertEqual(cache.get('b'), (False, None))
+
+    def test_should_not_grow_beyond_max_size(self):
+        cache = util.TimedLRUCache(max_size=10)
+        for i in range(20):
+            cache.put(i, i)
+        self.assertEqual(len(cache), 10)
+        self.assertEqual(cache.get(19), (True, 19))
+        self.assertEqual(cache.get(0), (False, None))
@@ -0,0 +1,37 @@
+"""Tests for the VLAN graph analyzer"""
+
+import unittest
+from mock import Mock, patch
+
+from nav.topology import vlan
+from nav.topology.vlan import VlanGraphAnalyzer
+
+
+class TestAccessPortVlans(unittest.TestCase):
+    def setUp(self):
+        self.vlan10, self.vlan20 = Mock(vlan=10), Mock(vlan=20)
+        self.uplink = Mock(id=1, netbox_id=100)
+        self.analyzer = VlanGraphAnalyzer.__new__(VlanGraphAnalyzer)
+        self.analyzer.ifc_vlan_map = {
+            self.uplink: {self.vlan10: 'up', self.vlan20: 'up'},
+        }
+
+    def test_should_find_access_ports_in_one_query(self):
+        access_ports = [
+            Mock(id=2, netbox_id=100, vlan=10),
+            Mock(id=3, netbox_id=100, vlan=30),
+            Mock(id=1, netbox_id=100, vlan=10),
+        ]
+        with patch.object(vlan, 'Interface') as interface:
+            queryset = interface.objects.filter.return_value.filter
+            queryset.return_value.iterator.return_value = access_ports
+            result = list(self.analyzer.find_access_port_vlans())
+            self.assertEqual(interface.objects.filter.call_count, 1)
+
+        self.assertEqual(result, [(access_ports[0], {self.vlan10: 'down'})])
+
+    def test_should_not_query_without_active_vlans(self):
+        self.analyzer.ifc_vlan_map = {}
+        with patch.object(vlan, 'Interface') as interface:
+            self.assertEqual(list(self.analyzer.find_access_port_vlans()), [])
+            self.assertFalse(interface.objects.filter.called)
@@ -0,0 +1,44 @@
+"""Tests for the VLAN topology updater"""
+
+import unittest
+from mock import Mock, patch
+
+from nav.models.manage import SwPortVlan
+from nav.topology.vlan import VlanTopologyUpdater
+
+
+class TestVlanTopologyUpdater(unittest.TestCase):
+    def setUp(self):
+        ifc1, ifc2 = Mock(pk=1), Mock(pk=2)
+        vlan10, vlan20 = Mock(pk=10), Mock(pk=20)
+        self.updater = VlanTopologyUpdater({
+            ifc1: {vlan10: 'up', vlan20: 'down'},
+            ifc2: {vlan10: 'blocked'},
+        })
+        self.existing = {
+            (1, 10): (100, SwPortVlan.DIRECTION_UP),
+            (2, 10): (101, SwPortVlan.DIRECTION_DOWN),
+            (2, 20): (102, SwPortVlan.DIRECTION_UP),
+            (3, 10): (103, SwPortVlan.DIRECTION_UP),
+        }
+
+    def test_should_only_write_differences(self):
+        with patch.multiple(VlanTopologyUpdater,
+                            _get_existing_records=Mock(
+                                return_value=self.existing),
+                            _create_swportvlans=Mock(),
+                            _update_directions=Mock(),
+                            _delete_swportvlans=Mock()):
+            self.updater.update()
+            created = list(
+                VlanTopologyUpdater._create_swportvlans.call_args[0][0])
+            self.assertEqual(created,
+                             [((1, 20), SwPortVlan.DIRECTION_DOWN)])
+            VlanTopologyUpdater._update_directions.assert_called_once_with(
+                [(101, SwPortVlan.DIRECTION_BLOCKED)])
+            deleted = VlanTopologyUpdater._delete_swportvlans.call_args[0][0]
+            self.assertEqual(sorted(deleted), [102, 103])
+
+    def test_unknown_direction_should_be_undefined(self):
+        self.assertEqual(VlanTopologyUpdater._direction_from_string('foo'),
+                         SwPortVlan.DIRECTION_UNDEFINED)
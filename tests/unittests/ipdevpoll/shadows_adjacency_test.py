@@ -1,4 +1,12 @@
-from nav.ipdevpoll.shadows.adjacency import UnrecognizedNeighbor
+import unittest
+from mock import Mock, patch
+
+from nav.models import manage
+from nav.ipdevpoll.storage import ContainerRepository
+from nav.ipdevpoll.shadows import Netbox, Interface
+from nav.ipdevpoll.shadows.adjacency import (UnrecognizedNeighbor,
+                                             AdjacencyCandidate,
+                                             AdjacencyManager)
 
 def test_nonascii_remote_name_should_be_changed():
     remote_name = 'a\x9enon-ascii'
@@ -13,3 +21,71 @@ def test_nonascii_remote_id_should_be_changed():
     u.remote_id = remote_id
     u.prepare()
     assert u.remote_id != remote_id
+
+
+class AdjacencyManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.containers = ContainerRepository()
+        netbox = self.containers.factory(None, Netbox)
+        netbox.id = 1
+        self.objects = Mock()
+        self.objects_patch = patch.object(manage.AdjacencyCandidate,
+                                          'objects', self.objects)
+        self.objects_patch.start()
+
+    def tearDown(self):
+        self.objects_patch.stop()
+
+    def _make_existing(self, candid, interfaceid, miss_count=0,
+                       source='cam'):
+        return manage.AdjacencyCandidate(
+            id=candid, netbox_id=1, interface_id=interfaceid, to_netbox_id=2,
+            source=source, miss_count=miss_count)
+
+    def _make_found(self, interfaceid, source='cam'):
+        cand = self.containers.factory((interfaceid, source),
+                                       AdjacencyCandidate)
+        cand.interface = Interface(id=interfaceid)
+        cand.to_netbox = Netbox(id=2)
+        cand.source = source
+        return cand
+
+    def _run_manager(self, existing):
+        self.objects.filter.return_value = existing
+        manager = AdjacencyManager(AdjacencyCandidate, self.containers)
+        manager.prepare()
+        self.objects.reset_mock()
+        self.objects.filter.return_value = Mock()
+        manager.cleanup()
+        return manager
+
+    def test_unchanged_candidates_should_not_be_written(self):
+        found = self._make_found(10)
+        self._run_manager([self._make_existing(100, 10)])
+        self.assertFalse(self.objects.filter.called)
+        self.assertFalse('miss_count' in found.get_touched())
+
+    def test_found_again_should_be_reset_in_one_update(self):
+        self._make_found(10)
+        self._make_found(11)
+        self._run_manager([self._make_existing(100, 10, miss_count=1),
+                           self._make_existing(101, 11, miss_count=2)])
+        filtr = self.objects.filter
+        self.assertEqual(filtr.call_count, 1)
+        self.assertEqual(sorted(filtr.call_args[1]['id__in']), [100, 101])
+        filtr.return_value.update.assert_called_once_with(miss_count=0)
+
+    def test_missing_should_be_incremented_in_one_update(self):
+        self._make_found(10)
+        self._run_manager([self._make_existing(100, 10),
+                           self._make_existing(101, 11),
+                           self._make_existing(102, 12),
+                           self._make_existing(103, 13, source='lldp')])
+        filtr = self.objects.filter
+        self.assertEqual(sorted(filtr.call_args_list[0][1]['id__in']),
+                         [101, 102])
+        update = filtr.return_value.update
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual(update.call_args[1]['miss_count'].children[0].name,
+                         'miss_count')
+        filtr.return_value.delete.assert_called_once_with()
@@ -0,0 +1,82 @@
+import re
+import unittest
+from mock import Mock, patch
+
+from nav.metrics import lookup
+
+
+class LookupCacheTest(unittest.TestCase):
+    def test_should_return_cached_object(self):
+        cache = lookup.LookupCache()
+        cache.put('nav.devices.foo', 'bar')
+        self.assertEqual(cache.get('nav.devices.foo'), (True, 'bar'))
+
+    def test_should_cache_negative_results(self):
+        cache = lookup.LookupCache()
+        cache.put('nav.devices.foo', None)
+        self.assertEqual(cache.get('nav.devices.foo'), (True, None))
+
+    def test_should_not_return_expired_object(self):
+        cache = lookup.LookupCache(ttl=300)
+        with patch('time.time', return_value=1000):
+            cache.put('nav.devices.foo', 'bar')
+        with patch('time.time', return_value=1301):
+            self.assertEqual(cache.get('nav.devices.foo'), (False, None))
+
+    def test_should_evict_least_recently_used(self):
+        cache = lookup.LookupCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.get('b')[0])
+        self.assertTrue(cache.get('a')[0])
+
+
+class LookupManyTest(unittest.TestCase):
+    def setUp(self):
+        self.interfaces = Mock(return_value={('foo', 'Gi1_1'): 'ifc'})
+        self.netboxes = Mock(return_value={('foo',): 'netbox'})
+        handlers = [
+            (re.compile(r'\.devices\.(?P<sysname>[^.]+)\.ports\.'
+                        r'(?P<ifname>[^\.]+)'), self.interfaces),
+            (re.compile(r'\.devices\.(?P<sysname>[^.]+)$'), self.netboxes),
+        ]
+        self.handler_patch = patch.object(lookup, '_reverse_handlers',
+                                          handlers)
+        self.cache_patch = patch.object(lookup, '_cache',
+                                        lookup.LookupCache())
+        self.handler_patch.start()
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.handler_patch.stop()
+        self.cache_patch.stop()
+
+    def test_should_call_each_handler_once(self):
+        result = lookup.lookup_many([
+            'nav.devices.foo.ports.Gi1_1.ifInOctets',
+            'nav.devices.foo.ports.Gi1_1.ifOutOctets',
+            'nav.devices.foo.ports.Gi1_2.ifInOctets',
+            'nav.devices.foo',
+        ])
+        self.assertEqual(self.interfaces.call_count, 1)
+        self.assertEqual(sorted(self.interfaces.call_args[0][0]),
+                         [('foo', 'Gi1_1'), ('foo', 'Gi1_2')])
+        self.assertEqual(self.netboxes.call_count, 1)
+
+        self.assertEqual(result['nav.devices.foo.ports.Gi1_1.ifInOctets'],
+                         'ifc')
+        self.assertEqual(result['nav.devices.foo.ports.Gi1_2.ifInOctets'],
+                         None)
+        self.assertEqual(result['nav.devices.foo'], 'netbox')
+
+    def test_unmatched_metric_should_map_to_none(self):
+        result = lookup.lookup_many(['carbon.agents.foo'])
+        self.assertEqual(result, {'carbon.agents.foo': None})
+
+    def test_should_use_cached_results(self):
+        lookup.lookup('nav.devices.foo')
+        lookup.lookup('nav.devices.foo')
+        self.assertEqual(self.netboxes.call_count, 1)
@@ -0,0 +1,180 @@
+import unittest
+from django.core.cache import get_cache
+from django.test.client import RequestFactory
+from django.utils import simplejson
+from mock import Mock, patch
+
+from nav.netmap import cache
+from nav.web.netmap import views
+
+
+def make_topology():
+    return {
+        'json': {
+            'vlans': {},
+            'nodes': {
+                u'1': {'id': '1', 'sysname': 'gw1', 'category': 'GW',
+                       'locationid': u'lab', 'up': 'y',
+                       'up_image': 'green.png', 'is_elink_node': False},
+                u'2': {'id': '2', 'sysname': 'elink', 'category': '',
+                       'is_elink_node': True},
+            },
+            'links': [{'source': u'1', 'target': u'2',
+                       'edges': [{'traffic': None}]}],
+        },
+        'port_pairs': [((0, 'edges', 0), (10, None))],
+        'digest': 'digest',
+    }
+
+
+class TopologyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_patch = patch.object(cache, 'cache',
+                                        get_cache('locmem://'))
+        self.cache_patch.start()
+        cache.cache.clear()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
+    @patch.object(cache, 'connection')
+    def test_generation_should_be_read_from_sequence(self, connection):
+        cursor = connection.cursor.return_value
+        cursor.fetchone.return_value = (5, True)
+        self.assertEqual(cache.get_generation(), '5.True')
+        self.assertEqual(cursor.execute.call_args[0][0], cache.GENERATION_SQL)
+
+    @patch.object(cache, 'connection')
+    def test_invalidate_should_bump_sequence(self, connection):
+        cache.invalidate_topology_cache()
+        cursor = connection.cursor.return_value
+        cursor.execute.assert_called_once_with(cache.INVALIDATE_SQL)
+
+    def test_topology_should_only_be_built_once_per_generation(self):
+        build = Mock(side_effect=lambda: {'json': 'foo'})
+        cache.get_topology(2, build, '1.True')
+        self.assertEqual(cache.get_topology(2, build, '1.True')['json'],
+                         'foo')
+        self.assertEqual(build.call_count, 1)
+
+        cache.get_topology(3, build, '1.True')
+        self.assertEqual(build.call_count, 2)
+
+        cache.get_topology(2, build, '2.True')
+        self.assertEqual(build.call_count, 3)
+
+    def test_rebuilt_topology_should_get_new_digest(self):
+        digest = cache.get_topology(2, lambda: {'json': {'a': 1}},
+                                    '1.True')['digest']
+        cache.cache.clear()  # as if the cached topology had expired
+        self.assertEqual(cache.get_topology(2, lambda: {'json': {'a': 1}},
+                                            '1.True')['digest'], digest)
+        cache.cache.clear()
+        self.assertNotEqual(cache.get_topology(2, lambda: {'json': {'a': 2}},
+                                               '1.True')['digest'], digest)
+
+    def test_etag_should_depend_on_all_parts(self):
+        self.assertEqual(cache.make_etag('a', 2, [(1, 2, 3)]),
+                         cache.make_etag('a', 2, [(1, 2, 3)]))
+        self.assertNotEqual(cache.make_etag('a', 2, [(1, 2, 3)]),
+                            cache.make_etag('a', 2, [(1, 2, 4)]))
+
+
+class OverlayTest(unittest.TestCase):
+    def test_positions_should_be_set_on_netbox_nodes(self):
+        nodes = make_topology()['json']['nodes']
+        views._overlay_node_positions(nodes, [(1, 10, 20), (2, 5, 5),
+                                              (3, 1, 1)])
+        self.assertEqual(nodes[u'1']['position'], {'x': 10, 'y': 20})
+        self.assertFalse('position' in nodes[u'2'])
+
+    def test_status_should_default_to_up(self):
+        nodes = make_topology()['json']['nodes']
+        views._overlay_netbox_status(nodes, {})
+        self.assertEqual(nodes[u'1']['up'], 'y')
+        views._overlay_netbox_status(nodes, {1: 'n'})
+        self.assertEqual(nodes[u'1']['up'], 'n')
+        self.assertFalse('up' in nodes[u'2'])
+
+    @patch.object(views, 'get_traffic_data')
+    @patch.object(views.Interface, 'objects')
+    def test_traffic_should_be_set_on_edges_by_path(self, objects,
+                                                    get_traffic_data):
+        interface = Mock()
+        objects.select_related.return_value.in_bulk.return_value = {
+            10: interface}
+        get_traffic_data.return_value.to_json.return_value = 'traffic'
+        topology = make_topology()
+        links = topology['json']['links']
+
+        views._overlay_traffic(links, topology['port_pairs'])
+        get_traffic_data.assert_called_once_with((interface, None))
+        self.assertEqual(links[0]['edges'][0]['traffic'], 'traffic')
+
+
+class GraphResponseTest(unittest.TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.patches = [
+            patch.object(views, 'get_topology', return_value=make_topology()),
+            patch.object(views, '_get_netbox_status', return_value={}),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+
+    def test_response_should_have_etag(self):
+        response = views.api_graph_layer_2(self.factory.get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+
+    def test_unchanged_topology_should_not_be_modified(self):
+        etag = views.api_graph_layer_2(self.factory.get('/'))['ETag']
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=etag)
+        response = views.api_graph_layer_2(request)
+        self.assertEqual(response.status_code, 304)
+
+    def test_rebuilt_topology_should_change_etag(self):
+        etag = views.api_graph_layer_2(self.factory.get('/'))['ETag']
+        topology = make_topology()
+        topology['digest'] = 'rebuilt'
+        views.get_topology.return_value = topology
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=etag)
+        response = views.api_graph_layer_2(request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changed_status_should_change_etag(self):
+        etag = views.api_graph_layer_2(self.factory.get('/'))['ETag']
+        views._get_netbox_status.return_value = {1: 'n'}
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=etag)
+        response = views.api_graph_layer_2(request)
+        self.assertEqual(response.status_code, 200)
+
+    @patch.object(views, '_overlay_traffic')
+    def test_traffic_response_should_not_have_etag(self, _overlay_traffic):
+        response = views.api_graph_layer_3(self.factory.get('/?traffic'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertTrue(_overlay_traffic.called)
+
+    def test_filters_should_prune_topology(self):
+        request = self.factory.get('/?categories=GW,SW')
+        response = views.api_graph_layer_2(request)
+        json = simplejson.loads(response.content)
+        self.assertEqual(json['nodes'].keys(), [u'1'])
+
+    def test_filters_should_change_etag(self):
+        etag = views.api_graph_layer_2(self.factory.get('/'))['ETag']
+        request = self.factory.get('/?categories=GW', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(views.api_graph_layer_2(request).status_code, 200)
+
+    def test_unknown_focus_should_be_bad_request(self):
+        request = self.factory.get('/?focus=nonexistent')
+        self.assertEqual(views.api_graph_layer_2(request).status_code, 400)
+
+    def test_invalid_depth_should_be_bad_request(self):
+        request = self.factory.get('/?focus=1&depth=far')
+        self.assertEqual(views.api_graph_layer_2(request).status_code, 400)
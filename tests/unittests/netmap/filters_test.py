@@ -0,0 +1,117 @@
+import unittest
+
+from nav.netmap.filters import filter_topology, get_neighbourhood, find_node
+
+
+def make_node(node_id, category='SW', location='lab', vlans=(),
+              is_elink_node=False):
+    return {'id': node_id, 'sysname': 'sw%s' % node_id, 'category': category,
+            'locationid': location, 'vlans': list(vlans),
+            'is_elink_node': is_elink_node}
+
+
+def make_link(source, target, vlans=()):
+    return {'source': source, 'target': target, 'vlans': list(vlans),
+            'edges': [{'traffic': None}]}
+
+
+def make_topology():
+    """Makes a layer 2 topology of the chain gw1 - 2 - 3 - 4, with an elink
+    node 5 connected to 4.
+
+    """
+    return {
+        'json': {
+            'vlans': {10: {'nav_vlan': 10}, 20: {'nav_vlan': 20}},
+            'nodes': {
+                u'1': make_node(u'1', category='GW', location='core'),
+                u'2': make_node(u'2', vlans=[10]),
+                u'3': make_node(u'3'),
+                u'4': make_node(u'4', vlans=[20]),
+                u'5': make_node(u'5', category='', location=None,
+                                is_elink_node=True),
+            },
+            'links': [
+                make_link(u'1', u'2', vlans=[10]),
+                make_link(u'2', u'3'),
+                make_link(u'3', u'4', vlans=[20]),
+                make_link(u'4', u'5'),
+            ],
+        },
+        'port_pairs': [((index, 'edges', 0), (index, None))
+                       for index in range(4)],
+    }
+
+
+class FilterTopologyTest(unittest.TestCase):
+    def test_no_filters_should_keep_everything(self):
+        topology = make_topology()
+        self.assertEqual(filter_topology(topology), topology)
+
+    def test_should_keep_only_links_between_matching_categories(self):
+        result = filter_topology(make_topology(), categories=['SW'])
+        json = result['json']
+        self.assertEqual(sorted(json['nodes']), [u'2', u'3', u'4'])
+        self.assertEqual([(l['source'], l['target']) for l in json['links']],
+                         [(u'2', u'3'), (u'3', u'4')])
+        self.assertEqual(sorted(json['vlans']), [10, 20])
+
+    def test_should_renumber_port_pair_paths(self):
+        result = filter_topology(make_topology(), categories=['SW'])
+        self.assertEqual(result['port_pairs'],
+                         [((0, 'edges', 0), (1, None)),
+                          ((1, 'edges', 0), (2, None))])
+
+    def test_elink_nodes_should_follow_their_links(self):
+        result = filter_topology(make_topology(), locations=['core'])
+        self.assertEqual(sorted(result['json']['nodes']), [u'1'])
+
+        result = filter_topology(make_topology(), categories=['SW', 'ELINK'])
+        self.assertTrue(u'5' in result['json']['nodes'])
+
+    def test_focus_should_keep_neighbourhood(self):
+        result = filter_topology(make_topology(), focus=u'2', depth=1)
+        json = result['json']
+        self.assertEqual(sorted(json['nodes']), [u'1', u'2', u'3'])
+        self.assertEqual(len(json['links']), 2)
+        self.assertEqual(sorted(json['vlans']), [10])
+
+    def test_filters_should_not_modify_base_topology(self):
+        topology = make_topology()
+        filter_topology(topology, categories=['GW'])
+        self.assertEqual(topology, make_topology())
+
+    def test_layer3_vlans_should_be_found_from_link_edges(self):
+        topology = {
+            'json': {
+                'vlans': [{'nav_vlan': 10}, {'nav_vlan': 20}],
+                'nodes': {u'1': make_node(u'1'), u'2': make_node(u'2'),
+                          u'3': make_node(u'3', category='GW')},
+                'links': [{'source': u'1', 'target': u'2',
+                           'edges': {10: []}},
+                          {'source': u'2', 'target': u'3',
+                           'edges': {20: []}}],
+            },
+            'port_pairs': [],
+        }
+        result = filter_topology(topology, categories=['SW'])
+        self.assertEqual(result['json']['vlans'], [{'nav_vlan': 10}])
+
+
+class NeighbourhoodTest(unittest.TestCase):
+    def setUp(self):
+        self.links = make_topology()['json']['links']
+
+    def test_depth_zero_should_only_find_focus(self):
+        self.assertEqual(get_neighbourhood(self.links, u'3', 0),
+                         set([u'3']))
+
+    def test_should_find_nodes_within_depth(self):
+        self.assertEqual(get_neighbourhood(self.links, u'1', 2),
+                         set([u'1', u'2', u'3']))
+
+    def test_should_find_node_by_id_or_sysname(self):
+        nodes = make_topology()['json']['nodes']
+        self.assertEqual(find_node(nodes, u'3'), u'3')
+        self.assertEqual(find_node(nodes, 'sw4'), u'4')
+        self.assertTrue(find_node(nodes, 'nonexistent') is None)
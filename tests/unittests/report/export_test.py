@@ -0,0 +1,91 @@
+import json
+import unittest
+from mock import Mock, patch
+
+from nav.report import dbresult
+from nav.report.generator import ReportConfig
+from nav.report.report import ExportFormatter, Cell
+from nav.web.report.views import stream_csv, stream_json
+
+
+def make_config():
+    config = ReportConfig()
+    config.sql = "SELECT sysname, ip, up FROM netbox"
+    config.sql_select = ['sysname', 'ip', 'up']
+    config.hidden = ['up']
+    config.extra = ['link']
+    config.name = {'sysname': 'Name'}
+    return config
+
+
+ROWS = [('foo', '10.0.0.1', 'y'), ('bar', None, 'n')]
+
+
+class ExportFormatterTest(unittest.TestCase):
+    def test_should_show_same_columns_as_report_table(self):
+        formatter = ExportFormatter(make_config())
+        self.assertEqual(formatter.headers, [u'Name', u'ip', u'link'])
+        self.assertEqual(formatter.format_row(ROWS[0]),
+                         [u'foo', u'10.0.0.1', u'link'])
+
+    def test_should_keep_numbers_as_values(self):
+        config = make_config()
+        config.sql_select = ['sysname', 'count']
+        formatter = ExportFormatter(config)
+        self.assertEqual(formatter.format_values(('foo', 5)),
+                         [u'foo', 5, u'link'])
+
+
+class StreamExportTest(unittest.TestCase):
+    def test_csv_should_be_written_in_batches(self):
+        formatter = ExportFormatter(make_config())
+        chunks = list(stream_csv(ROWS, formatter, ';', batch_size=1))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks),
+                         'Name;ip;link\r\nfoo;10.0.0.1;link\r\nbar;;link\r\n')
+
+    def test_json_should_be_a_list_of_objects(self):
+        formatter = ExportFormatter(make_config())
+        content = ''.join(stream_json(ROWS, formatter, batch_size=1))
+        self.assertEqual(json.loads(content), [
+            {'sysname': 'foo', 'ip': '10.0.0.1', 'link': 'link'},
+            {'sysname': 'bar', 'ip': None, 'link': 'link'},
+        ])
+
+    def test_empty_json_result_should_be_an_empty_list(self):
+        formatter = ExportFormatter(make_config())
+        self.assertEqual(''.join(stream_json([], formatter)), '[]')
+
+
+class StreamedResultTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Mock()
+        self.cursor = self.connection.cursor.return_value
+        self.cursor.description = [('sysname',), ('ip',)]
+        batches = [[('a', 1), ('b', 2)], [('c', 3)]]
+        self.cursor.fetchmany.side_effect = lambda size: (
+            batches.pop(0) if batches else [])
+
+    @patch.object(dbresult.db, 'getConnection')
+    def test_should_fetch_rows_in_batches(self, get_connection):
+        get_connection.return_value = self.connection
+        config = make_config()
+        result = dbresult.StreamedResult(config, batch_size=2)
+        self.assertEqual(config.sql_select, ['sysname', 'ip'])
+        self.assertEqual(self.cursor.fetchmany.call_count, 1)
+
+        self.assertEqual([row[0] for row in result], ['a', 'b', 'c'])
+        self.assertEqual(self.cursor.fetchmany.call_count, 2)
+        self.assertTrue(self.cursor.close.called)
+
+    @patch.object(dbresult.db, 'getConnection')
+    def test_should_use_named_cursor(self, get_connection):
+        get_connection.return_value = self.connection
+        dbresult.StreamedResult(make_config())
+        name = self.connection.cursor.call_args[0][0]
+        self.assertTrue(name.startswith('report_'))
+
+
+class CellTest(unittest.TestCase):
+    def test_cell_should_not_have_instance_dict(self):
+        self.assertFalse(hasattr(Cell(u'foo'), '__dict__'))
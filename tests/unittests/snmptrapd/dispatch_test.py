@@ -0,0 +1,82 @@
+from unittest import TestCase
+from Queue import Queue
+from mock import Mock
+
+from nav.snmptrapd.dispatch import (TrapDispatcher, TrapPriorities, get_batch,
+                                    HIGH, NORMAL, LOW)
+
+LINKDOWN = '.1.3.6.1.6.3.1.1.5.3'
+UPS_ON_BATTERY = '.1.3.6.1.4.1.318.0.5'
+
+
+class TrapPrioritiesTest(TestCase):
+    def setUp(self):
+        self.priorities = TrapPriorities(high=['.1.3.6.1.4.1.318'],
+                                         low=['1.3.6.1.6.3.1.1.5', ''])
+
+    def test_matching_high_prefix_should_give_high_priority(self):
+        self.assertEqual(self.priorities.get_priority(UPS_ON_BATTERY), HIGH)
+
+    def test_matching_low_prefix_should_give_low_priority(self):
+        self.assertEqual(self.priorities.get_priority(LINKDOWN), LOW)
+
+    def test_unmatched_oid_should_give_normal_priority(self):
+        self.assertEqual(self.priorities.get_priority('.1.3.6.1.4.1.9.0.1'),
+                         NORMAL)
+
+    def test_partial_oid_element_should_not_match(self):
+        self.assertEqual(self.priorities.get_priority('.1.3.6.1.4.1.3180.0'),
+                         NORMAL)
+
+    def test_longest_prefix_should_win(self):
+        priorities = TrapPriorities(high=['.1.3.6.1.4.1.318.0.5'],
+                                    low=['.1.3.6.1.4.1.318'])
+        self.assertEqual(priorities.get_priority(UPS_ON_BATTERY), HIGH)
+        self.assertEqual(priorities.get_priority('.1.3.6.1.4.1.318.0.9'), LOW)
+
+
+class TrapDispatcherTest(TestCase):
+    def setUp(self):
+        self.queue = Queue(10)
+        self.dispatcher = TrapDispatcher(
+            Mock(), queue_size=10, queue=self.queue,
+            priorities=TrapPriorities(high=[UPS_ON_BATTERY], low=[LINKDOWN]))
+
+    def _receive(self, oid, count=1):
+        for _ in range(count):
+            self.dispatcher.receive(Mock(snmpTrapOID=oid, agent='10.0.0.1'))
+
+    def test_received_traps_should_be_queued(self):
+        self._receive('.1.3.6.1.4.1.9.0.1', 3)
+        self.assertEqual(self.queue.qsize(), 3)
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats['received'], 3)
+        self.assertEqual(stats['queued'], 3)
+        self.assertEqual(stats['dropped'], 0)
+
+    def test_low_priority_traps_should_be_shed_at_half_capacity(self):
+        self._receive(LINKDOWN, 8)
+        self.assertEqual(self.queue.qsize(), 5)
+        self.assertEqual(self.dispatcher.get_stats()['dropped_low'], 3)
+
+    def test_normal_priority_traps_should_be_shed_at_90_percent(self):
+        self._receive('.1.3.6.1.4.1.9.0.1', 10)
+        self.assertEqual(self.queue.qsize(), 9)
+        self.assertEqual(self.dispatcher.get_stats()['dropped_normal'], 1)
+
+    def test_high_priority_traps_should_fill_queue(self):
+        self._receive('.1.3.6.1.4.1.9.0.1', 9)
+        self._receive(UPS_ON_BATTERY, 2)
+        self.assertEqual(self.queue.qsize(), 10)
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats['dropped_high'], 1)
+        self.assertEqual(stats['dropped'], 1)
+
+
+class GetBatchTest(TestCase):
+    def test_should_not_get_more_than_batch_size(self):
+        queue = Queue()
+        for item in range(5):
+            queue.put(item)
+        self.assertEqual(get_batch(queue, 3), [0, 1, 2])
+        self.assertEqual(get_batch(queue, 3), [3, 4])
@@ -0,0 +1,68 @@
+from unittest import TestCase
+from mock import patch, Mock
+
+from nav.snmptrapd.lookup import TrapLookupCache, NetboxInfo, InterfaceInfo
+
+
+class TrapLookupCacheTest(TestCase):
+    def setUp(self):
+        self.cursor = Mock()
+        connection = Mock()
+        connection.cursor.return_value = self.cursor
+        self.patcher = patch('nav.snmptrapd.lookup.getConnection',
+                             return_value=connection)
+        self.patcher.start()
+        self.cache = TrapLookupCache(max_netboxes=2)
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_should_find_netbox_from_bulk_load(self):
+        self.cursor.fetchall.return_value = [('10.0.0.1', 1, 'a', 'r1'),
+                                             ('10.0.0.2', 2, 'b', 'r2')]
+        self.assertEqual(self.cache.get_netbox('10.0.0.2'),
+                         NetboxInfo(2, 'b', 'r2'))
+
+    def test_should_not_query_database_for_known_netbox(self):
+        self.cursor.fetchall.return_value = [('10.0.0.1', 1, 'a', 'r1')]
+        self.cache.get_netbox('10.0.0.1')
+        self.cache.get_netbox('10.0.0.1')
+        self.assertEqual(self.cursor.execute.call_count, 1)
+
+    def test_should_only_retry_unknown_agent_once_per_interval(self):
+        self.cursor.fetchall.return_value = []
+        self.cursor.fetchone.return_value = None
+        self.assertTrue(self.cache.get_netbox('10.0.0.9') is None)
+        self.assertTrue(self.cache.get_netbox('10.0.0.9') is None)
+        # one bulk load, one single lookup on the first miss
+        self.assertEqual(self.cursor.execute.call_count, 2)
+
+    def test_should_find_new_netbox_on_miss(self):
+        self.cursor.fetchall.return_value = []
+        self.cursor.fetchone.return_value = ('10.0.0.3', 3, 'c', 'r3')
+        self.assertEqual(self.cache.get_netbox('10.0.0.3'),
+                         NetboxInfo(3, 'c', 'r3'))
+
+    def test_should_find_interface_by_string_ifindex(self):
+        self.cursor.fetchall.return_value = [(5, 50, 7, 'mod', 'Gi0/5', '')]
+        self.assertEqual(self.cache.get_interface(1, '5'),
+                         InterfaceInfo(50, 7, 'mod', 'Gi0/5', ''))
+
+    def test_should_not_query_known_interfaces_twice(self):
+        self.cursor.fetchall.return_value = [(5, 50, 7, 'mod', 'Gi0/5', '')]
+        self.cache.get_interface(1, 5)
+        self.cache.get_interface(1, 5)
+        self.assertEqual(self.cursor.execute.call_count, 1)
+
+    def test_should_only_reload_interfaces_once_on_repeated_miss(self):
+        self.cursor.fetchall.return_value = [(5, 50, 7, 'mod', 'Gi0/5', '')]
+        self.cache.get_interface(1, 5)
+        self.cache.get_interface(1, 6)
+        self.cache.get_interface(1, 6)
+        self.assertEqual(self.cursor.execute.call_count, 2)
+
+    def test_should_evict_least_recently_used_netbox(self):
+        self.cursor.fetchall.return_value = []
+        for netboxid in (1, 2, 1, 3):
+            self.cache.get_interface(netboxid, 1)
+        self.assertEqual(list(self.cache._interfaces.keys()), [1, 3])
@@ -5,8 +5,7 @@ from nav.snmptrapd.handlers import weathergoose as wg
 
 class WeatherGooseMockedDb(TestCase):
     def setUp(self):
-        self.getConnection = patch('nav.snmptrapd.handlers.weathergoose'
-                                   '.getConnection')
+        self.getConnection = patch('nav.snmptrapd.lookup.getConnection')
         self.getConnection.start()
 
     def tearDown(self):
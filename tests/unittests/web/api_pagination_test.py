@@ -0,0 +1,88 @@
+from datetime import datetime
+import unittest
+from mock import Mock
+
+from nav.models.manage import Cam, Netbox
+from nav.web.api.v1 import pagination
+from nav.web.api.v1.serializers import CamSerializer
+
+
+def make_request(**params):
+    return Mock(QUERY_PARAMS=params)
+
+
+class CursorTest(unittest.TestCase):
+    def test_cursor_should_round_trip(self):
+        key = [datetime(2014, 5, 1, 12, 0, 0, 5), 42]
+        cursor = pagination.encode_cursor(key)
+        self.assertEqual(pagination.decode_cursor(cursor),
+                         ['2014-05-01T12:00:00.000005', 42])
+
+    def test_empty_cursor_should_be_first_page(self):
+        self.assertTrue(pagination.decode_cursor('') is None)
+
+    def test_invalid_cursor_should_raise_value_error(self):
+        self.assertRaises(ValueError, pagination.decode_cursor, 'garbage')
+
+
+class KeysetTest(unittest.TestCase):
+    def test_order_should_end_with_primary_key(self):
+        self.assertEqual(pagination.get_keyset_order(Cam, 'start_time'),
+                         ('start_time', 'id'))
+        self.assertEqual(pagination.get_keyset_order(Cam, 'id'), ('id',))
+
+    def test_should_compare_row_values_after_key(self):
+        queryset = pagination.filter_after(
+            Cam.objects.all(), ('start_time', 'id'),
+            ['2014-05-01T12:00:00', 42])
+        sql = str(queryset.query)
+        self.assertTrue('("cam"."start_time", "cam"."camid") > ' in sql, sql)
+
+    def test_infinite_time_should_be_compared_as_infinity(self):
+        queryset = pagination.filter_after(
+            Cam.objects.all(), ('end_time', 'id'),
+            [datetime.max.isoformat(), 42])
+        extra_where = queryset.query.where.children[0]
+        self.assertEqual(extra_where.params[0], u'infinity')
+
+    def test_should_raise_value_error_on_mismatched_cursor(self):
+        self.assertRaises(ValueError, pagination.filter_after,
+                          Cam.objects.all(), ('start_time', 'id'), [42])
+
+    def test_should_detect_next_page_from_extra_row(self):
+        rows = [Mock(id=i) for i in range(3)]
+        queryset = Mock()
+        queryset.order_by.return_value = rows
+        page, next_key = pagination.get_keyset_page(queryset, ('id',), None,
+                                                    2)
+        self.assertEqual(page, rows[:2])
+        self.assertEqual(next_key, [1])
+
+    def test_last_page_should_have_no_next_key(self):
+        queryset = Mock()
+        queryset.order_by.return_value = [Mock(id=1)]
+        _page, next_key = pagination.get_keyset_page(queryset, ('id',), None,
+                                                     2)
+        self.assertTrue(next_key is None)
+
+
+class ProjectionTest(unittest.TestCase):
+    def test_should_only_select_requested_fields(self):
+        queryset = pagination.project_queryset(
+            Cam.objects.all(), set(['mac', 'bogus']), ('start_time',))
+        deferred, _ = queryset.query.deferred_loading
+        self.assertEqual(set(deferred), set(['mac', 'start_time']))
+
+    def test_should_prefetch_many_to_many_fields(self):
+        queryset = pagination.project_queryset(Netbox.objects.all(), None)
+        self.assertEqual(queryset._prefetch_related_lookups,
+                         ['netboxgroups'])
+
+    def test_serializer_should_drop_unrequested_fields(self):
+        request = make_request(fields='mac,netbox')
+        serializer = CamSerializer(context={'request': request})
+        self.assertEqual(sorted(serializer.fields.keys()), ['mac', 'netbox'])
+
+    def test_serializer_should_keep_all_fields_by_default(self):
+        serializer = CamSerializer(context={'request': make_request()})
+        self.assertTrue(len(serializer.fields) > 2)
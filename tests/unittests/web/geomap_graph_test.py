@@ -0,0 +1,79 @@
+import random
+import unittest
+from math import sqrt
+
+from nav.web.geomap.graph import Graph, Node, create_places
+from nav.web.geomap.utils import avg
+
+BOUNDS = {'minLon': 0.0, 'maxLon': 10.0, 'minLat': 50.0, 'maxLat': 60.0}
+VIEWPORT = {'width': 1000, 'height': 500}
+
+
+def make_graph(positions):
+    graph = Graph()
+    for index, (lon, lat) in enumerate(positions):
+        graph.add_node(Node(index, lon, lat,
+                            {'id': index, 'load': 0, 'num_netboxes': 1}))
+    return graph
+
+
+def make_random_positions(count, seed=0):
+    rand = random.Random(seed)
+    return [(rand.uniform(0, 10), rand.uniform(50, 60))
+            for _ in xrange(count)]
+
+
+def get_places(graph):
+    return sorted(sorted(room['id'] for room in node.properties['rooms'])
+                  for node in graph.nodes.values())
+
+
+def quadratic_places(graph, limit):
+    """The original pairwise clustering, as a reference"""
+    lon_scale = VIEWPORT['width'] / (BOUNDS['maxLon'] - BOUNDS['minLon'])
+    lat_scale = VIEWPORT['height'] / (BOUNDS['maxLat'] - BOUNDS['minLat'])
+
+    def distance(node1, node2):
+        return sqrt(((node1.lon - node2.lon) * lon_scale) ** 2 +
+                    ((node1.lat - node2.lat) * lat_scale) ** 2)
+
+    places = []
+    for node in graph.nodes.values():
+        for place in places:
+            if distance(node, place['position']) < limit:
+                place['rooms'].append(node)
+                place['position'].lon = avg([n.lon for n in place['rooms']])
+                place['position'].lat = avg([n.lat for n in place['rooms']])
+                break
+        else:
+            places.append({'position': Node(None, node.lon, node.lat, None),
+                           'rooms': [node]})
+    return sorted(sorted(room.id for room in place['rooms'])
+                  for place in places)
+
+
+class CreatePlacesTest(unittest.TestCase):
+    def test_close_rooms_should_be_combined(self):
+        graph = make_graph([(1.0, 55.0), (1.01, 55.01), (5.0, 55.0)])
+        create_places(graph, BOUNDS, VIEWPORT, 10)
+        self.assertEqual(get_places(graph), [[0, 1], [2]])
+
+    def test_place_should_be_positioned_at_average_of_rooms(self):
+        graph = make_graph([(1.0, 55.0), (1.02, 55.02)])
+        create_places(graph, BOUNDS, VIEWPORT, 10)
+        place = graph.nodes.values()[0]
+        self.assertAlmostEqual(place.lon, 1.01)
+        self.assertAlmostEqual(place.lat, 55.01)
+
+    def test_zero_limit_should_not_combine_rooms(self):
+        graph = make_graph([(1.0, 55.0), (1.0, 55.0)])
+        create_places(graph, BOUNDS, VIEWPORT, 0)
+        self.assertEqual(len(graph.nodes), 2)
+
+    def test_should_match_pairwise_clustering(self):
+        positions = make_random_positions(2000)
+        for limit in (5, 30, 100):
+            expected = quadratic_places(make_graph(positions), limit)
+            graph = make_graph(positions)
+            create_places(graph, BOUNDS, VIEWPORT, limit)
+            self.assertEqual(get_places(graph), expected)
@@ -0,0 +1,118 @@
+import math
+import unittest
+from django.core.cache import get_cache
+from mock import Mock, patch
+
+from nav.metrics.errors import GraphiteUnreachableError
+from nav.web.geomap import db
+
+INTERVAL = {'start': '-10min', 'end': 'now'}
+
+
+def octets_target(sysname, ifname, counter):
+    return ('scaleToSeconds(nonNegativeDerivative(scale('
+            'nav.devices.%s.ports.%s.%s,8)),1)' % (sysname, ifname, counter))
+
+
+def fake_averages(targets, start, end):
+    return dict((target, 2e6 if 'ifInOctets' in target else 4e6)
+                for target in targets)
+
+
+def cpu_series(sysname, cpu, kind, values):
+    return {'target': 'nav.devices.%s.cpu.%s.%s' % (sysname, cpu, kind),
+            'datapoints': [(value, 0) for value in values]}
+
+
+def make_graph(edge_ids, node_ids):
+    graph = Mock()
+    graph.edges = dict((edge_id, Mock(id=edge_id, reverse_id=reverse_id))
+                       for edge_id, reverse_id in edge_ids)
+    graph.nodes = dict((node_id, Mock()) for node_id in node_ids)
+    return graph
+
+
+class MetricLoaderTest(unittest.TestCase):
+    def setUp(self):
+        cache = get_cache('locmem://')
+        cache.clear()
+        self.patches = [
+            patch.object(db, 'cache', cache),
+            patch.object(db, 'get_metric_average',
+                         side_effect=fake_averages),
+            patch.object(db, 'get_metric_data', return_value=[]),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+        self.loader = self._make_loader()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+
+    def _make_loader(self):
+        loader = db.MetricLoader(INTERVAL)
+        for index in range(3):
+            loader.add_link('a-%d' % index, 'a', 'ge%d' % index)
+            loader.add_link('%d-a' % index, 'sw%d' % index, 'ge0')
+        loader.add_netbox(1, 'a')
+        loader.add_netbox(2, 'b')
+        return loader
+
+    def test_should_fetch_graph_links_in_one_request(self):
+        self.loader.load_graph(make_graph([('a-0', '0-a'), ('a-1', '1-a')],
+                                          []))
+        self.assertEqual(db.get_metric_average.call_count, 1)
+        targets = db.get_metric_average.call_args[0][0]
+        self.assertEqual(len(targets), 8)
+        self.assertTrue(octets_target('a', 'ge0', 'ifInOctets') in targets)
+
+        self.assertEqual(self.loader.get_link_load('a-0'), (2.0, 4.0))
+        self.assertEqual(db.get_metric_average.call_count, 1)
+
+    def test_unloaded_link_should_be_fetched_on_demand(self):
+        self.assertEqual(self.loader.get_link_load('a-2'), (2.0, 4.0))
+        self.assertEqual(len(db.get_metric_average.call_args[0][0]), 2)
+
+    def test_should_split_requests(self):
+        with patch.object(db, 'MAX_TARGETS_PER_REQUEST', 4):
+            self.loader.load(link_ids=['a-0', 'a-1', 'a-2'])
+        self.assertEqual(db.get_metric_average.call_count, 2)
+
+    def test_values_should_be_reused_by_later_requests(self):
+        self.loader.load(link_ids=['a-0'], netboxids=[1])
+        loader = self._make_loader()
+        loader.load(link_ids=['a-0'], netboxids=[1])
+        self.assertEqual(loader.get_link_load('a-0'), (2.0, 4.0))
+        self.assertEqual(db.get_metric_average.call_count, 1)
+        self.assertEqual(db.get_metric_data.call_count, 2)
+
+    def test_unreachable_graphite_should_give_nan_and_not_be_cached(self):
+        db.get_metric_average.side_effect = GraphiteUnreachableError(
+            'graphite is unreachable', None)
+        load = self.loader.get_link_load('a-0')
+        self.assertTrue(all(math.isnan(value) for value in load))
+
+        db.get_metric_average.side_effect = fake_averages
+        self.assertEqual(self._make_loader().get_link_load('a-0'),
+                         (2.0, 4.0))
+
+    def test_should_pick_cpu_with_highest_max(self):
+        db.get_metric_data.return_value = [
+            cpu_series('a', 'cpu1', 'loadavg5min', [10, 20]),
+            cpu_series('a', 'cpu2', 'loadavg5min', [5, 30, None]),
+        ]
+        self.assertEqual(self.loader.get_cpu_load(1), 17.5)
+        self.assertEqual(db.get_metric_data.call_count, 1)
+
+    def test_cpu_utilization_should_be_fallback(self):
+        def fake_data(targets, start, end):
+            if 'utilization' in targets[0]:
+                return [cpu_series('a', 'cpu1', 'utilization', [50])]
+            return [cpu_series('a', 'cpu1', 'loadavg5min', [None])]
+        db.get_metric_data.side_effect = fake_data
+
+        self.loader.load(netboxids=[1, 2])
+        self.assertEqual(self.loader.get_cpu_load(1), 50)
+        self.assertTrue(math.isnan(self.loader.get_cpu_load(2)))
+        self.assertEqual(db.get_metric_data.call_count, 2)
@@ -0,0 +1,114 @@
+import threading
+import time
+import unittest
+from mock import patch
+
+from nav.web.graphite import proxy
+from nav.web.graphite.proxy import GraphiteProxy, ProxyResponse
+
+NOW = 1400000000
+
+
+class DictCache(dict):
+    def set(self, key, value, timeout):
+        self[key] = value
+
+
+class NormalizeQueryTest(unittest.TestCase):
+    def test_should_sort_parameters(self):
+        self.assertEqual(
+            proxy.normalize_query([('target', 'b'), ('from', '-1h'),
+                                   ('target', 'a')]),
+            [('from', '-1h'), ('target', 'a'), ('target', 'b')])
+
+    def test_should_remove_cache_busting_parameters(self):
+        self.assertEqual(
+            proxy.normalize_query([('target', 'a'), ('_', '1400000000')]),
+            [('target', 'a')])
+
+
+class GetTtlTest(unittest.TestCase):
+    def test_short_live_window_should_get_min_ttl(self):
+        self.assertEqual(proxy.get_ttl([('from', '-10min')], NOW),
+                         proxy.MIN_TTL)
+
+    def test_long_live_window_should_get_max_ttl(self):
+        self.assertEqual(proxy.get_ttl([('from', '-1w')], NOW),
+                         proxy.MAX_TTL)
+
+    def test_live_window_ttl_should_scale_with_window(self):
+        self.assertEqual(proxy.get_ttl([('from', '-3h')], NOW), 108)
+
+    def test_historic_window_should_get_historic_ttl(self):
+        params = [('from', '-2d'), ('until', '-1d')]
+        self.assertEqual(proxy.get_ttl(params, NOW), proxy.HISTORIC_TTL)
+
+    def test_absolute_window_should_be_parsed(self):
+        params = [('from', str(NOW - 7200)), ('until', str(NOW - 3600))]
+        self.assertEqual(proxy.get_ttl(params, NOW), proxy.HISTORIC_TTL)
+
+    def test_unparseable_window_should_get_default_ttl(self):
+        self.assertEqual(proxy.get_ttl([('from', 'yesterday')], NOW),
+                         proxy.DEFAULT_TTL)
+
+
+class GraphiteProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = DictCache()
+        self.cache_patch = patch.object(proxy, 'cache', self.cache)
+        self.cache_patch.start()
+        self.proxy = GraphiteProxy('http://localhost:8000/')
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
+    def test_should_cache_render_responses(self):
+        response = ProxyResponse(200, 'image/png', 'PNG', None)
+        with patch.object(self.proxy, '_fetch',
+                          return_value=response) as fetch:
+            self.proxy.request('GET', 'render/', [('target', 'a')])
+            result = self.proxy.request('GET', 'render/',
+                                        [('target', 'a'), ('_', '1')])
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(result.body, 'PNG')
+
+    def test_should_not_cache_errors(self):
+        response = ProxyResponse(500, 'text/html', 'oops', None)
+        with patch.object(self.proxy, '_fetch',
+                          return_value=response) as fetch:
+            self.proxy.request('GET', 'render/', [('target', 'a')])
+            self.proxy.request('GET', 'render/', [('target', 'a')])
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_should_not_cache_streamed_responses(self):
+        response = ProxyResponse(200, 'image/png', None, iter(['PNG']))
+        with patch.object(self.proxy, '_fetch',
+                          return_value=response) as fetch:
+            self.proxy.request('GET', 'render/', [('target', 'a')])
+            self.proxy.request('GET', 'render/', [('target', 'a')])
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_should_coalesce_identical_in_flight_requests(self):
+        response = ProxyResponse(200, 'image/png', 'PNG', None)
+        calls = []
+
+        def _slow_fetch(*args):
+            calls.append(args)
+            time.sleep(0.2)
+            return response
+
+        results = []
+
+        def _request():
+            results.append(self.proxy.request('GET', 'metrics/find',
+                                              [('query', 'nav.*')]))
+
+        with patch.object(self.proxy, '_fetch', side_effect=_slow_fetch):
+            threads = [threading.Thread(target=_request) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.body for r in results], ['PNG'] * 3)
@@ -0,0 +1,51 @@
+import unittest
+from mock import patch
+
+from nav import asyncdns
+from nav.util import TimedLRUCache
+from nav.web.machinetracker import utils
+
+
+class ReverseLookupTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_patch = patch.object(utils, '_dns_cache', TimedLRUCache())
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+
+    @patch('nav.asyncdns.reverse_lookup')
+    def test_should_resolve_all_addresses_at_once(self, lookup):
+        lookup.return_value = {
+            '10.0.0.1': ['a.example.org'],
+            '10.0.0.2': [],
+            '10.0.0.3': asyncdns.DNSNameError(),
+        }
+        result = utils.reverse_lookup(['10.0.0.1', '10.0.0.2', '10.0.0.3',
+                                       '10.0.0.1'])
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(result, {'10.0.0.1': 'a.example.org',
+                                  '10.0.0.2': '', '10.0.0.3': ''})
+
+    @patch('nav.asyncdns.reverse_lookup')
+    def test_should_only_look_up_uncached_addresses(self, lookup):
+        lookup.return_value = {'10.0.0.1': ['a.example.org']}
+        utils.reverse_lookup(['10.0.0.1'])
+        lookup.return_value = {'10.0.0.2': ['b.example.org']}
+        result = utils.reverse_lookup(['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(lookup.call_args[0][0], ['10.0.0.2'])
+        self.assertEqual(result['10.0.0.1'], 'a.example.org')
+
+    @patch('nav.asyncdns.reverse_lookup')
+    def test_should_not_cache_timed_out_lookups(self, lookup):
+        lookup.return_value = {
+            '10.0.0.1': asyncdns.DNSQueryTimeoutError('10.0.0.1')}
+        self.assertEqual(utils.reverse_lookup(['10.0.0.1']),
+                         {'10.0.0.1': ''})
+        utils.reverse_lookup(['10.0.0.1'])
+        self.assertEqual(lookup.call_count, 2)
+
+    @patch('nav.asyncdns.reverse_lookup')
+    def test_hostname_should_return_false_on_failure(self, lookup):
+        lookup.return_value = {'10.0.0.1': []}
+        self.assertFalse(utils.hostname('10.0.0.1'))
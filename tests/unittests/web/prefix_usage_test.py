@@ -0,0 +1,65 @@
+import unittest
+from IPy import IP
+from mock import patch
+
+from nav.web.api.v1.helpers import prefix_collector
+from nav.web.api.v1.helpers.prefix_collector import (PrefixUsages,
+                                                     count_sorted)
+
+
+class CountSortedTest(unittest.TestCase):
+    def test_should_count_disjoint_prefixes(self):
+        prefixes = [IP('10.0.1.0/24'), IP('10.0.0.0/24')]
+        addresses = ['10.0.0.1', '10.0.0.2', '10.0.1.1', '10.0.2.1']
+        self.assertEqual(count_sorted(prefixes, addresses),
+                         {IP('10.0.0.0/24'): 2, IP('10.0.1.0/24'): 1})
+
+    def test_should_count_addresses_in_all_enclosing_prefixes(self):
+        prefixes = [IP('10.0.0.0/16'), IP('10.0.1.0/24'),
+                    IP('10.0.1.0/25'), IP('10.0.2.0/24')]
+        addresses = ['10.0.0.1', '10.0.1.1', '10.0.1.200', '10.0.2.1',
+                     '10.0.3.1']
+        self.assertEqual(count_sorted(prefixes, addresses), {
+            IP('10.0.0.0/16'): 5,
+            IP('10.0.1.0/24'): 2,
+            IP('10.0.1.0/25'): 1,
+            IP('10.0.2.0/24'): 1,
+        })
+
+    def test_should_separate_address_families(self):
+        prefixes = [IP('10.0.0.0/8'), IP('2001:db8::/64')]
+        addresses = ['10.1.2.3', '2001:db8::1', '2001:db8::2']
+        self.assertEqual(count_sorted(prefixes, addresses),
+                         {IP('10.0.0.0/8'): 1, IP('2001:db8::/64'): 2})
+
+    def test_prefixes_without_addresses_should_count_zero(self):
+        prefixes = [IP('10.0.0.0/24'), IP('10.0.5.0/24')]
+        self.assertEqual(count_sorted(prefixes, ['10.0.9.1']),
+                         {IP('10.0.0.0/24'): 0, IP('10.0.5.0/24'): 0})
+
+
+class PrefixUsagesTest(unittest.TestCase):
+    def setUp(self):
+        self.prefixes = [IP('10.0.%d.0/24' % i) for i in range(10)]
+
+    @patch.object(prefix_collector, 'count_active_addresses')
+    def test_should_only_compute_usage_for_accessed_slice(self, count):
+        count.return_value = {IP('10.0.2.0/24'): 128}
+        usages = PrefixUsages(self.prefixes)
+        self.assertEqual(len(usages), 10)
+        self.assertFalse(count.called)
+
+        page = usages[2:4]
+        self.assertEqual(count.call_count, 1)
+        self.assertEqual(count.call_args[0][0], self.prefixes[2:4])
+        self.assertEqual([usage.active_addresses for usage in page],
+                         [128, 0])
+        self.assertEqual(page[0].usage, 50.0)
+
+    @patch.object(prefix_collector, 'SQL_BATCH_SIZE', 4)
+    @patch.object(prefix_collector, 'count_active_addresses')
+    def test_iteration_should_compute_usage_in_batches(self, count):
+        count.return_value = {}
+        usages = list(PrefixUsages(self.prefixes))
+        self.assertEqual(len(usages), 10)
+        self.assertEqual(count.call_count, 3)
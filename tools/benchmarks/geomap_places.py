@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Benchmarks geomap's clustering of rooms into places.
+
+Clusters synthetic sets of rooms, spread uniformly over the map's viewport,
+into places as geomap does for every map request.  The time per room should
+stay roughly constant as the number of rooms grows.
+
+"""
+import random
+import sys
+from optparse import OptionParser
+from time import time
+
+from nav.web.geomap.graph import Graph, Node, create_places
+
+BOUNDS = {'minLon': 4.0, 'maxLon': 32.0, 'minLat': 57.0, 'maxLat': 72.0}
+VIEWPORT = {'width': 1280, 'height': 1024}
+
+
+def main():
+    """Main program"""
+    options = parse_options()
+    rand = random.Random(options.seed)
+    print "%8s %8s %10s %12s" % ("rooms", "places", "time", "per room")
+    for count in options.rooms:
+        graph = make_graph(rand, count)
+        start = time()
+        create_places(graph, BOUNDS, VIEWPORT, options.limit)
+        elapsed = time() - start
+        print "%8d %8d %9.3fs %10.2fus" % (count, len(graph.nodes), elapsed,
+                                            elapsed / count * 1e6)
+
+
+def make_graph(rand, count):
+    """Makes a graph of count rooms at random positions within BOUNDS"""
+    graph = Graph()
+    for room_id in xrange(count):
+        graph.add_node(Node(room_id,
+                            rand.uniform(BOUNDS['minLon'], BOUNDS['maxLon']),
+                            rand.uniform(BOUNDS['minLat'], BOUNDS['maxLat']),
+                            {'load': float('nan'), 'num_netboxes': 1}))
+    return graph
+
+
+def parse_options():
+    """Parses the command line"""
+    parser = OptionParser()
+    parser.add_option("-n", "--rooms", default="10000,20000,50000,100000",
+                      help="comma separated list of room counts")
+    parser.add_option("-l", "--limit", type="int", default=30,
+                      help="minimum distance between places, in pixels")
+    parser.add_option("-s", "--seed", type="int", default=0,
+                      help="random seed")
+    options, _args = parser.parse_args()
+    options.rooms = [int(count) for count in options.rooms.split(',')]
+    return options
+
+
+if __name__ == '__main__':
+    sys.exit(main())
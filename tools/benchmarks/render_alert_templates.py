@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Benchmarks eventengine's alert message template rendering.
+
+Renders a number of synthetic boxState alerts using the alert message
+templates from a NAV source tree, with and without the template registry's
+caches.
+
+"""
+import os
+import sys
+from datetime import datetime
+from optparse import OptionParser
+from time import time
+
+from nav.models.manage import Netbox
+from nav.models.event import EventType
+from nav.eventengine import alerts
+
+SOURCE_TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), os.pardir,
+                                   os.pardir, 'etc', 'alertmsg')
+
+
+class FakeAlert(dict):
+    """Mimics the attributes of an AlertGenerator used by templates"""
+    def __init__(self, number):
+        super(FakeAlert, self).__init__()
+        self.netbox = Netbox(id=number, sysname='box%d.example.org' % number,
+                             ip='10.0.%d.%d' % (number // 256, number % 256))
+        self.event_type = EventType(id='boxState')
+        self.alert_type = 'boxDown' if number % 2 else 'boxUp'
+        self.time = datetime.now()
+        self.state = 's'
+        self['alerttype'] = self.alert_type
+
+
+def main():
+    """Main program"""
+    options = parse_options()
+    alerts.ALERT_TEMPLATE_DIR = os.path.abspath(options.directory)
+    fakes = [FakeAlert(number) for number in xrange(options.count)]
+
+    cold = bench(fakes, alerts.clear_template_cache)
+    warm = bench(fakes, lambda: None)
+
+    print "rendered %d alerts" % len(fakes)
+    print "uncached: %8.3fs (%7.1f alerts/s)" % (cold, len(fakes) / cold)
+    print "cached:   %8.3fs (%7.1f alerts/s)" % (warm, len(fakes) / warm)
+
+
+def bench(fakes, before_each):
+    """Renders all alerts, calling before_each before every alert"""
+    alerts.render_templates(fakes[0])
+    start = time()
+    for alert in fakes:
+        before_each()
+        alerts.render_templates(alert)
+    return time() - start
+
+
+def parse_options():
+    """Parses the command line"""
+    parser = OptionParser()
+    parser.add_option("-n", "--count", type="int", default=10000,
+                      help="number of alerts to render")
+    parser.add_option("-d", "--directory", default=SOURCE_TEMPLATE_DIR,
+                      help="alert template directory")
+    options, _args = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2014 UNINETT AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 2 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Benchmarks navtopology's VLAN topology analysis.
+
+Analyzes a number of VLANs on a synthetic layer 2 topology, where a single
+router has a tree of switches below it, connected by trunks that carry all
+VLANs.  The VLANs are analyzed one by one in this process, and then in a
+pool of worker processes.
+
+"""
+import sys
+from optparse import OptionParser
+from time import time
+
+from nav.topology.compact import (CompactLayer2Graph, IfcInfo, RoutedVlan,
+                                  CompactVlanTopologyAnalyzer,
+                                  analyze_routed_vlans, make_vlan_bitset)
+
+ROUTER = 1
+
+
+def main():
+    """Main program"""
+    options = parse_options()
+    graph = make_graph(options.switches, options.fanout, options.vlans)
+    router_port = graph.edge_ifc[graph.edges_from(ROUTER)[0]]
+    routed_vlans = [RoutedVlan(vlan, ROUTER, router_port, ROUTER + 1)
+                    for vlan in xrange(1, options.vlans + 1)]
+
+    start = time()
+    for routed_vlan in routed_vlans:
+        CompactVlanTopologyAnalyzer(routed_vlan, graph).analyze()
+    serial = time() - start
+
+    start = time()
+    for _result in analyze_routed_vlans(graph, {}, routed_vlans,
+                                        options.workers):
+        pass
+    parallel = time() - start
+
+    print "analyzed %d vlans on %d switches" % (len(routed_vlans),
+                                                 options.switches)
+    print "serial:             %8.3fs" % serial
+    print "parallel (%2d procs): %8.3fs (%.1fx)" % (options.workers, parallel,
+                                                    serial / parallel)
+
+
+def make_graph(switches, fanout, vlans):
+    """Makes a tree of switches below a router, connected by trunks"""
+    all_vlans = make_vlan_bitset(xrange(1, vlans + 1))
+    links = []
+    access_vlans = {}
+    ifc_ids = iter(xrange(1, sys.maxint))
+
+    def _link(netbox, parent):
+        up_ifc, down_ifc = ifc_ids.next(), ifc_ids.next()
+        links.append((parent, netbox, down_ifc,
+                      IfcInfo(up_ifc, True, None, all_vlans)))
+        links.append((netbox, parent, up_ifc,
+                      IfcInfo(down_ifc, True, None, all_vlans)))
+
+    _link(ROUTER + 1, ROUTER)
+    for number in xrange(1, switches):
+        netbox = ROUTER + 1 + number
+        _link(netbox, ROUTER + 1 + (number - 1) // fanout)
+        # every switch has an access port on a few of the VLANs
+        access_vlans[netbox] = dict((vlan, [ifc_ids.next()])
+                                    for vlan in xrange(number % 10 + 1,
+                                                       vlans + 1, 10))
+    return CompactLayer2Graph(links, access_vlans)
+
+
+def parse_options():
+    """Parses the command line"""
+    parser = OptionParser()
+    parser.add_option("-s", "--switches", type="int", default=500,
+                      help="number of switches")
+    parser.add_option("-f", "--fanout", type="int", default=4,
+                      help="number of switches below each switch")
+    parser.add_option("-n", "--vlans", type="int", default=1000,
+                      help="number of routed VLANs")
+    parser.add_option("-w", "--workers", type="int", default=4,
+                      help="number of worker processes")
+    options, _args = parser.parse_args()
+    return options
+
+
+if __name__ == '__main__':
+    sys.exit(main())